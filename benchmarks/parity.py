@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Transform parity check
+======================
+migrate_data.py used to map every source row with a Python function; its
+TableMappings now do that work in the source SELECT, and the little left in
+Python runs over whole batches. This checks that the result is unchanged:
+it fills the Contract-Management-System and business-services-hub schemas
+with random rows drawn from edge cases (Unicode, punctuation and blanks in
+names, every status, null and empty values), runs each mapping over them
+and compares the rows with those of the original per-row functions, kept
+below as the reference. Service ids are no longer remapped here (that
+happens on the unified DB, see migration.remap), so the references keep
+the source ids.
+
+Usage:
+    python benchmarks/parity.py --dsn postgresql://postgres@localhost/postgres --rows 5000
+"""
+
+import argparse
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+from psycopg2.extras import RealDictCursor, execute_values
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import schemas
+from postgres import LocalPostgres, recreate_database, drop_database
+
+import migrate_data
+from migration import source_schema
+
+DATABASES = {'contract': 'bench_parity_contract', 'services': 'bench_parity_services'}
+
+NAMES = [
+    'Acme Corp', 'ACME/Widgets Ltd.', '  spaced  out  ', 'a/b/c', 'Al-Noor & Sons (LLC)',
+    "O'Reilly", 'MiXeD_Case_123', 'tab\tand\nnewline', '', '-', '--x--', '100%', 'Zz9',
+    'Café Déjà Vu', 'ŞİRKET İstanbul', 'Straße 5', 'شركة النور', '東京 株式会社',
+    'Ⅻ Roman ²³', 'emoji 🚀 co', 'ǅemal', 'ﬁle', 'ΣΊΣΥΦΟΣ', None,
+]
+CHARS = 'abcXYZ019 /-_.&\'"()[]{}+*?^$|\\ÉéÜüßİıЖж٣²🚀'
+
+SERVICE_STATUSES = list(migrate_data.SERVICE_STATUSES) + ['weird', '', 'ACTIVE', None]
+APPROVAL_STATUSES = ['approved', 'pending', 'rejected', '', None]
+
+# Sample values by source column (anything else is drawn by type)
+SAMPLES = {
+    'status': SERVICE_STATUSES,
+    'approval_status': APPROVAL_STATUSES,
+    'currency': ['USD', 'OMR', '', None],
+    'price_currency': ['USD', 'OMR', '', None],
+    'role': ['provider', 'client', 'admin', None],
+    'slug': ['company-1', '', None],
+}
+TYPE_SAMPLES = {
+    'boolean': [True, False, None],
+    'integer': [0, 3, 60, None],
+    'numeric': [Decimal('0'), Decimal('4.5'), Decimal('10'), None],
+    'jsonb': [None, {}, {'k': 1}, {'city': 'Muscat'}],
+    'ARRAY': [None, [], ['a', 'b']],
+}
+
+
+def random_name(rng):
+    """A name from NAMES, or random characters from CHARS"""
+    if rng.random() < 0.5:
+        return rng.choice(NAMES)
+    return ''.join(rng.choice(CHARS) for _ in range(rng.randint(0, 20)))
+
+
+class Sample:
+    """Random source rows"""
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.profile_ids = [self.uuid() for _ in range(60)]
+        self.company_ids = [self.uuid() for _ in range(60)]
+
+    def uuid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128)))
+
+    def value(self, column, data_type):
+        rng = self.rng
+        if column == 'id':
+            return self.uuid()
+        if column in ('user_id', 'created_by', 'provider_id', 'owner_id'):
+            return rng.choice(self.profile_ids + [None])
+        if column == 'company_id':
+            return rng.choice(self.company_ids + [None])
+        if column in SAMPLES:
+            return rng.choice(SAMPLES[column])
+        if data_type == 'timestamp with time zone':
+            return rng.choice([None, datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=rng.randrange(10**6))])
+        if data_type in TYPE_SAMPLES:
+            return rng.choice(TYPE_SAMPLES[data_type])    # dicts go out as JSON (see migrate_data)
+        return random_name(rng)
+
+    def fill(self, conn, rows):
+        """Insert `rows` random rows into every table of the database behind `conn`"""
+        with conn.cursor() as cur:
+            for table, types in source_schema(conn).items():
+                columns = list(types)
+                values = [[self.value(c, types[c]) for c in columns] for _ in range(rows)]
+                execute_values(cur, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s", values)
+        conn.commit()
+
+
+# The per-row Python mappings migrate_data.py used before the TableMappings,
+# less the service id remaps
+
+def reference_service_status(status):
+    return {
+        'active': 'active', 'inactive': 'inactive', 'draft': 'draft',
+        'pending': 'pending', 'approved': 'active', 'rejected': 'inactive'
+    }.get(status, 'active')
+
+
+def reference_slugify(name):
+    slug = name.lower().replace(' ', '-').replace('/', '-')
+    return ''.join(c if c.isalnum() or c == '-' else '' for c in slug)
+
+
+def reference_contract_profile(sample, row):
+    return row['id'], dict(
+        id=row['user_id'] or row['id'], email=row['email'], full_name=row['full_name'],
+        phone=row['phone'], address=row['address'], preferences=row['preferences'],
+        created_at=row['created_at'], updated_at=row['updated_at']
+    )
+
+
+def reference_hub_profile(sample, row):
+    return row['id'], dict(
+        id=row['id'], email=row['email'], full_name=row['full_name'], phone=row['phone'],
+        country=row['country'], company_id=row['company_id'], is_verified=row['is_verified'],
+        role=row['role'], created_at=row['created_at'], updated_at=row['updated_at']
+    )
+
+
+def reference_contract_company(sample, row):
+    return row['id'], dict(
+        id=row['id'], name=row['name'], slug=row['slug'], description=row['description'],
+        logo_url=row['logo_url'], website=row['website'], email=row['email'], phone=row['phone'],
+        address=row['address'], status='active' if row.get('is_active', True) else 'inactive',
+        created_at=row['created_at'], updated_at=row['updated_at']
+    )
+
+
+def reference_hub_company(sample, row):
+    return row['id'], dict(
+        id=row['id'], name=row['name'],
+        slug=reference_slugify(row['name']) if row['name'] is not None else None,
+        logo_url=row['logo_url'], cr_number=row['cr_number'], vat_number=row['vat_number'],
+        status='active', created_at=row['created_at']
+    )
+
+
+def reference_contract_service(sample, row):
+    return dict(
+        id=row['id'], provider_id=row['created_by'], provider_company_id=row['company_id'],
+        title=row['name'], description=row['description'], category=row['category'],
+        price=row['price_base'], currency=row['price_currency'] or 'USD',
+        duration_minutes=row['duration_minutes'], max_participants=row['max_participants'],
+        status=reference_service_status(row['status']), metadata=row['metadata'] or {},
+        created_at=row['created_at'], updated_at=row['updated_at']
+    )
+
+
+def reference_hub_service(sample, row):
+    status = 'active'
+    if row['status'] != 'active' or (row.get('approval_status') and row['approval_status'] != 'approved'):
+        status = 'pending'
+    return dict(
+        id=row['id'], provider_id=row['provider_id'], title=row['title'], description=row['description'],
+        category=row['category'], price=row['base_price'], currency=row['currency'] or 'USD',
+        location=row['location'], tags=row['tags'], requirements=row['requirements'],
+        cover_image_url=row['cover_image_url'], featured=row['featured'],
+        rating=row['rating'] or 0, review_count=row['review_count'] or 0,
+        booking_count=row['booking_count'] or 0, status=reference_service_status(status),
+        created_at=row['created_at'], updated_at=row['updated_at']
+    )
+
+
+CHECKS = [
+    ('contract', migrate_data.CONTRACT_PROFILES, True, reference_contract_profile),
+    ('services', migrate_data.HUB_PROFILES, True, reference_hub_profile),
+    ('contract', migrate_data.CONTRACT_COMPANIES, True, reference_contract_company),
+    ('services', migrate_data.HUB_COMPANIES, True, reference_hub_company),
+    ('contract', migrate_data.CONTRACT_SERVICES, False, reference_contract_service),
+    ('services', migrate_data.HUB_SERVICES, False, reference_hub_service),
+]
+
+
+def fetch(conn, query):
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(query)
+        return [dict(row) for row in cur]
+
+
+def check(dsn, rows=2000, seed=0, keep=False):
+    """Compare every migrate_data.py mapping with its reference on `rows` random
+    rows per table; returns a list of mismatch descriptions"""
+    sample = Sample(seed)
+    conns = {}
+    mismatches = []
+    try:
+        for source, ddl in (('contract', schemas.CONTRACT), ('services', schemas.SERVICES)):
+            recreate_database(dsn, DATABASES[source], ddl)
+            conns[source] = psycopg2.connect(make_dsn(dsn, dbname=DATABASES[source]))
+            sample.fill(conns[source], rows)
+
+        for source, mapping, keyed, reference in CHECKS:
+            conn = conns[source]
+            compiled = mapping.compile(conn)
+            mapped = compiled.transformer(keyed=keyed)(fetch(conn, compiled.query(keyed=keyed)))
+            expected = [reference(sample, row) for row in fetch(conn, f"SELECT * FROM {mapping.source} ORDER BY id")]
+            label = f"{source}.{mapping.source}"
+            if len(mapped) != len(expected):
+                mismatches.append(f"{label}: {len(mapped)} rows, expected {len(expected)}")
+            for got, want in zip(mapped, expected):
+                if got != want:
+                    mismatches.append(f"{label}: got {got!r}, expected {want!r}")
+            print(f"{'✅' if not any(m.startswith(label) for m in mismatches) else '❌'} {label}: "
+                  f"{len(expected)} rows compared")
+    finally:
+        for conn in conns.values():
+            conn.close()
+        if not keep:
+            for name in DATABASES.values():
+                drop_database(dsn, name)
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check migrate_data.py mappings against the per-row reference")
+    parser.add_argument('--rows', type=int, default=2000, help="random rows per source table")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    parser.add_argument('--dsn', default=os.getenv('BENCHMARK_DSN'),
+                        help="existing server to check on (default: start a throwaway one)")
+    parser.add_argument('--pg-bin', default=None,
+                        help="directory with initdb and pg_ctl for the throwaway server")
+    parser.add_argument('--keep', action='store_true',
+                        help="keep the bench_parity_* databases after the check")
+    args = parser.parse_args()
+
+    server = None
+    dsn = args.dsn
+    if not dsn:
+        try:
+            server = LocalPostgres(args.pg_bin)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(2)
+        dsn = server.start()
+
+    try:
+        mismatches = check(dsn, args.rows, args.seed, args.keep)
+    finally:
+        if server:
+            server.close()
+
+    for mismatch in mismatches[:20]:
+        print(f"   {mismatch}")
+    if mismatches:
+        print(f"\n❌ {len(mismatches)} mismatches")
+        sys.exit(1)
+    print("\n✅ Mappings match the reference")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+A throwaway local Postgres server, and a proxy that counts round trips to it.
+
+LocalPostgres runs initdb into a temporary directory and starts the server on
+a unix socket only, so a benchmark never touches a real project. A server
+can't be initialised as root; use --dsn to point the benchmark at an existing
+local server instead.
+
+RoundTripProxy sits between the migration scripts and the server and reads
+the frontend protocol. Every simple query ('Q') and every extended-protocol
+sync ('S') is one client/server round trip, so counting them per database
+gives the number of times a script waited on the network, whether or not
+pg_stat_statements is installed. It can also hold each round trip back for a
+fixed delay to approximate a remote Supabase project.
+"""
+
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+
+import psycopg2
+from psycopg2.extensions import make_dsn, parse_dsn
+
+# Protocol codes sent in place of a startup packet
+SSL_REQUEST = 80877103
+GSSENC_REQUEST = 80877104
+CANCEL_REQUEST = 80877102
+
+
+def find_pg_bin(pg_bin=None):
+    """Directory holding initdb/pg_ctl: `pg_bin`, $PG_BIN, PATH or pg_config"""
+    for candidate in (pg_bin, os.getenv('PG_BIN')):
+        if candidate:
+            return candidate
+    initdb = shutil.which('initdb')
+    if initdb:
+        return os.path.dirname(initdb)
+    if shutil.which('pg_config'):
+        return subprocess.check_output(['pg_config', '--bindir'], text=True).strip()
+    raise RuntimeError("initdb not found; pass --pg-bin or set PG_BIN (or use --dsn)")
+
+
+class LocalPostgres:
+    """A Postgres server in a temporary directory, stopped and removed on close"""
+
+    def __init__(self, pg_bin=None):
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            raise RuntimeError("initdb refuses to run as root; run as another user or pass --dsn")
+        self.pg_bin = find_pg_bin(pg_bin)
+        self.directory = tempfile.mkdtemp(prefix='migration-bench-')
+        self.data = os.path.join(self.directory, 'data')
+        self.started = False
+
+    def start(self):
+        """Initialise the cluster and start the server; returns its DSN"""
+        subprocess.run([
+            os.path.join(self.pg_bin, 'initdb'), '-D', self.data, '-U', 'postgres',
+            '-A', 'trust', '-E', 'UTF8', '--no-sync'
+        ], check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([
+            os.path.join(self.pg_bin, 'pg_ctl'), '-D', self.data, '-w',
+            '-l', os.path.join(self.directory, 'server.log'),
+            '-o', f"-c listen_addresses='' -k {self.directory}",
+            'start'
+        ], check=True, stdout=subprocess.DEVNULL)
+        self.started = True
+        return make_dsn(dbname='postgres', user='postgres', host=self.directory)
+
+    def close(self):
+        """Stop the server and delete its data directory"""
+        if self.started:
+            subprocess.run([
+                os.path.join(self.pg_bin, 'pg_ctl'), '-D', self.data, '-m', 'fast', 'stop'
+            ], stdout=subprocess.DEVNULL)
+            self.started = False
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class RoundTripProxy:
+    """TCP proxy in front of a Postgres server that counts round trips per database"""
+
+    def __init__(self, dsn, latency_ms=0):
+        params = parse_dsn(dsn)
+        self.params = params
+        self.latency = latency_ms / 1000
+        host = params.get('host') or '/tmp'
+        port = int(params.get('port') or 5432)
+        if host.startswith('/'):
+            self.upstream = (socket.AF_UNIX, os.path.join(host, f".s.PGSQL.{port}"))
+        else:
+            self.upstream = (socket.AF_INET, (host, port))
+
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def dsn(self, dbname):
+        """DSN reaching `dbname` through the proxy"""
+        params = {k: v for k, v in self.params.items() if k not in ('host', 'port', 'dbname')}
+        return make_dsn(dbname=dbname, host='127.0.0.1', port=self.port,
+                        sslmode='disable', gssencmode='disable', **params)
+
+    def snapshot(self):
+        """Round trips so far, per database"""
+        with self._lock:
+            return dict(self.counts)
+
+    def close(self):
+        self._listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            family, address = self.upstream
+            server = socket.socket(family, socket.SOCK_STREAM)
+            server.connect(address)
+            for sock in (client, server):
+                if sock.family == socket.AF_INET:
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._frontend, args=(client, server), daemon=True).start()
+            threading.Thread(target=self._backend, args=(server, client), daemon=True).start()
+
+    def _backend(self, server, client):
+        """Copy server messages to the client unchanged"""
+        try:
+            while True:
+                data = server.recv(65536)
+                if not data:
+                    break
+                client.sendall(data)
+        except OSError:
+            pass
+        finally:
+            client.close()
+
+    def _frontend(self, client, server):
+        """Copy client messages to the server, counting queries and syncs"""
+        try:
+            database = self._startup(client, server)
+            while database is not None:
+                header = _read_exactly(client, 5)
+                if not header:
+                    break
+                kind, length = header[:1], struct.unpack('!i', header[1:])[0]
+                body = _read_exactly(client, length - 4)
+                if kind in (b'Q', b'S'):
+                    with self._lock:
+                        self.counts[database] = self.counts.get(database, 0) + 1
+                    if self.latency:
+                        time.sleep(self.latency)
+                server.sendall(header + body)
+        except OSError:
+            pass
+        finally:
+            server.close()
+
+    def _startup(self, client, server):
+        """Forward the startup packet and return the database it names
+        (None for a cancel request, which ends the connection)"""
+        while True:
+            header = _read_exactly(client, 8)
+            if not header:
+                return None
+            length, code = struct.unpack('!ii', header)
+            body = _read_exactly(client, length - 8)
+            server.sendall(header + body)
+            if code == CANCEL_REQUEST:
+                return None
+            if code in (SSL_REQUEST, GSSENC_REQUEST):
+                # The server's one-byte answer goes back through _backend and the
+                # real startup packet follows
+                continue
+            fields = body.split(b'\0')
+            options = dict(zip(fields[0::2], fields[1::2]))
+            return (options.get(b'database') or options.get(b'user') or b'').decode()
+
+
+def _read_exactly(sock, size):
+    """`size` bytes from `sock`, or b'' if it closed first"""
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return b''
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recreate_database(dsn, name, ddl=None):
+    """Drop and create database `name` on the server at `dsn`, then run `ddl` in it"""
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+        cur.execute(f'CREATE DATABASE "{name}"')
+    admin.close()
+    if ddl:
+        conn = psycopg2.connect(make_dsn(dsn, dbname=name))
+        with conn.cursor() as cur:
+            cur.execute(ddl)
+        conn.commit()
+        conn.close()
+
+
+def drop_database(dsn, name):
+    """Drop database `name` on the server at `dsn` if it exists"""
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    admin.close()
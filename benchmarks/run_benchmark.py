@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+Migration benchmark
+===================
+Runs migrate_data.py and migrate_between_projects.py against synthetic data
+in a local Postgres and reports, per run and per stage, wall time, rows per
+second, peak RSS of the migration process and database round trips.
+
+The target schema mimics the unified Supabase schema (enums, indexes,
+triggers, roles/permissions, user_role_assignments and the user_permissions
+materialized view); see schemas.py. Source tables are filled server-side
+with generate_series, so 10M-row runs don't spend their setup in Python.
+
+Usage:
+    # throwaway server (needs initdb on PATH, --pg-bin or PG_BIN; not as root)
+    python benchmarks/run_benchmark.py --rows 10000 100000 --output bench.json
+
+    # existing local server (bench_* databases are created and dropped)
+    python benchmarks/run_benchmark.py --dsn postgresql://postgres@localhost/postgres
+
+    # fail (exit 1) when throughput drops or round trips grow by more than 10%
+    python benchmarks/run_benchmark.py --compare baseline.json --threshold 10
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+import schemas
+import synthetic
+from postgres import LocalPostgres, RoundTripProxy, recreate_database, drop_database
+
+# Benchmark databases, created on the server under test
+DATABASES = {
+    'contract': 'bench_contract',
+    'services': 'bench_services',
+    'unified': 'bench_unified',
+    'old': 'bench_old',
+    'new': 'bench_new',
+}
+
+# Source tables each stage reads, to turn wall time into rows per second
+STAGE_SOURCES = {
+    'migrate_data': [
+        ('profiles', 'migrate_profiles', [('contract', 'profiles'), ('services', 'profiles')]),
+        ('companies', 'migrate_companies', [('contract', 'companies'), ('services', 'companies')]),
+        ('id_maps', 'ship_id_maps', []),
+        ('services', 'migrate_services', [('contract', 'services'), ('services', 'services')]),
+        ('company_references', 'update_company_references', []),
+    ],
+    'migrate_between_projects': [
+        ('profiles', 'migrate_profiles', [('old', 'profiles')]),
+        ('companies', 'migrate_companies', [('old', 'companies')]),
+        ('services', 'migrate_services', [('old', 'services')]),
+        ('bookings', 'migrate_bookings', [('old', 'bookings')]),
+        ('rbac_roles', 'assign_rbac_roles', [('old', 'profiles')]),
+        ('user_permissions', 'refresh_materialized_view', []),
+    ],
+}
+
+
+def progress(message):
+    """Progress line on stderr, keeping stdout for the JSON report"""
+    print(message, file=sys.stderr, flush=True)
+
+
+class RssSampler:
+    """Peak resident set size of this process, sampled from /proc on a thread
+
+    Falls back to ru_maxrss (peak since process start) where /proc is missing.
+    """
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self.page_size
+        except OSError:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+        return False
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+
+def configure_scripts(proxy, reject_log):
+    """Point the migration scripts at the benchmark databases and import them"""
+    os.environ.update({
+        'CONTRACT_DB_URL': proxy.dsn(DATABASES['contract']),
+        'SERVICES_DB_URL': proxy.dsn(DATABASES['services']),
+        'UNIFIED_DB_URL': proxy.dsn(DATABASES['unified']),
+        'OLD_PROJECT_DB_URL': proxy.dsn(DATABASES['old']),
+        'NEW_PROJECT_DB_URL': proxy.dsn(DATABASES['new']),
+        'MIGRATION_REJECT_LOG': reject_log,
+    })
+    import migrate_data
+    import migrate_between_projects
+    return {'migrate_data': migrate_data, 'migrate_between_projects': migrate_between_projects}
+
+
+def unified_ddl(dsn):
+    """Target schema, with the trigram index when pg_trgm is available"""
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        trgm = cur.fetchone() is not None
+    conn.close()
+    if trgm:
+        return schemas.UNIFIED + "CREATE EXTENSION IF NOT EXISTS pg_trgm;" + schemas.UNIFIED_TRGM
+    return schemas.UNIFIED
+
+
+def reset_target(dsn, name, ddl):
+    """Recreate an empty target database with roles and permissions seeded"""
+    recreate_database(dsn, name, ddl)
+    conn = psycopg2.connect(make_dsn(dsn, dbname=name))
+    with open(os.path.join(REPO_ROOT, 'SEED_ROLES_AND_PERMISSIONS.sql')) as f, conn.cursor() as cur:
+        cur.execute(f.read())
+    conn.commit()
+    conn.close()
+
+
+def prepare_sources(dsn, script, rows):
+    """Create and fill the source databases of `script` with `rows` profiles each"""
+    if script == 'migrate_data':
+        sources = [('contract', schemas.CONTRACT, synthetic.CONTRACT),
+                   ('services', schemas.SERVICES, synthetic.SERVICES)]
+    else:
+        sources = [('old', schemas.OLD, synthetic.OLD)]
+    for source, ddl, tables in sources:
+        recreate_database(dsn, DATABASES[source], ddl)
+        conn = psycopg2.connect(make_dsn(dsn, dbname=DATABASES[source]))
+        synthetic.populate(conn, tables, rows)
+        conn.close()
+
+
+def target_counts(dsn, target):
+    """Row counts of the migrated tables"""
+    conn = psycopg2.connect(make_dsn(dsn, dbname=DATABASES[target]))
+    counts = {}
+    with conn.cursor() as cur:
+        for table in ('profiles', 'companies', 'services', 'bookings',
+                      'user_role_assignments', 'user_permissions'):
+            cur.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = cur.fetchone()[0]
+    conn.close()
+    return counts
+
+
+def measure(proxy, rows, fn):
+    """Run `fn` and return its wall time, peak RSS and round trips"""
+    before = proxy.snapshot()
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        fn()
+        wall = time.perf_counter() - started
+    after = proxy.snapshot()
+    round_trips = {db: after[db] - before.get(db, 0) for db in after if after[db] != before.get(db, 0)}
+    return {
+        'rows': rows,
+        'wall_seconds': round(wall, 4),
+        'rows_per_second': round(rows / wall, 1) if rows and wall else None,
+        'peak_rss_mb': round(rss.peak / 2**20, 1),
+        'round_trips': sum(round_trips.values()),
+        'round_trips_by_db': round_trips,
+    }
+
+
+def run_script(module, script, rows, args, proxy):
+    """One migration run of `script`, measured per stage"""
+    sizes = synthetic.table_sizes(rows)
+    stages = STAGE_SOURCES[script]
+    state = module.MigrationState()
+    if script == 'migrate_data':
+        migrator = module.DataMigrator(batch_size=args.batch_size, state=state, pipeline=args.pipeline,
+                                       adaptive_batches=args.adaptive_batches)
+    else:
+        migrator = module.CrossProjectMigrator(batch_size=args.batch_size, bulk_copy=args.bulk_copy,
+                                               state=state,
+                                               pipeline_writers=args.pipeline_writers if args.pipeline else 0,
+                                               adaptive_batches=args.adaptive_batches)
+    migrator.metrics.progress_seconds = 0
+
+    results = []
+    # RBAC assignment re-reads the migrated profiles; count each source row once
+    total_rows = sum(sizes[table] for name, _, sources in stages if name != 'rbac_roles'
+                     for _, table in sources)
+
+    def run_all():
+        migrator.connect()
+        try:
+            if args.workers > 1:
+                results.append(dict(name='parallel', **measure(
+                    proxy, total_rows, lambda: migrator.run_parallel(args.workers, args.chunks or args.workers))))
+            else:
+                for name, method, sources in stages:
+                    stage_rows = sum(sizes[table] for _, table in sources)
+                    results.append(dict(name=name, **measure(proxy, stage_rows, getattr(migrator, method))))
+            if script == 'migrate_data':
+                migrator.drop_id_map_tables()
+            migrator.save_state()
+        finally:
+            migrator.close()
+
+    run = measure(proxy, total_rows, run_all)
+    run['stages'] = results
+    run['metrics'] = migrator.metrics.to_dict()
+    return run
+
+
+def git_revision():
+    """Current commit and whether the work tree has uncommitted changes"""
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, text=True,
+                                           stderr=subprocess.DEVNULL).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                             cwd=REPO_ROOT, text=True, stderr=subprocess.DEVNULL).strip())
+        return revision, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def server_version(dsn):
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cur:
+        cur.execute("SHOW server_version")
+        version = cur.fetchone()[0]
+    conn.close()
+    return version
+
+
+def run_benchmark(args, dsn):
+    """Run every script at every scale and return the report"""
+    revision, dirty = git_revision()
+    report = {
+        'benchmark': 'migration',
+        'version': 1,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'git': {'revision': revision, 'dirty': dirty},
+        'python': platform.python_version(),
+        'postgres': server_version(dsn),
+        'config': {
+            'batch_size': args.batch_size,
+            'workers': args.workers,
+            'chunks': args.chunks,
+            'bulk_copy': args.bulk_copy,
+            'pipeline': args.pipeline,
+            'pipeline_writers': args.pipeline_writers if args.pipeline else None,
+            'adaptive_batches': args.adaptive_batches,
+            'latency_ms': args.latency_ms,
+            'repeat': args.repeat,
+        },
+        'runs': [],
+    }
+
+    proxy = RoundTripProxy(dsn, latency_ms=args.latency_ms)
+    reject_log = os.path.join(tempfile.gettempdir(), 'migration-bench-rejects.jsonl')
+    modules = configure_scripts(proxy, reject_log)
+    ddl = unified_ddl(dsn)
+    log = open(args.log, 'a') if args.log else open(os.devnull, 'w')
+
+    try:
+        for rows in args.rows:
+            for script in args.scripts:
+                progress(f"📦 {script}: generating {rows:,} rows per source table...")
+                prepare_sources(dsn, script, rows)
+                target = 'unified' if script == 'migrate_data' else 'new'
+                for attempt in range(1, args.repeat + 1):
+                    reset_target(dsn, DATABASES[target], ddl)
+                    with contextlib.redirect_stdout(log):
+                        run = run_script(modules[script], script, rows, args, proxy)
+                    run = dict(script=script, scale=rows, attempt=attempt, **run)
+                    run['target_rows'] = target_counts(dsn, target)
+                    report['runs'].append(run)
+                    progress(f"⏱️  {script} x{rows:,} #{attempt}: {run['wall_seconds']:.2f}s, "
+                          f"{run['rows_per_second'] or 0:,.0f} rows/s, {run['peak_rss_mb']} MB, "
+                          f"{run['round_trips']:,} round trips")
+                    for stage in run['stages']:
+                        progress(f"     {stage['name']:<20} {stage['wall_seconds']:>9.2f}s "
+                              f"{stage['rows_per_second'] or 0:>12,.0f} rows/s "
+                              f"{stage['peak_rss_mb']:>8} MB {stage['round_trips']:>10,} round trips")
+    finally:
+        log.close()
+        proxy.close()
+        if not args.keep:
+            for name in DATABASES.values():
+                drop_database(dsn, name)
+    return report
+
+
+def summarize(report):
+    """Median of each metric per (script, scale, stage) across repeats"""
+    groups = {}
+    for run in report['runs']:
+        key = (run['script'], run['scale'])
+        groups.setdefault(key + ('total',), []).append(run)
+        for stage in run['stages']:
+            groups.setdefault(key + (stage['name'],), []).append(stage)
+
+    summary = {}
+    for key, entries in groups.items():
+        summary[key] = {
+            metric: statistics.median(e[metric] for e in entries)
+            for metric in ('wall_seconds', 'rows_per_second', 'round_trips', 'peak_rss_mb')
+            if all(e[metric] is not None for e in entries)
+        }
+    return summary
+
+
+def compare(report, baseline, threshold):
+    """Print the change from `baseline` and return the regressions found
+
+    A regression is lower throughput (rows/s, or wall time for stages that
+    read no rows) or more round trips by more than `threshold` percent.
+    """
+    current, previous = summarize(report), summarize(baseline)
+    regressions = []
+    print(f"\n📊 Compared with {baseline['git']['revision'] or 'baseline'} (threshold {threshold}%)")
+    if report['config'] != baseline['config']:
+        print(f"⚠️  Configurations differ: {baseline['config']} → {report['config']}")
+    for key in sorted(current):
+        if key not in previous:
+            continue
+        now, then = current[key], previous[key]
+        label = f"{key[0]} x{key[1]:,} {key[2]}"
+        checks = [('rows_per_second', -1), ('round_trips', 1)]
+        if 'rows_per_second' not in now:
+            checks[0] = ('wall_seconds', 1)
+        changes = []
+        for metric, worse in checks:
+            if metric not in now or metric not in then or not then[metric]:
+                continue
+            delta = (now[metric] - then[metric]) / then[metric] * 100
+            changes.append(f"{metric} {delta:+.1f}%")
+            if delta * worse > threshold:
+                regressions.append(f"{label}: {metric} {then[metric]:,} → {now[metric]:,} ({delta:+.1f}%)")
+        print(f"   {label:<50} {', '.join(changes)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the migration scripts against a local Postgres")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000],
+                        help="profiles per source table; other tables scale with it "
+                             "(several values run several scales, e.g. 10000 1000000 10000000)")
+    parser.add_argument('--scripts', nargs='+', choices=sorted(STAGE_SOURCES), default=sorted(STAGE_SOURCES),
+                        help="scripts to benchmark (default: both)")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="runs per script and scale; comparisons use the median")
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('MIGRATION_BATCH_SIZE', '1000')),
+                        help="rows per set-based write (1 = row by row)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="run stages in parallel (measured as one 'parallel' stage)")
+    parser.add_argument('--chunks', type=int, default=None,
+                        help="id ranges per large table with --workers (default: --workers)")
+    parser.add_argument('--bulk-copy', action='store_true',
+                        help="use migrate_between_projects.py --bulk-copy")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="overlap reads and writes (the scripts' --pipeline)")
+    parser.add_argument('--pipeline-writers', type=int, default=1,
+                        help="writer connections per table for migrate_between_projects.py --pipeline")
+    parser.add_argument('--adaptive-batches', action='store_true',
+                        help="tune batch sizes from write latency (the scripts' --adaptive-batches)")
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help="delay added to every round trip, to approximate a remote database")
+    parser.add_argument('--dsn', default=os.getenv('BENCHMARK_DSN'),
+                        help="existing server to benchmark on (default: start a throwaway one)")
+    parser.add_argument('--pg-bin', default=None,
+                        help="directory with initdb and pg_ctl for the throwaway server")
+    parser.add_argument('--output', default=None,
+                        help="write the JSON report here (default: stdout)")
+    parser.add_argument('--log', default=None,
+                        help="append the migration scripts' output to this file")
+    parser.add_argument('--compare', default=None, metavar='BASELINE',
+                        help="JSON report of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=10,
+                        help="percent change counted as a regression with --compare")
+    parser.add_argument('--keep', action='store_true',
+                        help="keep the bench_* databases after the run")
+    args = parser.parse_args()
+
+    server = None
+    dsn = args.dsn
+    if not dsn:
+        try:
+            server = LocalPostgres(args.pg_bin)
+        except RuntimeError as e:
+            progress(f"❌ {e}")
+            sys.exit(2)
+        dsn = server.start()
+
+    try:
+        report = run_benchmark(args, dsn)
+    finally:
+        if server:
+            server.close()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        progress(f"💾 Report written to {args.output}")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print("\n❌ Regressions:")
+            for regression in regressions:
+                print(f"   {regression}")
+            sys.exit(1)
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
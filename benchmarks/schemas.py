@@ -0,0 +1,276 @@
+"""
+Source and target schemas for the migration benchmark.
+
+The unified (target) schema follows UNIFIED_SCHEMA_MIGRATION.sql: the same
+enums, secondary indexes, updated_at triggers, RBAC tables, notify trigger on
+user_role_assignments and the user_permissions materialized view with its
+unique index. Columns are the ones the migration scripts write, and the
+Supabase auth.users foreign key and RLS policies are left out so the schema
+loads into a plain Postgres. Roles and permissions are seeded from
+SEED_ROLES_AND_PERMISSIONS.sql.
+"""
+
+ENUMS = """
+CREATE TYPE user_status_type AS ENUM ('active', 'inactive', 'suspended');
+CREATE TYPE service_status_type AS ENUM ('active', 'inactive', 'draft', 'archived', 'pending', 'suspended');
+CREATE TYPE booking_status_type AS ENUM (
+    'draft', 'pending', 'pending_payment', 'paid', 'confirmed', 'in_progress',
+    'delivered', 'completed', 'cancelled', 'refunded', 'disputed'
+);
+"""
+
+UNIFIED = ENUMS + """
+CREATE TABLE profiles (
+    id UUID PRIMARY KEY,
+    email TEXT NOT NULL,
+    full_name TEXT,
+    name TEXT,
+    phone TEXT,
+    avatar_url TEXT,
+    company_name TEXT,
+    company_id UUID,
+    address JSONB,
+    preferences JSONB DEFAULT '{}',
+    country TEXT,
+    is_verified BOOLEAN DEFAULT false,
+    role TEXT DEFAULT 'client' CHECK (role IN ('client', 'provider', 'admin', 'staff', 'manager', 'enterprise_admin', 'enterprise_employee')),
+    status user_status_type DEFAULT 'active',
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    CONSTRAINT profiles_email_unique UNIQUE (email)
+);
+CREATE INDEX idx_profiles_email ON profiles(email);
+CREATE INDEX idx_profiles_role ON profiles(role);
+CREATE INDEX idx_profiles_status ON profiles(status);
+CREATE INDEX idx_profiles_company_id ON profiles(company_id);
+
+CREATE TABLE companies (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    owner_id UUID REFERENCES profiles(id) ON DELETE SET NULL,
+    name TEXT NOT NULL,
+    slug TEXT UNIQUE,
+    description TEXT,
+    cr_number TEXT,
+    vat_number TEXT,
+    logo_url TEXT,
+    website TEXT,
+    email TEXT,
+    phone TEXT,
+    address JSONB,
+    settings JSONB DEFAULT '{}',
+    status TEXT DEFAULT 'active',
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX idx_companies_owner_id ON companies(owner_id);
+CREATE INDEX idx_companies_slug ON companies(slug);
+CREATE INDEX idx_companies_cr_number ON companies(cr_number);
+
+CREATE TABLE services (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    provider_id UUID REFERENCES profiles(id) ON DELETE CASCADE,
+    provider_company_id UUID REFERENCES companies(id) ON DELETE SET NULL,
+    title TEXT,
+    description TEXT,
+    category TEXT,
+    price NUMERIC(12,3),
+    currency TEXT DEFAULT 'OMR' CHECK (currency IN ('OMR', 'USD', 'EUR', 'GBP', 'AED')),
+    duration_minutes INTEGER,
+    max_participants INTEGER DEFAULT 1,
+    location TEXT,
+    tags TEXT[],
+    requirements TEXT,
+    cover_image_url TEXT,
+    status service_status_type DEFAULT 'pending',
+    featured BOOLEAN DEFAULT false,
+    rating NUMERIC(3,2) DEFAULT 0,
+    review_count INTEGER DEFAULT 0,
+    booking_count INTEGER DEFAULT 0,
+    metadata JSONB DEFAULT '{}',
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX idx_services_provider_id ON services(provider_id);
+CREATE INDEX idx_services_provider_company_id ON services(provider_company_id);
+CREATE INDEX idx_services_category ON services(category);
+CREATE INDEX idx_services_status ON services(status);
+CREATE INDEX idx_services_featured ON services(featured);
+
+CREATE TABLE bookings (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    client_id UUID REFERENCES profiles(id) ON DELETE SET NULL,
+    provider_id UUID REFERENCES profiles(id) ON DELETE SET NULL,
+    provider_company_id UUID REFERENCES companies(id) ON DELETE SET NULL,
+    service_id UUID REFERENCES services(id) ON DELETE SET NULL,
+    package_id UUID,
+    status booking_status_type DEFAULT 'pending',
+    scheduled_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX idx_bookings_client_id ON bookings(client_id);
+CREATE INDEX idx_bookings_provider_id ON bookings(provider_id);
+CREATE INDEX idx_bookings_service_id ON bookings(service_id);
+CREATE INDEX idx_bookings_status ON bookings(status);
+
+CREATE TABLE roles (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    name TEXT UNIQUE NOT NULL,
+    category TEXT NOT NULL CHECK (category IN ('client', 'provider', 'admin', 'system')),
+    description TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE permissions (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    resource TEXT NOT NULL,
+    action TEXT NOT NULL,
+    scope TEXT NOT NULL CHECK (scope IN ('own', 'provider', 'organization', 'booking', 'public', 'all')),
+    name TEXT UNIQUE NOT NULL,
+    description TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE role_permissions (
+    role_id UUID REFERENCES roles(id) ON DELETE CASCADE,
+    permission_id UUID REFERENCES permissions(id) ON DELETE CASCADE,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (role_id, permission_id)
+);
+
+CREATE TABLE user_role_assignments (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    role_id UUID REFERENCES roles(id) ON DELETE CASCADE,
+    assigned_by UUID REFERENCES profiles(id),
+    context JSONB DEFAULT '{}',
+    valid_from TIMESTAMPTZ DEFAULT NOW(),
+    valid_until TIMESTAMPTZ NULL,
+    is_active BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX idx_user_role_assignments_user_id ON user_role_assignments(user_id);
+CREATE INDEX idx_user_role_assignments_role_id ON user_role_assignments(role_id);
+CREATE INDEX idx_user_role_assignments_user_active ON user_role_assignments(user_id, is_active);
+
+CREATE MATERIALIZED VIEW user_permissions AS
+SELECT
+    ura.user_id,
+    p.resource,
+    p.action,
+    p.scope,
+    p.name AS permission_name,
+    r.name AS role_name,
+    r.category AS role_category,
+    ura.valid_from,
+    ura.valid_until,
+    ura.is_active
+FROM user_role_assignments ura
+JOIN roles r ON ura.role_id = r.id
+JOIN role_permissions rp ON r.id = rp.role_id
+JOIN permissions p ON rp.permission_id = p.id
+WHERE ura.is_active = TRUE
+AND (ura.valid_until IS NULL OR ura.valid_until > CURRENT_TIMESTAMP);
+
+CREATE INDEX idx_user_permissions_user_id ON user_permissions(user_id);
+CREATE INDEX idx_user_permissions_resource_action ON user_permissions(resource, action);
+CREATE UNIQUE INDEX user_permissions_unique_idx ON user_permissions (user_id, permission_name);
+
+CREATE OR REPLACE FUNCTION update_updated_at_column()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_profiles_updated_at BEFORE UPDATE ON profiles
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+CREATE TRIGGER update_companies_updated_at BEFORE UPDATE ON companies
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+CREATE TRIGGER update_services_updated_at BEFORE UPDATE ON services
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+CREATE TRIGGER update_bookings_updated_at BEFORE UPDATE ON bookings
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+CREATE OR REPLACE FUNCTION refresh_user_permissions_on_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('refresh_user_permissions', '');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_refresh_user_permissions
+    AFTER INSERT OR UPDATE OR DELETE ON user_role_assignments
+    FOR EACH ROW EXECUTE FUNCTION refresh_user_permissions_on_change();
+"""
+
+# Built only when the pg_trgm extension is available
+UNIFIED_TRGM = """
+CREATE INDEX idx_services_title_trgm ON services USING gin(title gin_trgm_ops);
+"""
+
+# Contract-Management-System (migrate_data.py source)
+CONTRACT = """
+CREATE TABLE profiles (
+    id UUID PRIMARY KEY, user_id UUID, email TEXT, full_name TEXT, avatar_url TEXT, phone TEXT,
+    address JSONB, preferences JSONB, created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ
+);
+CREATE TABLE companies (
+    id UUID PRIMARY KEY, name TEXT, slug TEXT, description TEXT, logo_url TEXT, website TEXT,
+    email TEXT, phone TEXT, address JSONB, settings JSONB, is_active BOOLEAN,
+    created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ
+);
+CREATE TABLE services (
+    id UUID PRIMARY KEY, company_id UUID, name TEXT, description TEXT, category TEXT,
+    price_base NUMERIC, price_currency TEXT, duration_minutes INT, max_participants INT,
+    status TEXT, metadata JSONB, created_by UUID, created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ
+);
+"""
+
+# business-services-hub (migrate_data.py source)
+SERVICES = """
+CREATE TABLE profiles (
+    id UUID PRIMARY KEY, email TEXT, full_name TEXT, phone TEXT, country TEXT, company_id UUID,
+    is_verified BOOLEAN, role TEXT, created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ
+);
+CREATE TABLE companies (
+    id UUID PRIMARY KEY, owner_id UUID, name TEXT, cr_number TEXT, vat_number TEXT,
+    logo_url TEXT, created_at TIMESTAMPTZ
+);
+CREATE TABLE services (
+    id UUID PRIMARY KEY, provider_id UUID, title TEXT, description TEXT, category TEXT,
+    base_price NUMERIC, currency TEXT, estimated_duration TEXT, location TEXT, tags TEXT[],
+    requirements TEXT, cover_image_url TEXT, status TEXT, approval_status TEXT, featured BOOLEAN,
+    rating NUMERIC, review_count INT, booking_count INT, created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ
+);
+"""
+
+# Old Supabase project (migrate_between_projects.py source)
+OLD = """
+CREATE TABLE profiles (
+    id UUID PRIMARY KEY, email TEXT, full_name TEXT, first_name TEXT, last_name TEXT, phone TEXT,
+    avatar_url TEXT, profile_image_url TEXT, company_name TEXT, company TEXT, country TEXT,
+    is_verified BOOLEAN, role TEXT, status TEXT, created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ
+);
+CREATE TABLE companies (
+    id UUID PRIMARY KEY, name TEXT, slug TEXT, description TEXT, logo_url TEXT, website TEXT,
+    email TEXT, phone TEXT, address JSONB, cr_number TEXT, vat_number TEXT, owner_id UUID,
+    is_active BOOLEAN, created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ
+);
+CREATE TABLE services (
+    id UUID PRIMARY KEY, provider_id UUID, company_id UUID, title TEXT, name TEXT, description TEXT,
+    category TEXT, price NUMERIC, base_price NUMERIC, price_base NUMERIC, currency TEXT,
+    price_currency TEXT, location TEXT, tags TEXT[], requirements TEXT, cover_image_url TEXT,
+    featured BOOLEAN, is_featured BOOLEAN, rating NUMERIC, review_count INT, booking_count INT,
+    status TEXT, approval_status TEXT, created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ
+);
+CREATE TABLE bookings (
+    id UUID PRIMARY KEY, client_id UUID, user_id UUID, provider_id UUID, provider_company_id UUID,
+    service_id UUID, package_id UUID, status TEXT, scheduled_at TIMESTAMPTZ,
+    scheduled_start TIMESTAMPTZ, start_time TIMESTAMPTZ, created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ
+);
+"""
@@ -0,0 +1,157 @@
+"""
+Synthetic source data, generated server-side with generate_series.
+
+`rows` is the number of profiles in each source; the other tables scale with
+it (companies = rows / 10, services = rows, bookings = 2 * rows). Ids are
+md5 hashes of a per-table prefix and the row number, so they are spread over
+the whole UUID keyspace like v4 ids but identical between runs. Half of the
+business-services-hub profiles share an email with a Contract-Management-System
+profile and a third of its companies share a name, so the merge paths of
+migrate_data.py are exercised, and statuses/roles cover the mapped values.
+"""
+
+
+def table_sizes(rows):
+    """Rows per source table for a benchmark of `rows` profiles per source"""
+    companies = max(4, rows // 10)
+    return {'profiles': rows, 'companies': companies, 'services': rows, 'bookings': rows * 2}
+
+
+def uuid_expr(prefix, number):
+    """SQL expression for the deterministic id of row `number` of `prefix`"""
+    return f"md5('{prefix}' || ({number}))::uuid"
+
+
+TIMESTAMP = "(timestamptz '2024-01-01' + mod(i, 525600) * interval '1 minute')"
+
+CONTRACT = {
+    'profiles': f"""
+        INSERT INTO profiles
+        SELECT {uuid_expr('cp', 'i')},
+               CASE WHEN mod(i, 3) = 0 THEN {uuid_expr('cu', 'i')} END,
+               'user' || i || '@example.com',
+               CASE WHEN mod(i, 7) <> 0 THEN 'Contract User ' || i END,
+               NULL,
+               '+968' || i,
+               CASE WHEN mod(i, 2) = 1 THEN jsonb_build_object('city', 'Muscat') END,
+               jsonb_build_object('lang', 'en'),
+               {TIMESTAMP}, {TIMESTAMP} + interval '1 day'
+        FROM generate_series(1, %(profiles)s) i
+    """,
+    'companies': f"""
+        INSERT INTO companies
+        SELECT {uuid_expr('cc', 'i')}, 'Company ' || i, 'company-' || i,
+               CASE WHEN mod(i, 2) = 1 THEN 'Contract company ' || i END,
+               NULL, NULL, 'info' || i || '@example.com', NULL, NULL, NULL,
+               mod(i, 3) <> 0, {TIMESTAMP}, {TIMESTAMP}
+        FROM generate_series(1, %(companies)s) i
+    """,
+    'services': f"""
+        INSERT INTO services
+        SELECT {uuid_expr('cs', 'i')},
+               CASE WHEN mod(i, 5) <> 0 THEN {uuid_expr('cc', '1 + mod(i, %(companies)s)')} END,
+               'Contract service ' || i, 'Service description ' || i, 'consulting',
+               10 + mod(i, 500), CASE WHEN mod(i, 2) = 0 THEN 'OMR' END, 60, 2,
+               (ARRAY['active', 'inactive', 'draft', 'pending', 'approved', 'rejected', 'weird'])[1 + mod(i, 7)],
+               CASE WHEN mod(i, 3) <> 0 THEN jsonb_build_object('k', i) END,
+               {uuid_expr('cp', '1 + mod(i, %(profiles)s)')},
+               {TIMESTAMP}, {TIMESTAMP}
+        FROM generate_series(1, %(services)s) i
+    """,
+}
+
+SERVICES = {
+    'profiles': f"""
+        INSERT INTO profiles
+        SELECT {uuid_expr('sp', 'i')},
+               CASE WHEN i <= %(profiles)s / 2 THEN 'user' || i ELSE 'hub' || i END || '@example.com',
+               CASE WHEN mod(i, 5) <> 0 THEN 'Hub User ' || i END,
+               CASE WHEN mod(i, 4) <> 0 THEN '+1' || i END,
+               CASE WHEN mod(i, 2) = 1 THEN 'OM' END,
+               NULL, mod(i, 2) = 1,
+               (ARRAY['provider', 'client', 'admin'])[1 + mod(i, 3)],
+               {TIMESTAMP}, {TIMESTAMP} + interval '2 days'
+        FROM generate_series(1, %(profiles)s) i
+    """,
+    'companies': f"""
+        INSERT INTO companies
+        SELECT {uuid_expr('sc', 'i')}, {uuid_expr('sp', '1 + mod(i, %(profiles)s)')},
+               CASE WHEN mod(i, 3) = 0 THEN 'Company ' || i ELSE 'Hub Company ' || i END,
+               'CR' || i, NULL, NULL, {TIMESTAMP}
+        FROM generate_series(1, %(companies)s) i
+    """,
+    'services': f"""
+        INSERT INTO services
+        SELECT {uuid_expr('ss', 'i')}, {uuid_expr('sp', '1 + mod(i, %(profiles)s)')},
+               'Hub service ' || i, 'Description ' || i, 'design',
+               5 + mod(i, 300), CASE WHEN mod(i, 3) = 0 THEN 'USD' END, NULL, 'Muscat',
+               ARRAY['a', 'b'], NULL, NULL,
+               (ARRAY['active', 'inactive', 'draft', 'pending', 'approved', 'rejected', 'weird'])[1 + mod(i, 7)],
+               (ARRAY['approved', 'pending', NULL])[1 + mod(i, 3)],
+               mod(i, 2) = 1, CASE WHEN mod(i, 2) = 0 THEN 4.5 END, NULL, 3,
+               {TIMESTAMP}, {TIMESTAMP}
+        FROM generate_series(1, %(services)s) i
+    """,
+}
+
+OLD = {
+    'profiles': f"""
+        INSERT INTO profiles
+        SELECT {uuid_expr('op', 'i')}, 'user' || i || '@example.com',
+               CASE WHEN mod(i, 4) <> 0 THEN 'Full Name ' || i END,
+               'First', 'Last' || i, NULL, NULL, 'https://example.com/' || i || '.png',
+               NULL, 'Company', 'OM',
+               CASE WHEN mod(i, 5) <> 0 THEN TRUE END,
+               (ARRAY['promoter', 'user', 'admin', 'provider', 'client', NULL])[1 + mod(i, 6)],
+               (ARRAY['pending', 'approved', 'active', 'suspended', 'deleted', NULL])[1 + mod(i, 6)],
+               {TIMESTAMP}, {TIMESTAMP}
+        FROM generate_series(1, %(profiles)s) i
+    """,
+    'companies': f"""
+        INSERT INTO companies
+        SELECT {uuid_expr('oc', 'i')}, 'Old Company ' || i,
+               CASE WHEN mod(i, 2) = 0 THEN 'old-company-' || i END,
+               NULL, NULL, NULL, NULL, NULL, NULL, 'CR' || i, NULL,
+               {uuid_expr('op', '1 + mod(i, %(profiles)s)')},
+               CASE WHEN mod(i, 3) <> 0 THEN mod(i, 2) = 1 END,
+               {TIMESTAMP}, {TIMESTAMP}
+        FROM generate_series(1, %(companies)s) i
+    """,
+    'services': f"""
+        INSERT INTO services
+        SELECT {uuid_expr('os', 'i')}, {uuid_expr('op', '1 + mod(i, %(profiles)s)')},
+               CASE WHEN mod(i, 4) <> 0 THEN {uuid_expr('oc', '1 + mod(i, %(companies)s)')} END,
+               CASE WHEN mod(i, 2) = 0 THEN 'Title ' || i END, 'Name ' || i, NULL, 'consulting',
+               NULL, CASE WHEN mod(i, 3) <> 0 THEN 9 + mod(i, 400) END, NULL, NULL,
+               CASE WHEN mod(i, 2) = 1 THEN 'OMR' END, NULL, NULL, NULL, NULL, NULL,
+               CASE WHEN mod(i, 2) = 0 THEN TRUE END, NULL, NULL, NULL,
+               (ARRAY['active', 'pending', 'inactive', 'archived', 'draft', 'x', NULL])[1 + mod(i, 7)],
+               (ARRAY['approved', 'pending', NULL])[1 + mod(i, 3)],
+               {TIMESTAMP}, {TIMESTAMP}
+        FROM generate_series(1, %(services)s) i
+    """,
+    'bookings': f"""
+        INSERT INTO bookings
+        SELECT {uuid_expr('ob', 'i')},
+               CASE WHEN mod(i, 3) <> 0 THEN {uuid_expr('op', '1 + mod(i, %(profiles)s)')} END,
+               {uuid_expr('op', '1 + mod(i + 1, %(profiles)s)')},
+               {uuid_expr('op', '1 + mod(i + 2, %(profiles)s)')},
+               CASE WHEN mod(i, 2) = 1 THEN {uuid_expr('oc', '1 + mod(i, %(companies)s)')} END,
+               {uuid_expr('os', '1 + mod(i, %(services)s)')}, NULL,
+               (ARRAY['approved', 'pending', 'in_progress', 'completed', 'cancelled',
+                      'declined', 'confirmed', 'draft', 'zzz', NULL])[1 + mod(i, 10)],
+               CASE WHEN mod(i, 2) = 1 THEN {TIMESTAMP} END,
+               {TIMESTAMP}, {TIMESTAMP}, {TIMESTAMP}, {TIMESTAMP}
+        FROM generate_series(1, %(bookings)s) i
+    """,
+}
+
+
+def populate(conn, tables, rows):
+    """Fill the source tables described by `tables` (CONTRACT, SERVICES or OLD)"""
+    sizes = table_sizes(rows)
+    with conn.cursor() as cur:
+        for table, query in tables.items():
+            cur.execute(query, sizes)
+        cur.execute("ANALYZE")
+    conn.commit()
@@ -10,17 +10,37 @@ Requirements:
 Usage:
     1. Create a .env file with both database connection strings
     2. Run: python migrate_between_projects.py
+       (add --bulk-copy for a first-time load into an empty project,
+        --workers 4 to migrate independent tables in parallel,
+        --pipeline to overlap reading the old project with writing the new one,
+        --bulk-load to defer index and trigger upkeep to the end of a large load;
+        --extract DIR saves the old project to a local snapshot that --load DIR
+        replays, for rehearsing the load without reading the old project;
+        --sync keeps applying the old project's changes after the full load)
 """
 
 import os
 import sys
+import time
 import psycopg2
 from psycopg2.extras import execute_values, RealDictCursor
 from psycopg2 import sql
 from dotenv import load_dotenv
+from migration import (
+    stream_rows, where_clause, copy_between, Stage, run_stages, key_range_condition,
+    MigrationState, changed_since_condition, after_key_condition,
+    RowTransaction, RejectLog, COMMIT_ROWS, Metrics, measured, estimate_rows, write_batches,
+    TableMapping, Column, Sql, prepared_statements, IdMap, Check, Verifier, verified, VERIFY_WORKERS,
+    ship_id_map, drop_id_maps, BulkLoad, BULK_SESSION, Snapshot, SnapshotWriter, source_schema,
+    ChangeStream, Change, Commit, Truncate, create_replication, drop_replication,
+    SYNC_SLOT, SYNC_PUBLICATION, SYNC_BATCH_ROWS, SYNC_BATCH_SECONDS, SYNC_IDLE_CONFIRM_SECONDS,
+    Profiler
+)
 from uuid import UUID
-from datetime import datetime
+from datetime import datetime, timezone
 import json
+import argparse
+from functools import partial
 
 # Load environment variables
 load_dotenv()
@@ -29,31 +49,170 @@ load_dotenv()
 OLD_PROJECT_DB_URL = os.getenv('OLD_PROJECT_DB_URL')  # Old Supabase project
 NEW_PROJECT_DB_URL = os.getenv('NEW_PROJECT_DB_URL')  # New unified Supabase project
 
+# Rows per batch; source rows are fetched from the old project at least this many at a time
+BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '1000'))
+
+# Profiles of this run, shipped to the new project to scope RBAC assignment
+RBAC_PROFILES_TABLE = 'migration_rbac_profiles'
+
+# Tables whose secondary indexes and triggers are set aside by --bulk-load
+BULK_LOAD_TABLES = ['profiles', 'companies', 'services', 'bookings']
+
+# Old project tables → unified columns (fallback columns the old table lacks are skipped)
+PROFILES = TableMapping('profiles', [
+    Column('id'),
+    Column('email'),
+    Column('full_name', 'full_name',
+           Sql("CONCAT(first_name, ' ', last_name)", 'first_name', 'last_name'),
+           Sql("split_part(email, '@', 1)", 'email')),
+    Column('phone'),
+    Column('avatar_url', 'avatar_url', 'profile_image_url'),
+    Column('company_name', 'company_name', 'company'),
+    Column('country'),
+    Column('is_verified', default=False),
+    Column('role', default='client', values={'promoter': 'provider', 'user': 'client'}),
+    Column('status', values={'pending': 'active', 'approved': 'active', 'suspended': 'suspended',
+                             'deleted': 'inactive'}, otherwise='active'),
+    Column('created_at'),
+    Column('updated_at'),
+], update=['email', 'role', 'status'])    # what _write_profile overwrites
+
+COMPANIES = TableMapping('companies', [
+    Column('id'),
+    Column('name'),
+    Column('slug', 'slug', Sql("LOWER(REGEXP_REPLACE(name, '[^a-zA-Z0-9]+', '-', 'g'))", 'name')),
+    Column('description'),
+    Column('logo_url'),
+    Column('website'),
+    Column('email'),
+    Column('phone'),
+    Column('address'),
+    Column('cr_number'),
+    Column('vat_number'),
+    Column('owner_id'),
+    Column('status', 'is_active', default=True, values={True: 'active'}, otherwise='inactive'),
+    Column('created_at'),
+    Column('updated_at'),
+], update=['name', 'status'])    # what _write_company overwrites
+
+SERVICES = TableMapping('services', [
+    Column('id'),
+    Column('provider_id', remap='profile_id_map'),
+    Column('provider_company_id', 'provider_company_id', 'company_id', remap='company_id_map'),
+    Column('title', 'title', 'name'),
+    Column('description'),
+    Column('category'),
+    Column('price', 'price', 'base_price', 'price_base', default=0),
+    Column('currency', 'currency', 'price_currency', default='USD'),
+    Column('location'),
+    Column('tags'),
+    Column('requirements'),
+    Column('cover_image_url'),
+    Column('featured', 'featured', 'is_featured', default=False),
+    Column('rating', default=0),
+    Column('review_count', default=0),
+    Column('booking_count', default=0),
+    Column('status', Sql("""CASE 
+        WHEN status = 'active' AND COALESCE(approval_status, 'approved') = 'approved' THEN 'active'
+        WHEN status = 'pending' OR approval_status = 'pending' THEN 'pending'
+        WHEN status = 'inactive' OR status = 'archived' THEN 'inactive'
+        WHEN status = 'draft' THEN 'draft'
+        ELSE 'active'
+    END""", 'status', 'approval_status'), Sql("""CASE
+        WHEN status = 'pending' THEN 'pending'
+        WHEN status = 'inactive' OR status = 'archived' THEN 'inactive'
+        WHEN status = 'draft' THEN 'draft'
+        ELSE 'active'
+    END""", 'status'), default='active', cast='service_status_type'),
+    Column('created_at'),
+    Column('updated_at'),
+], update=['title', 'description', 'price', 'status'])
+
+BOOKINGS = TableMapping('bookings', [
+    Column('id'),
+    Column('client_id', 'client_id', 'user_id', remap='profile_id_map'),
+    Column('provider_id', remap='profile_id_map'),
+    Column('provider_company_id', remap='company_id_map'),
+    Column('service_id'),
+    Column('package_id'),
+    Column('status', values={
+        'approved': 'confirmed', 'pending': 'pending', 'in_progress': 'in_progress',
+        'completed': 'completed', 'cancelled': 'cancelled', 'declined': 'cancelled',
+        'confirmed': 'confirmed', 'draft': 'draft',
+    }, otherwise='pending', cast='booking_status_type'),
+    Column('scheduled_at', 'scheduled_at', 'scheduled_start', 'start_time'),
+    Column('created_at'),
+    Column('updated_at'),
+], update=['client_id', 'provider_id', 'service_id', 'status'])
+
+# Tables followed by --sync, in foreign-key order, with the method writing one of their rows
+SYNC_TABLES = [
+    (PROFILES, '_write_profile'),
+    (COMPANIES, '_write_company'),
+    (SERVICES, '_write_service'),
+    (BOOKINGS, '_write_booking'),
+]
+
 class CrossProjectMigrator:
-    def __init__(self):
+    def __init__(self, batch_size=BATCH_SIZE, bulk_copy=False, state=None, incremental=False,
+                 metrics=None, pipeline_writers=0, bulk_load=False, snapshot=None, adaptive_batches=False):
         self.old_conn = None
         self.new_conn = None
+        self.batch_size = batch_size
+        self.itersize = max(batch_size, 2000)
+        
+        # Load services and bookings with COPY (first-time loads into an empty project)
+        self.bulk_copy = bulk_copy
+        
+        # Source id range handled by this migrator (None = whole table)
+        self.key_range = None
+        
+        # Watermarks and checkpoints; incremental runs only read rows changed since the
+        # last successful run, resumed runs continue after the last committed batch
+        self.state = state or MigrationState()
+        self.incremental = incremental
+        
+        # Rows the new project refused; they are logged and skipped instead of aborting the run
+        self.rejects = RejectLog()
+        
+        # Per-stage row counts, timings and round trips (shared with forked workers)
+        self.metrics = metrics or Metrics('migrate_between_projects')
+        
+        # Writer connections per table when reads and writes are pipelined (0 = one batch at a time)
+        self.pipeline_writers = pipeline_writers
+        
+        # Write with BULK_SESSION settings while BULK_LOAD_TABLES' indexes and triggers are set aside
+        self.bulk_load = bulk_load
+        
+        # Snapshot read instead of the old project (see extract())
+        self.snapshot = snapshot
+        
+        # Tune the COMMIT_ROWS transactions per stage from the observed write latency
+        self.adaptive_batches = adaptive_batches
         
         # ID mapping tables (for foreign key references)
-        self.profile_id_map = {}  # old_id -> new_id (usually same, but just in case)
-        self.company_id_map = {}
+        self.profile_id_map = IdMap()  # old_id -> new_id (usually same, but just in case)
+        self.company_id_map = IdMap()  # identity entries cost only their 16-byte key
         
-    def connect(self):
-        """Connect to both Supabase projects"""
+    def connect(self, new=True):
+        """Connect to both Supabase projects (not to the old one when loading a
+        snapshot, nor to the new one with new=False)"""
         print("🔌 Connecting to Supabase projects...")
         
         try:
-            if OLD_PROJECT_DB_URL:
-                self.old_conn = psycopg2.connect(OLD_PROJECT_DB_URL)
+            if self.snapshot:
+                print(f"✅ Reading snapshot {self.snapshot.path} (taken {self.snapshot.manifest['created_at']})")
+            elif OLD_PROJECT_DB_URL:
+                self.old_conn = self.metrics.connect(OLD_PROJECT_DB_URL)
                 print("✅ Connected to OLD Supabase project")
             else:
                 print("❌ OLD_PROJECT_DB_URL is required!")
                 sys.exit(1)
                 
-            if NEW_PROJECT_DB_URL:
-                self.new_conn = psycopg2.connect(NEW_PROJECT_DB_URL)
+            if new and NEW_PROJECT_DB_URL:
+                self.new_conn = self._connect_new()
                 print("✅ Connected to NEW unified Supabase project")
-            else:
+            elif new:
                 print("❌ NEW_PROJECT_DB_URL is required!")
                 sys.exit(1)
                 
@@ -61,6 +220,15 @@ class CrossProjectMigrator:
             print(f"❌ Connection error: {e}")
             sys.exit(1)
     
+    def _connect_new(self):
+        """Connect to the new project, with bulk-load session settings if enabled"""
+        conn = self.metrics.connect(NEW_PROJECT_DB_URL)
+        if self.bulk_load:
+            with conn.cursor() as cur:
+                cur.execute(BULK_SESSION)
+            conn.commit()
+        return conn
+    
     def close(self):
         """Close database connections"""
         if self.old_conn:
@@ -68,465 +236,669 @@ class CrossProjectMigrator:
         if self.new_conn:
             self.new_conn.close()
     
+    def _compiled(self, mapping):
+        """`mapping` compiled against the old project, or the schema its snapshot recorded"""
+        if self.snapshot:
+            return mapping.compile_types(self.snapshot.name, self.snapshot.types(mapping.source))
+        return mapping.compile(self.old_conn)
+    
+    def _compile(self, mapping):
+        """`mapping` compiled against the old project, and its batch transformer"""
+        compiled = self._compiled(mapping)
+        return compiled, compiled.transformer({
+            'profile_id_map': self.profile_id_map,
+            'company_id_map': self.company_id_map,
+        })
+    
+    def fork(self, key_range=None):
+        """Create a migrator on its own connections that shares this one's ID maps"""
+        worker = CrossProjectMigrator(self.batch_size, self.bulk_copy, self.state, self.incremental,
+                                      metrics=self.metrics, pipeline_writers=self.pipeline_writers,
+                                      bulk_load=self.bulk_load, snapshot=self.snapshot,
+                                      adaptive_batches=self.adaptive_batches)
+        worker.profile_id_map = self.profile_id_map
+        worker.company_id_map = self.company_id_map
+        worker.rejects = self.rejects
+        worker.key_range = key_range
+        if not self.snapshot:
+            worker.old_conn = self.metrics.connect(OLD_PROJECT_DB_URL)
+        worker.new_conn = worker._connect_new()
+        return worker
+    
+    def _source_filter(self, table):
+        """WHERE clause limiting a source query to this migrator's id range and,
+        in incremental mode, to rows changed since the last successful run"""
+        since = self.state.since('old', table) if self.incremental else None
+        if since:
+            print(f"   ↪ {table}: rows changed since {since.isoformat()}")
+        after = self.state.position(self._checkpoint_name(table))
+        if after:
+            print(f"   ↪ {table}: resuming after {after}")
+        if not since:
+            self.metrics.expect(estimate_rows(self.old_conn, table, self.key_range, after))
+        return where_clause(
+            key_range_condition(self.key_range),
+            changed_since_condition(since),
+            after_key_condition(after)
+        )
+    
+    def _read(self, table, compiled):
+        """Source rows of `compiled`, from the old project or the snapshot, tracked
+        for watermarks and metrics"""
+        if not self.snapshot:
+            rows = stream_rows(self.old_conn, compiled.query(self._source_filter(table)), itersize=self.itersize)
+        else:
+            after = self.state.position(self._checkpoint_name(table))
+            if after:
+                print(f"   ↪ {table}: resuming after {after}")
+            self.metrics.expect(self.snapshot.count(table, self.key_range, after))
+            rows = self.snapshot.rows(table, self.key_range, after)
+        return self.state.track('old', table, self.metrics.read(rows))
+    
+    def _checkpoint_name(self, table):
+        """Checkpoint name of a table within this migrator's id range"""
+        if self.key_range:
+            lo, hi = self.key_range
+            return f"{table}[{lo or ''}:{hi or ''}]"
+        return table
+    
+    def _already_migrated(self, table):
+        """True (and say so) when the run being resumed already finished this table"""
+        if self.state.is_complete(self._checkpoint_name(table)):
+            print(f"   ⏭️  {table} already migrated")
+            return True
+        return False
+    
+    def save_state(self):
+        """Advance watermarks after a successful run (ID maps are identity here)"""
+        self.state.save()
+    
+    def _run_stage(self, method, key_range=None):
+        """Run one migration step on a forked migrator"""
+        worker = self.fork(key_range)
+        try:
+            getattr(worker, method)()
+        finally:
+            worker.close()
+    
+    def run_parallel(self, workers, chunks=1):
+        """Run the migration stages concurrently, as far as foreign keys allow
+        
+        companies.owner_id references profiles, services reference profiles and
+        companies, and bookings reference all three. RBAC assignment only needs
+        profiles, so it overlaps with the rest. Profiles, services and bookings
+        are split into `chunks` id ranges.
+        """
+        run_stages([
+            Stage('profiles', partial(self._run_stage, 'migrate_profiles'), chunks=chunks),
+            Stage('companies', partial(self._run_stage, 'migrate_companies'),
+                  depends_on=['profiles']),
+            Stage('services', partial(self._run_stage, 'migrate_services'),
+                  depends_on=['profiles', 'companies'], chunks=chunks),
+            Stage('bookings', partial(self._run_stage, 'migrate_bookings'),
+                  depends_on=['profiles', 'companies', 'services'], chunks=chunks),
+            Stage('rbac_roles', partial(self._run_stage, 'assign_rbac_roles'),
+                  depends_on=['profiles']),
+            Stage('user_permissions', partial(self._run_stage, 'refresh_materialized_view'),
+                  depends_on=['rbac_roles']),
+        ], workers)
+    
+    def _write_rows(self, batch, table, write):
+        """Write a batch of source rows with `write` in one transaction; returns
+        the number written (rejected rows are logged and skipped)"""
+        with RowTransaction(self.new_conn, self.rejects, table) as tx:
+            for row in batch:
+                tx.write(row['id'], row, write, row)
+        return len(batch) - tx.rejected
+    
+    def _migrate_rows(self, table, rows, write, transform=None):
+        """Write source rows with the `write` method in COMMIT_ROWS-row transactions,
+        checkpointing after each; returns the number written
+        
+        `transform`, if given, finishes each batch first. When pipelined, the next
+        batches are read while earlier ones are being written, by
+        pipeline_writers connections (this one and forks of it). With
+        adaptive_batches the transactions grow and shrink with the write latency.
+        """
+        checkpoint = self._checkpoint_name(table)
+        sizer = self.metrics.batch_sizer(COMMIT_ROWS) if self.adaptive_batches else None
+        workers = [self] + [self.fork(self.key_range) for _ in range(self.pipeline_writers - 1)]
+        try:
+            return write_batches(
+                self.metrics, self.metrics.batches(rows, sizer or COMMIT_ROWS),
+                [partial(worker._write_rows, table=table, write=getattr(worker, write)) for worker in workers],
+                lambda batch, written: self.state.checkpoint(checkpoint, batch[-1]['id']),
+                transform=transform,
+                pipeline=self.pipeline_writers > 0,
+                sizer=sizer
+            )
+        finally:
+            for worker in workers[1:]:
+                worker.close()
+    
+    @measured('profiles')
     def migrate_profiles(self):
         """Migrate profiles from old project to new project"""
         print("\n📋 Migrating profiles...")
+        if self._already_migrated('profiles'):
+            return
         
-        with self.old_conn.cursor(cursor_factory=RealDictCursor) as old_cur:
-            old_cur.execute("""
-                SELECT 
-                    id,
-                    email,
-                    COALESCE(full_name, CONCAT(first_name, ' ', last_name), split_part(email, '@', 1)) AS full_name,
-                    phone,
-                    COALESCE(avatar_url, profile_image_url) AS avatar_url,
-                    COALESCE(company_name, company) AS company_name,
-                    country,
-                    COALESCE(is_verified, false) AS is_verified,
-                    CASE 
-                        WHEN role = 'promoter' THEN 'provider'
-                        WHEN role = 'user' THEN 'client'
-                        ELSE COALESCE(role, 'client')
-                    END AS role,
-                    CASE 
-                        WHEN status = 'pending' THEN 'active'
-                        WHEN status = 'approved' THEN 'active'
-                        WHEN status = 'suspended' THEN 'suspended'
-                        WHEN status = 'deleted' THEN 'inactive'
-                        ELSE 'active'
-                    END AS status,
-                    created_at,
-                    updated_at
-                FROM profiles
-            """)
-            
-            profiles = old_cur.fetchall()
-            total_migrated = 0
-            
-            for profile in profiles:
-                old_id = profile['id']
-                
-                with self.new_conn.cursor(cursor_factory=RealDictCursor) as new_cur:
-                    # Check if profile exists
-                    new_cur.execute("SELECT id FROM profiles WHERE id = %s", (old_id,))
-                    existing = new_cur.fetchone()
-                    
-                    if existing:
-                        # Update existing
-                        new_cur.execute("""
-                            UPDATE profiles SET
-                                email = %s,
-                                full_name = COALESCE(profiles.full_name, %s),
-                                name = COALESCE(profiles.name, %s),
-                                phone = COALESCE(profiles.phone, %s),
-                                avatar_url = COALESCE(profiles.avatar_url, %s),
-                                company_name = COALESCE(profiles.company_name, %s),
-                                country = COALESCE(profiles.country, %s),
-                                is_verified = COALESCE(profiles.is_verified, %s),
-                                role = %s,
-                                status = %s::user_status_type,
-                                updated_at = GREATEST(profiles.updated_at, %s)
-                            WHERE id = %s
-                        """, (
-                            profile['email'],
-                            profile['full_name'],
-                            profile['full_name'],
-                            profile['phone'],
-                            profile['avatar_url'],
-                            profile['company_name'],
-                            profile['country'],
-                            profile['is_verified'],
-                            profile['role'],
-                            profile['status'],
-                            profile['updated_at'],
-                            old_id
-                        ))
-                    else:
-                        # Insert new
-                        new_cur.execute("""
-                            INSERT INTO profiles (
-                                id, email, full_name, name, phone, avatar_url,
-                                company_name, country, is_verified, role, status,
-                                created_at, updated_at
-                            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s::user_status_type, %s, %s)
-                            ON CONFLICT (id) DO UPDATE SET
-                                email = EXCLUDED.email,
-                                full_name = COALESCE(profiles.full_name, EXCLUDED.full_name),
-                                role = EXCLUDED.role
-                        """, (
-                            old_id,
-                            profile['email'],
-                            profile['full_name'],
-                            profile['full_name'],
-                            profile['phone'],
-                            profile['avatar_url'],
-                            profile['company_name'],
-                            profile['country'],
-                            profile['is_verified'],
-                            profile['role'],
-                            profile['status'],
-                            profile['created_at'],
-                            profile['updated_at']
-                        ))
-                    
-                    self.new_conn.commit()
-                    self.profile_id_map[old_id] = old_id  # Usually same ID
-                    total_migrated += 1
+        compiled, transform = self._compile(PROFILES)
+        profiles = self._read('profiles', compiled)
         
+        total_migrated = self._migrate_rows('profiles', profiles, '_write_profile', transform)
+        
+        self.state.complete(self._checkpoint_name('profiles'))
         print(f"✅ Migrated {total_migrated} profiles")
     
+    def _write_profile(self, profile):
+        """Insert or update one profile (inside the caller's transaction)"""
+        old_id = profile['id']
+        
+        with self.new_conn.cursor(cursor_factory=RealDictCursor) as new_cur:
+            # Check if profile exists
+            new_cur.execute("SELECT id FROM profiles WHERE id = %s", (old_id,))
+            existing = new_cur.fetchone()
+            
+            if existing:
+                # Update existing
+                new_cur.execute("""
+                    UPDATE profiles SET
+                        email = %s,
+                        full_name = COALESCE(profiles.full_name, %s),
+                        name = COALESCE(profiles.name, %s),
+                        phone = COALESCE(profiles.phone, %s),
+                        avatar_url = COALESCE(profiles.avatar_url, %s),
+                        company_name = COALESCE(profiles.company_name, %s),
+                        country = COALESCE(profiles.country, %s),
+                        is_verified = COALESCE(profiles.is_verified, %s),
+                        role = %s,
+                        status = %s::user_status_type,
+                        updated_at = GREATEST(profiles.updated_at, %s)
+                    WHERE id = %s
+                """, (
+                    profile['email'],
+                    profile['full_name'],
+                    profile['full_name'],
+                    profile['phone'],
+                    profile['avatar_url'],
+                    profile['company_name'],
+                    profile['country'],
+                    profile['is_verified'],
+                    profile['role'],
+                    profile['status'],
+                    profile['updated_at'],
+                    old_id
+                ))
+            else:
+                # Insert new
+                new_cur.execute("""
+                    INSERT INTO profiles (
+                        id, email, full_name, name, phone, avatar_url,
+                        company_name, country, is_verified, role, status,
+                        created_at, updated_at
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s::user_status_type, %s, %s)
+                    ON CONFLICT (id) DO UPDATE SET
+                        email = EXCLUDED.email,
+                        full_name = COALESCE(profiles.full_name, EXCLUDED.full_name),
+                        role = EXCLUDED.role
+                """, (
+                    old_id,
+                    profile['email'],
+                    profile['full_name'],
+                    profile['full_name'],
+                    profile['phone'],
+                    profile['avatar_url'],
+                    profile['company_name'],
+                    profile['country'],
+                    profile['is_verified'],
+                    profile['role'],
+                    profile['status'],
+                    profile['created_at'],
+                    profile['updated_at']
+                ))
+        
+        self.profile_id_map[old_id] = old_id  # Usually same ID
+    
+    @measured('companies')
     def migrate_companies(self):
         """Migrate companies from old project to new project"""
         print("\n🏢 Migrating companies...")
+        if self._already_migrated('companies'):
+            return
         
-        with self.old_conn.cursor(cursor_factory=RealDictCursor) as old_cur:
-            old_cur.execute("""
-                SELECT 
-                    id,
-                    name,
-                    COALESCE(slug, LOWER(REGEXP_REPLACE(name, '[^a-zA-Z0-9]+', '-', 'g'))) AS slug,
-                    description,
-                    logo_url,
-                    website,
-                    email,
-                    phone,
-                    address,
-                    cr_number,
-                    vat_number,
-                    owner_id,
-                    CASE 
-                        WHEN COALESCE(is_active, true) THEN 'active'
-                        ELSE 'inactive'
-                    END AS status,
-                    created_at,
-                    updated_at
-                FROM companies
-            """)
-            
-            companies = old_cur.fetchall()
-            total_migrated = 0
-            
-            for company in companies:
-                old_id = company['id']
-                
-                with self.new_conn.cursor(cursor_factory=RealDictCursor) as new_cur:
-                    # Check if company exists
-                    new_cur.execute("SELECT id FROM companies WHERE id = %s OR slug = %s", 
-                                   (old_id, company['slug']))
-                    existing = new_cur.fetchone()
-                    
-                    if existing:
-                        # Update existing
-                        new_cur.execute("""
-                            UPDATE companies SET
-                                name = %s,
-                                description = COALESCE(companies.description, %s),
-                                logo_url = COALESCE(companies.logo_url, %s),
-                                website = COALESCE(companies.website, %s),
-                                email = COALESCE(companies.email, %s),
-                                phone = COALESCE(companies.phone, %s),
-                                address = COALESCE(companies.address, %s),
-                                cr_number = COALESCE(companies.cr_number, %s),
-                                vat_number = COALESCE(companies.vat_number, %s),
-                                status = %s
-                            WHERE id = %s
-                        """, (
-                            company['name'],
-                            company['description'],
-                            company['logo_url'],
-                            company['website'],
-                            company['email'],
-                            company['phone'],
-                            company['address'],
-                            company['cr_number'],
-                            company['vat_number'],
-                            company['status'],
-                            old_id
-                        ))
-                    else:
-                        # Insert new
-                        new_cur.execute("""
-                            INSERT INTO companies (
-                                id, name, slug, description, logo_url, website,
-                                email, phone, address, cr_number, vat_number,
-                                owner_id, status, created_at, updated_at
-                            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (id) DO UPDATE SET
-                                name = EXCLUDED.name,
-                                slug = EXCLUDED.slug
-                        """, (
-                            old_id,
-                            company['name'],
-                            company['slug'],
-                            company['description'],
-                            company['logo_url'],
-                            company['website'],
-                            company['email'],
-                            company['phone'],
-                            company['address'],
-                            company['cr_number'],
-                            company['vat_number'],
-                            company['owner_id'],
-                            company['status'],
-                            company['created_at'],
-                            company['updated_at']
-                        ))
-                    
-                    self.new_conn.commit()
-                    self.company_id_map[old_id] = old_id
-                    total_migrated += 1
+        compiled, transform = self._compile(COMPANIES)
+        companies = self._read('companies', compiled)
         
+        total_migrated = self._migrate_rows('companies', companies, '_write_company', transform)
+        
+        self.state.complete(self._checkpoint_name('companies'))
         print(f"✅ Migrated {total_migrated} companies")
     
+    def _write_company(self, company):
+        """Insert or update one company (inside the caller's transaction)"""
+        old_id = company['id']
+        
+        with self.new_conn.cursor(cursor_factory=RealDictCursor) as new_cur:
+            # Check if company exists
+            new_cur.execute("SELECT id FROM companies WHERE id = %s OR slug = %s", 
+                           (old_id, company['slug']))
+            existing = new_cur.fetchone()
+            
+            if existing:
+                # Update existing
+                new_cur.execute("""
+                    UPDATE companies SET
+                        name = %s,
+                        description = COALESCE(companies.description, %s),
+                        logo_url = COALESCE(companies.logo_url, %s),
+                        website = COALESCE(companies.website, %s),
+                        email = COALESCE(companies.email, %s),
+                        phone = COALESCE(companies.phone, %s),
+                        address = COALESCE(companies.address, %s),
+                        cr_number = COALESCE(companies.cr_number, %s),
+                        vat_number = COALESCE(companies.vat_number, %s),
+                        status = %s
+                    WHERE id = %s
+                """, (
+                    company['name'],
+                    company['description'],
+                    company['logo_url'],
+                    company['website'],
+                    company['email'],
+                    company['phone'],
+                    company['address'],
+                    company['cr_number'],
+                    company['vat_number'],
+                    company['status'],
+                    old_id
+                ))
+            else:
+                # Insert new
+                new_cur.execute("""
+                    INSERT INTO companies (
+                        id, name, slug, description, logo_url, website,
+                        email, phone, address, cr_number, vat_number,
+                        owner_id, status, created_at, updated_at
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (id) DO UPDATE SET
+                        name = EXCLUDED.name,
+                        slug = EXCLUDED.slug
+                """, (
+                    old_id,
+                    company['name'],
+                    company['slug'],
+                    company['description'],
+                    company['logo_url'],
+                    company['website'],
+                    company['email'],
+                    company['phone'],
+                    company['address'],
+                    company['cr_number'],
+                    company['vat_number'],
+                    company['owner_id'],
+                    company['status'],
+                    company['created_at'],
+                    company['updated_at']
+                ))
+        
+        self.company_id_map[old_id] = old_id
+    
+    @measured('services')
     def migrate_services(self):
         """Migrate services from old project to new project"""
         print("\n🔧 Migrating services...")
+        if self._already_migrated('services'):
+            return
         
-        with self.old_conn.cursor(cursor_factory=RealDictCursor) as old_cur:
-            # First check which columns exist
-            old_cur.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_schema = 'public' 
-                AND table_name = 'services' 
-                AND column_name IN ('company_id', 'provider_company_id')
-            """)
-            company_cols = [row[0] for row in old_cur.fetchall()]
-            
-            # Build query based on available columns
-            if 'provider_company_id' in company_cols:
-                company_col_expr = 'provider_company_id'
-            elif 'company_id' in company_cols:
-                company_col_expr = 'company_id'
-            else:
-                company_col_expr = 'NULL'
-            
-            query = f"""
-                SELECT 
-                    id,
-                    provider_id,
-                    {company_col_expr} AS provider_company_id,
-                    COALESCE(title, name) AS title,
-                    description,
-                    category,
-                    COALESCE(price, base_price, price_base, 0) AS price,
-                    COALESCE(currency, price_currency, 'USD') AS currency,
-                    location,
-                    tags,
-                    requirements,
-                    cover_image_url,
-                    COALESCE(featured, is_featured, false) AS featured,
-                    COALESCE(rating, 0) AS rating,
-                    COALESCE(review_count, 0) AS review_count,
-                    COALESCE(booking_count, 0) AS booking_count,
-                    CASE 
-                        WHEN status = 'active' AND COALESCE(approval_status, 'approved') = 'approved' THEN 'active'
-                        WHEN status = 'pending' OR approval_status = 'pending' THEN 'pending'
-                        WHEN status = 'inactive' OR status = 'archived' THEN 'inactive'
-                        WHEN status = 'draft' THEN 'draft'
-                        ELSE 'active'
-                    END AS status,
-                    created_at,
-                    updated_at
-                FROM services
-            """
-            
-            old_cur.execute(query)
-            
-            services = old_cur.fetchall()
-            total_migrated = 0
-            
-            for service in services:
-                # Map provider_id and company_id
-                provider_id = self.profile_id_map.get(service['provider_id'], service['provider_id'])
-                company_id = service.get('provider_company_id')
-                if company_id:
-                    company_id = self.company_id_map.get(company_id, company_id)
-                
-                with self.new_conn.cursor() as new_cur:
-                    new_cur.execute("""
-                        INSERT INTO services (
-                            id, provider_id, provider_company_id, title, description,
-                            category, price, currency, location, tags, requirements,
-                            cover_image_url, featured, rating, review_count, booking_count,
-                            status, created_at, updated_at
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s::service_status_type, %s, %s)
-                        ON CONFLICT (id) DO UPDATE SET
-                            title = EXCLUDED.title,
-                            description = EXCLUDED.description,
-                            price = EXCLUDED.price,
-                            status = EXCLUDED.status
-                    """, (
-                        service['id'],
-                        provider_id,
-                        company_id,
-                        service['title'],
-                        service['description'],
-                        service['category'],
-                        service['price'],
-                        service['currency'],
-                        service['location'],
-                        service['tags'],
-                        service['requirements'],
-                        service['cover_image_url'],
-                        service['featured'],
-                        service['rating'],
-                        service['review_count'],
-                        service['booking_count'],
-                        service['status'],
-                        service['created_at'],
-                        service['updated_at']
-                    ))
-                    
-                    self.new_conn.commit()
-                    total_migrated += 1
+        compiled, transform = self._compile(SERVICES)
+        
+        if self.bulk_copy:
+            query = compiled.query(self._source_filter('services'))
+            total_migrated = self._bulk_copy('services', query, compiled.columns, compiled.casts,
+                                             SERVICES.update)
+            self.state.complete(self._checkpoint_name('services'))
+            print(f"✅ Migrated {total_migrated} services (bulk copy)")
+            return
+        
+        services = self._read('services', compiled)
+        total_migrated = self._migrate_rows('services', services, '_write_service', transform)
         
+        self.state.complete(self._checkpoint_name('services'))
         print(f"✅ Migrated {total_migrated} services")
     
+    def _write_service(self, service):
+        """Insert or update one service (inside the caller's transaction)"""
+        self._upsert(SERVICES, service)
+    
+    def _upsert(self, mapping, row):
+        """Insert or update one row of a mapped table with its prepared upsert"""
+        compiled = self._compiled(mapping)
+        with self.new_conn.cursor() as new_cur:
+            prepared_statements(self.new_conn).execute(new_cur, *compiled.upsert(), compiled.params(row))
+    
+    @measured('bookings')
     def migrate_bookings(self):
         """Migrate bookings from old project to new project"""
         print("\n📅 Migrating bookings...")
+        if self._already_migrated('bookings'):
+            return
+        
+        compiled, transform = self._compile(BOOKINGS)
+        
+        if self.bulk_copy:
+            query = compiled.query(self._source_filter('bookings'))
+            total_migrated = self._bulk_copy('bookings', query, compiled.columns, compiled.casts,
+                                             BOOKINGS.update)
+            self.state.complete(self._checkpoint_name('bookings'))
+            print(f"✅ Migrated {total_migrated} bookings (bulk copy)")
+            return
+        
+        bookings = self._read('bookings', compiled)
+        total_migrated = self._migrate_rows('bookings', bookings, '_write_booking', transform)
+        
+        self.state.complete(self._checkpoint_name('bookings'))
+        print(f"✅ Migrated {total_migrated} bookings")
+    
+    def _write_booking(self, booking):
+        """Insert or update one booking (inside the caller's transaction)"""
+        self._upsert(BOOKINGS, booking)
+    
+    def _bulk_copy(self, table, query, columns, casts, update_columns):
+        """Load a source query into `table` with COPY through a staging table
+        
+        The source query must select `columns` in order. Enum columns named in
+        `casts` are staged as text and cast in the final merge. IDs are not
+        remapped: profile and company ids are carried over unchanged.
+        """
+        stage = f"_copy_{table}"
+        column_list = ', '.join(columns)
+        stage_columns = ', '.join(f"{c}::text AS {c}" if c in casts else c for c in columns)
+        merge_columns = ', '.join(f"{c}::{casts[c]}" if c in casts else c for c in columns)
+        updates = ', '.join(f"{c} = EXCLUDED.{c}" for c in update_columns)
         
-        with self.old_conn.cursor(cursor_factory=RealDictCursor) as old_cur:
-            old_cur.execute("""
-                SELECT 
-                    id,
-                    COALESCE(client_id, user_id) AS client_id,
-                    provider_id,
-                    provider_company_id,
-                    service_id,
-                    package_id,
-                    CASE 
-                        WHEN status = 'approved' THEN 'confirmed'
-                        WHEN status = 'pending' THEN 'pending'
-                        WHEN status = 'in_progress' THEN 'in_progress'
-                        WHEN status = 'completed' THEN 'completed'
-                        WHEN status = 'cancelled' THEN 'cancelled'
-                        WHEN status = 'declined' THEN 'cancelled'
-                        WHEN status = 'confirmed' THEN 'confirmed'
-                        WHEN status = 'draft' THEN 'draft'
-                        ELSE 'pending'
-                    END AS status,
-                    COALESCE(scheduled_at, scheduled_start, start_time) AS scheduled_at,
-                    created_at,
-                    updated_at
-                FROM bookings
+        with self.new_conn.cursor() as new_cur:
+            if self.bulk_load:
+                # Foreign keys made deferrable by start_bulk_load() are checked once, at commit
+                new_cur.execute("SET CONSTRAINTS ALL DEFERRED")
+            new_cur.execute(f"""
+                CREATE TEMP TABLE {stage} ON COMMIT DROP AS
+                SELECT {stage_columns} FROM {table} WITH NO DATA
             """)
             
-            bookings = old_cur.fetchall()
-            total_migrated = 0
+            copied = copy_between(
+                self.old_conn, f"COPY ({query}) TO STDOUT",
+                self.new_conn, f"COPY {stage} ({column_list}) FROM STDIN"
+            )
             
-            for booking in bookings:
-                # Map IDs
-                client_id = self.profile_id_map.get(booking['client_id'], booking['client_id'])
-                provider_id = self.profile_id_map.get(booking['provider_id'], booking['provider_id'])
-                company_id = self.company_id_map.get(booking['provider_company_id'], booking['provider_company_id'])
-                
-                with self.new_conn.cursor() as new_cur:
-                    new_cur.execute("""
-                        INSERT INTO bookings (
-                            id, client_id, provider_id, provider_company_id,
-                            service_id, package_id, status, scheduled_at,
-                            created_at, updated_at
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s::booking_status_type, %s, %s, %s)
-                        ON CONFLICT (id) DO UPDATE SET
-                            client_id = EXCLUDED.client_id,
-                            provider_id = EXCLUDED.provider_id,
-                            service_id = EXCLUDED.service_id,
-                            status = EXCLUDED.status
-                    """, (
-                        booking['id'],
-                        client_id,
-                        provider_id,
-                        company_id,
-                        booking['service_id'],
-                        booking['package_id'],
-                        booking['status'],
-                        booking['scheduled_at'],
-                        booking['created_at'],
-                        booking['updated_at']
-                    ))
-                    
-                    self.new_conn.commit()
-                    total_migrated += 1
+            new_cur.execute(f"SELECT MAX(COALESCE(updated_at, created_at)) FROM {stage}")
+            self.state.observe('old', table, new_cur.fetchone()[0])
+            
+            new_cur.execute(f"""
+                INSERT INTO {table} ({column_list})
+                SELECT {merge_columns} FROM {stage}
+                ON CONFLICT (id) DO UPDATE SET {updates}
+            """)
+            total_migrated = new_cur.rowcount
         
-        print(f"✅ Migrated {total_migrated} bookings")
+        self.new_conn.commit()
+        self.metrics.count(rows_read=copied, rows_written=total_migrated)
+        return total_migrated
+    
+    def _bulk_load_tables(self):
+        """BulkLoad of BULK_LOAD_TABLES, recorded under the target alone: whatever
+        the source (old project or snapshot), a run finds what an interrupted
+        one left set aside"""
+        path = MigrationState.run_path('bulk_load', NEW_PROJECT_DB_URL) + '.json'
+        return BulkLoad(self.new_conn, NEW_PROJECT_DB_URL, BULK_LOAD_TABLES, path,
+                        defer_foreign_keys=self.bulk_copy, connect=self.metrics.connect)
+    
+    def bulk_load_interrupted(self):
+        """Whether an earlier --bulk-load run left indexes or triggers set aside"""
+        return self._bulk_load_tables().interrupted
     
+    @measured('bulk_load')
+    def start_bulk_load(self):
+        """Set aside secondary indexes and triggers of the tables about to be loaded"""
+        print("\n🚚 Preparing bulk load...")
+        changes = self._bulk_load_tables().prepare()
+        print(f"✅ Dropped {len(changes['indexes'])} indexes, disabled {len(changes['triggers'])} triggers"
+              + (f", deferred {len(changes['constraints'])} foreign keys" if changes['constraints'] else ""))
+    
+    @measured('bulk_load')
+    def finish_bulk_load(self):
+        """Rebuild the indexes, re-enable the triggers and ANALYZE the loaded tables"""
+        print("\n🚚 Finishing bulk load...")
+        changes = self._bulk_load_tables().restore()
+        if changes is None:
+            return
+        print(f"✅ Rebuilt {len(changes['indexes'])} indexes, re-enabled {len(changes['triggers'])} triggers, "
+              f"analyzed {', '.join(BULK_LOAD_TABLES)}")
+    
+    @measured('rbac_roles')
     def assign_rbac_roles(self):
-        """Assign RBAC roles in new project"""
+        """Assign RBAC roles in new project
+        
+        One join of the profiles migrated in this run (all profiles when resuming,
+        as the interrupted run's are unknown) with the role named by profiles.role.
+        Assignments a user already has are skipped: user_role_assignments has no
+        unique key on (user_id, role_id) for ON CONFLICT to dedupe on.
+        """
         print("\n🔐 Assigning RBAC roles...")
+        if self._already_migrated('rbac_roles'):
+            return
+        
+        scope = ''
+        if not self.state.resumed:
+            ship_id_map(self.new_conn, RBAC_PROFILES_TABLE, self.profile_id_map)
+            scope = f"JOIN {RBAC_PROFILES_TABLE} m ON m.new_id = p.id"
         
         with self.new_conn.cursor() as cur:
-            # Admin
-            cur.execute("""
-                INSERT INTO user_role_assignments (user_id, role_id)
-                SELECT p.id, r.id
-                FROM profiles p
-                CROSS JOIN roles r
-                WHERE p.role = 'admin' AND r.name = 'admin'
-                ON CONFLICT DO NOTHING
-            """)
-            
-            # Provider
-            cur.execute("""
+            cur.execute(f"""
                 INSERT INTO user_role_assignments (user_id, role_id)
-                SELECT p.id, r.id
+                SELECT DISTINCT p.id, r.id
                 FROM profiles p
-                CROSS JOIN roles r
-                WHERE p.role = 'provider' AND r.name = 'provider'
-                ON CONFLICT DO NOTHING
+                {scope}
+                JOIN roles r ON r.name = p.role::text
+                WHERE p.role::text IN ('admin', 'provider', 'client')
+                AND NOT EXISTS (
+                    SELECT 1 FROM user_role_assignments ura
+                    WHERE ura.user_id = p.id AND ura.role_id = r.id
+                )
             """)
-            
-            # Client
-            cur.execute("""
-                INSERT INTO user_role_assignments (user_id, role_id)
-                SELECT p.id, r.id
-                FROM profiles p
-                CROSS JOIN roles r
-                WHERE p.role = 'client' AND r.name = 'client'
-                ON CONFLICT DO NOTHING
-            """)
-            
+            assigned = cur.rowcount
             self.new_conn.commit()
         
-        print("✅ RBAC roles assigned")
+        if scope:
+            drop_id_maps(self.new_conn, RBAC_PROFILES_TABLE)
+        self.metrics.count(rows_written=assigned)
+        self.state.complete('rbac_roles')
+        print(f"✅ RBAC roles assigned ({assigned} new)")
     
+    @measured('user_permissions')
     def refresh_materialized_view(self):
-        """Refresh user_permissions materialized view"""
+        """Refresh user_permissions materialized view
+        
+        A materialized view can only be refreshed as a whole, so this is skipped
+        when this run assigned no roles, and done CONCURRENTLY (without blocking
+        readers) once the view is populated and has its unique index.
+        """
         print("\n🔄 Refreshing materialized view...")
         
+        assigned = self.metrics.stages.get('rbac_roles')
+        if assigned and assigned.finished is not None and not assigned.rows_written and not self.state.resumed:
+            print("⏭️  No roles assigned in this run, user_permissions is up to date")
+            return
+        
         try:
             with self.new_conn.cursor() as cur:
-                cur.execute("REFRESH MATERIALIZED VIEW user_permissions")
+                cur.execute("""
+                    SELECT c.relispopulated AND EXISTS (
+                        SELECT 1 FROM pg_index i
+                        WHERE i.indrelid = c.oid AND i.indisunique
+                        AND i.indpred IS NULL AND i.indexprs IS NULL
+                    )
+                    FROM pg_class c
+                    WHERE c.oid = 'user_permissions'::regclass
+                """)
+                concurrently = cur.fetchone()[0]
+                cur.execute(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrently else ''}user_permissions")
                 self.new_conn.commit()
-            print("✅ Materialized view refreshed")
+            print(f"✅ Materialized view refreshed{' concurrently' if concurrently else ''}")
         except Exception as e:
+            self.new_conn.rollback()
             print(f"⚠️  Could not refresh materialized view: {e}")
     
-    def print_summary(self):
-        """Print migration summary"""
+    def setup_sync(self):
+        """Create the publication and replication slot read by sync(); done before
+        the full load, the changes made during it are replayed by the sync"""
+        created = create_replication(self.old_conn, [mapping.source for mapping, _ in SYNC_TABLES])
+        print(f"✅ Replication slot {SYNC_SLOT} " + ("created" if created else "already exists"))
+    
+    def teardown_sync(self):
+        """Drop the replication slot and publication once the sync is no longer needed"""
+        drop_replication(self.old_conn)
+        print(f"✅ Dropped replication slot {SYNC_SLOT} and publication {SYNC_PUBLICATION}")
+    
+    @measured('sync')
+    def sync(self, metrics_path=None):
+        """Apply the old project's changes as they are committed, until interrupted
+        
+        Changes are gathered into micro-batches of up to SYNC_BATCH_ROWS rows
+        (or SYNC_BATCH_SECONDS), closed at a transaction boundary. A batch is
+        applied as the current source state of its rows: they are read through
+        their mapped SELECT and written as a full run writes them, and rows no
+        longer in the source are deleted. The slot is then confirmed past the
+        batch, and while nothing is pending it follows the server's WAL end.
+        Lag and throughput go to the progress lines and, every progress
+        interval, to `metrics_path`.
+        """
+        self.setup_sync()
+        stream = ChangeStream(OLD_PROJECT_DB_URL, {mapping.source: mapping.key for mapping, _ in SYNC_TABLES})
+        pending = {}
+        first_change = first_commit = last_commit = None
+        dumped = confirmed = time.monotonic()
+        print("\n🔁 Syncing changes from the old project (Ctrl-C to stop)...")
+        
+        try:
+            for event in stream.events(SYNC_BATCH_SECONDS):
+                if isinstance(event, Change):
+                    pending.setdefault(event.table, set()).add(event.key)
+                    first_change = first_change or time.monotonic()
+                    continue
+                if isinstance(event, Truncate):
+                    print(f"   ⚠️  {', '.join(event.tables)} truncated on the old project; "
+                          f"truncations are not synced, rerun the full migration")
+                    continue
+                if isinstance(event, Commit):
+                    first_commit = first_commit or event
+                    last_commit = event
+                    full = sum(len(keys) for keys in pending.values()) >= SYNC_BATCH_ROWS
+                    if not full and first_change and time.monotonic() - first_change < SYNC_BATCH_SECONDS:
+                        continue
+                
+                # A full or old enough batch, or the stream went quiet
+                if last_commit:
+                    self._apply_changes(pending)
+                    stream.confirm(last_commit.lsn)
+                    lag = (datetime.now(timezone.utc) - first_commit.committed_at).total_seconds()
+                    self.metrics.lag(lag, max(stream.wal_end - last_commit.lsn, 0))
+                    pending = {}
+                    first_change = first_commit = last_commit = None
+                    confirmed = time.monotonic()
+                elif event is None:
+                    self.metrics.lag(0.0, 0)    # caught up
+                    # Nothing to apply: let the slot follow the WAL the publication skipped
+                    if (not pending and not stream.in_transaction and stream.wal_end
+                            and time.monotonic() - confirmed >= SYNC_IDLE_CONFIRM_SECONDS):
+                        stream.confirm(stream.wal_end)
+                        confirmed = time.monotonic()
+                
+                if metrics_path and time.monotonic() - dumped >= (self.metrics.progress_seconds or 10):
+                    self.metrics.dump(metrics_path)
+                    dumped = time.monotonic()
+        except KeyboardInterrupt:
+            # Changes after the last confirmed batch stay in the slot for the next sync
+            print("\n⏹️  Sync stopped")
+        finally:
+            stream.close()
+    
+    def _apply_changes(self, pending):
+        """Write the current source state of the changed rows `pending` ({table: {key}})"""
+        gone = {}
+        for mapping, write in SYNC_TABLES:
+            keys = pending.get(mapping.source)
+            if not keys:
+                continue
+            compiled, transform = self._compile(mapping)
+            listed = ', '.join(f"'{UUID(key)}'" for key in keys)
+            with self.old_conn.cursor(cursor_factory=RealDictCursor) as old_cur:
+                old_cur.execute(compiled.query(f"WHERE {mapping.source}.{mapping.key} IN ({listed})", keyed=True))
+                rows = old_cur.fetchall()
+            self.old_conn.rollback()    # no transaction left open between batches
+            self.metrics.count(rows_read=len(keys))
+            
+            found = {str(row.pop('_key')) for row in rows}
+            if rows:
+                self.metrics.write(partial(self._write_rows, table=mapping.target, write=getattr(self, write)),
+                                   transform(rows))
+            gone[mapping] = sorted(keys - found)
+        
+        # Deleted rows go children first
+        for mapping, _ in reversed(SYNC_TABLES):
+            if gone.get(mapping):
+                self.metrics.write(partial(self._delete_rows, mapping), gone[mapping])
+    
+    def _delete_rows(self, mapping, keys):
+        """Delete the rows of `mapping`'s table with source keys `keys`; returns
+        the number deleted (rows still referenced are rejected)"""
+        with RowTransaction(self.new_conn, self.rejects, mapping.target) as tx:
+            for key in keys:
+                tx.write(key, {mapping.key: key}, self._delete_row, mapping, key)
+        return len(keys) - tx.rejected
+    
+    def _delete_row(self, mapping, key):
+        with self.new_conn.cursor() as new_cur:
+            new_cur.execute(f"DELETE FROM {mapping.target} WHERE {mapping.conflict} = %s", (key,))
+    
+    def extract(self, path):
+        """Write the source query rows of every migrated table to a snapshot in
+        `path`, for --load to replay (see migration.snapshot)"""
+        writer = SnapshotWriter(path)
+        schema = source_schema(self.old_conn)
+        for mapping in (PROFILES, COMPANIES, SERVICES, BOOKINGS):
+            with self.metrics.stage(mapping.source):
+                print(f"\n📦 Extracting {mapping.source}...")
+                query = self._compiled(mapping).query(keyed=True)
+                rows = self.metrics.read(stream_rows(self.old_conn, query, itersize=self.itersize))
+                extracted = writer.write_table(mapping.source, schema[mapping.source], rows)
+            print(f"✅ Extracted {extracted} {mapping.source}")
+        writer.close()
+        print(f"\n✅ Snapshot written to {path} ({writer.bytes / (1 << 20):.1f} MiB)")
+    
+    def verify(self, workers=VERIFY_WORKERS):
+        """Compare every migrated table with the old project by chunked checksums;
+        returns whether they all match"""
+        verifier = Verifier({'old': OLD_PROJECT_DB_URL, 'new': NEW_PROJECT_DB_URL}, 'new', workers)
+        return verified(verifier.run([
+            Check(mapping.target, [('old', mapping)])
+            for mapping in (PROFILES, COMPANIES, SERVICES, BOOKINGS)
+        ]))
+    
+    def print_summary(self, exact_counts=False):
+        """Print migration summary (from the run's counters; table sizes are
+        planner estimates unless `exact_counts`)"""
         print("\n" + "="*50)
         print("📊 MIGRATION SUMMARY")
         print("="*50)
         
-        with self.new_conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT COUNT(*) as count FROM profiles")
-            profiles = cur.fetchone()['count']
-            
-            cur.execute("SELECT COUNT(*) as count FROM companies")
-            companies = cur.fetchone()['count']
-            
-            cur.execute("SELECT COUNT(*) as count FROM services")
-            services = cur.fetchone()['count']
-            
-            cur.execute("SELECT COUNT(*) as count FROM bookings")
-            bookings = cur.fetchone()['count']
-            
-            print(f"✅ Profiles: {profiles}")
-            print(f"✅ Companies: {companies}")
-            print(f"✅ Services: {services}")
-            print(f"✅ Bookings: {bookings}")
+        self.metrics.print_tables(self.new_conn, ['profiles', 'companies', 'services', 'bookings'],
+                                  exact_counts)
+        if self.rejects.count:
+            print(f"⚠️  Rejected rows: {self.rejects.count} (see {self.rejects.path})")
         
+        print("-"*50)
+        self.metrics.print_stages()
         print("="*50)
         print("\n🎉 Migration completed!")
         print("\nNext steps:")
@@ -535,25 +907,147 @@ class CrossProjectMigrator:
 
 def main():
     """Main migration function"""
+    parser = argparse.ArgumentParser(description="Migrate data between separate Supabase projects")
+    parser.add_argument('--bulk-copy', action='store_true',
+                        help="load services and bookings with COPY through staging tables "
+                             "(fastest for a first-time load into an empty project)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only migrate rows changed since the last successful run")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue an interrupted run from its last checkpoint "
+                             "(use the same --chunks as the interrupted run)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="run independent stages in parallel on this many connections")
+    parser.add_argument('--chunks', type=int, default=None,
+                        help="split large tables into this many id ranges (default: --workers)")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="read the next batches from the old project while earlier ones are "
+                             "being written (profiles, companies, services, bookings)")
+    parser.add_argument('--pipeline-writers', type=int, default=1,
+                        help="with --pipeline, write each table on this many connections")
+    parser.add_argument('--adaptive-batches', action='store_true',
+                        help="grow or shrink each stage's transactions from the observed write latency, "
+                             "backing off on timeouts and lock failures")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="write per-stage metrics to FILE at the end "
+                             "(Prometheus text for .prom/.txt, JSON otherwise)")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="sample each stage's stacks and trace its allocations; write per-stage "
+                             "collapsed stacks (for flame graphs) and allocations.txt to DIR")
+    parser.add_argument('--bulk-load', action='store_true',
+                        help="drop secondary indexes and disable triggers of the loaded tables, write "
+                             "with asynchronous commit, then rebuild the indexes in parallel and ANALYZE")
+    parser.add_argument('--extract', metavar='DIR',
+                        help="instead of migrating, save the old project's mapped rows to a compressed "
+                             "local snapshot in DIR")
+    parser.add_argument('--load', metavar='DIR',
+                        help="migrate from the snapshot in DIR (see --extract) instead of the old project")
+    parser.add_argument('--sync', nargs='?', const='run', choices=['run', 'setup', 'teardown'],
+                        help="instead of migrating, apply the old project's changes continuously through "
+                             "logical replication until interrupted; 'setup' only creates the replication "
+                             "slot (do it before the full load), 'teardown' drops it")
+    parser.add_argument('--verify', action='store_true',
+                        help="instead of migrating, compare the new project's tables with the old "
+                             "project by chunked checksums (--workers ranges at a time)")
+    parser.add_argument('--exact-counts', action='store_true',
+                        help="count the new project's tables with COUNT(*) for the summary "
+                             "(default: planner estimates, no table scans)")
+    args = parser.parse_args()
+    if args.load and (args.bulk_copy or args.incremental or args.verify):
+        parser.error("--load replays a full snapshot: it can't be combined with "
+                     "--bulk-copy, --incremental or --verify")
+    
     print("🚀 Cross-Project Data Migration")
     print("="*50)
     
-    migrator = CrossProjectMigrator()
+    if args.verify:
+        matched = CrossProjectMigrator().verify(args.workers if args.workers > 1 else VERIFY_WORKERS)
+        sys.exit(0 if matched else 1)
+    
+    if args.sync:
+        migrator = CrossProjectMigrator()
+        profiler = Profiler(migrator.metrics) if args.profile and args.sync == 'run' else None
+        if profiler:
+            profiler.start()
+        migrator.metrics.start_progress()
+        try:
+            migrator.connect(new=args.sync == 'run')
+            if args.sync == 'setup':
+                migrator.setup_sync()
+            elif args.sync == 'teardown':
+                migrator.teardown_sync()
+            else:
+                migrator.sync(args.metrics)
+        finally:
+            migrator.metrics.stop_progress()
+            if args.metrics and args.sync == 'run':
+                migrator.metrics.dump(args.metrics)
+            if profiler:
+                profiler.stop()
+                profiler.write(args.profile)
+                print(f"🔬 Stage profiles written to {args.profile}")
+            migrator.close()
+        return
+    
+    if args.extract:
+        migrator = CrossProjectMigrator()
+        try:
+            migrator.connect(new=False)
+            migrator.extract(args.extract)
+        finally:
+            migrator.close()
+        return
+    
+    try:
+        snapshot = Snapshot(args.load) if args.load else None
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    
+    # A snapshot keeps its own state (watermarks, checkpoints) apart from the live old project
+    source = snapshot.name if snapshot else OLD_PROJECT_DB_URL
+    state = MigrationState.for_run('migrate_between_projects', source, NEW_PROJECT_DB_URL,
+                                   resume=args.resume)
+    if args.resume:
+        print("♻️  Resuming from checkpoint" if state.resumed else "⚠️  No checkpoint found, starting from the beginning")
+    migrator = CrossProjectMigrator(bulk_copy=args.bulk_copy, state=state, incremental=args.incremental,
+                                    pipeline_writers=args.pipeline_writers if args.pipeline else 0,
+                                    bulk_load=args.bulk_load, snapshot=snapshot,
+                                    adaptive_batches=args.adaptive_batches)
+    profiler = Profiler(migrator.metrics) if args.profile else None
+    if profiler:
+        profiler.start()
+    migrator.metrics.start_progress()
     
     try:
         # Connect to both projects
         migrator.connect()
         
+        bulk_load = args.bulk_load or migrator.bulk_load_interrupted()
+        if args.bulk_load:
+            migrator.start_bulk_load()
+        elif bulk_load:
+            print("⚠️  An interrupted --bulk-load left indexes dropped; they are rebuilt after this run")
+        
         # Migrate data
-        migrator.migrate_profiles()
-        migrator.migrate_companies()
-        migrator.migrate_services()
-        migrator.migrate_bookings()
-        migrator.assign_rbac_roles()
-        migrator.refresh_materialized_view()
+        try:
+            if args.workers > 1:
+                migrator.run_parallel(args.workers, args.chunks or args.workers)
+            else:
+                migrator.migrate_profiles()
+                migrator.migrate_companies()
+                migrator.migrate_services()
+                migrator.migrate_bookings()
+                migrator.assign_rbac_roles()
+                migrator.refresh_materialized_view()
+        finally:
+            if bulk_load:
+                migrator.finish_bulk_load()
+        
+        migrator.save_state()
         
         # Print summary
-        migrator.print_summary()
+        migrator.print_summary(args.exact_counts)
         
     except Exception as e:
         print(f"\n❌ Error during migration: {e}")
@@ -561,6 +1055,14 @@ def main():
         traceback.print_exc()
         sys.exit(1)
     finally:
+        migrator.metrics.stop_progress()
+        if args.metrics:
+            migrator.metrics.dump(args.metrics)
+            print(f"📈 Metrics written to {args.metrics}")
+        if profiler:
+            profiler.stop()
+            profiler.write(args.profile)
+            print(f"🔬 Stage profiles written to {args.profile}")
         migrator.close()
 
 if __name__ == "__main__":
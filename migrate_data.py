@@ -17,14 +17,28 @@ Requirements:
 Usage:
     1. Create a .env file with database connection strings
     2. Run: python migrate_data.py
+       (add --workers 4 to migrate independent tables in parallel,
+        --pipeline to overlap reading the sources with writing the unified DB)
 """
 
 import os
 import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import psycopg2
-from psycopg2.extras import execute_values, RealDictCursor
+from psycopg2.extras import execute_values, RealDictCursor, Json
+from psycopg2.extensions import register_adapter
 from psycopg2 import sql
 from dotenv import load_dotenv
+from migration import (
+    stream_rows, where_clause, Stage, run_stages, key_range_condition,
+    TargetIndex, MigrationState, changed_since_condition, after_key_condition,
+    RowTransaction, RejectLog, COMMIT_ROWS, ROW_ERRORS, Metrics, measured, estimate_rows,
+    write_batches, batched, prepared_statements, placeholders, ROWS_PER_ROUND_TRIP,
+    TableMapping, Column, Sql, IdMap, ship_id_map, drop_id_maps, remapped_columns, update_references,
+    Check, Verifier, verified, VERIFY_WORKERS, MergeSet, BACK_OFF_ERRORS, Profiler
+)
 from uuid import UUID
 from datetime import datetime
 
@@ -36,15 +50,214 @@ CONTRACT_DB_URL = os.getenv('CONTRACT_DB_URL')  # Contract-Management-System Sup
 SERVICES_DB_URL = os.getenv('SERVICES_DB_URL')  # business-services-hub Supabase URL
 UNIFIED_DB_URL = os.getenv('UNIFIED_DB_URL')    # New unified Supabase URL
 
+# Rows written per set-based statement (1 = legacy row-by-row writes)
+BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '1000'))
+
+# JSONB columns (address, preferences, metadata) come back from the source as dicts
+register_adapter(dict, Json)
+
+
+def slugify(name):
+    """Generate slug from name"""
+    slug = name.lower().replace(' ', '-').replace('/', '-')
+    return ''.join(c if c.isalnum() or c == '-' else '' for c in slug)
+
+
+# slugify() computed by the source server. Only for ASCII names: Python's
+# lower() and isalnum() know all of Unicode, the server's regex classes depend
+# on its locale. Other names are left null and slugified in Python. ASCII is
+# tested by code point, which holds in every server encoding (byte counts
+# only tell it apart in UTF-8). translate() rather than LOWER() keeps it
+# locale-free.
+SLUG_SQL = Sql("""CASE WHEN name !~ '[^\\x01-\\x7f]' THEN regexp_replace(
+        translate(name, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ /', 'abcdefghijklmnopqrstuvwxyz--'),
+        '[^a-z0-9-]+', '', 'g')
+    END""", 'name')
+
+
+# Source service status → unified status (anything else becomes active)
+SERVICE_STATUSES = {
+    'active': 'active',
+    'inactive': 'inactive',
+    'draft': 'draft',
+    'pending': 'pending',
+    'approved': 'active',
+    'rejected': 'inactive'
+}
+
+# Unified DB tables the ID maps are shipped to for the services and references stages
+PROFILE_MAP_TABLE = 'migration_profile_id_map'
+COMPANY_MAP_TABLE = 'migration_company_id_map'
+
+# Service columns remapped on the unified DB, per source: (mapping table, ids it lacks are
+# 'keep'-t, None-d, or kept only if the named table has them); see migration.remap
+SERVICE_REMAPS = {
+    'contract': {
+        'provider_id': (PROFILE_MAP_TABLE, None),
+        'provider_company_id': (COMPANY_MAP_TABLE, 'companies'),
+    },
+    'services': {
+        'provider_id': (PROFILE_MAP_TABLE, 'keep'),
+    },
+}
+
+# Unified references rewritten once the ID maps are shipped: (table, column, mapping table)
+COMPANY_REFERENCES = [
+    ('profiles', 'company_id', COMPANY_MAP_TABLE),
+    ('bookings', 'client_id', PROFILE_MAP_TABLE),
+    ('bookings', 'provider_id', PROFILE_MAP_TABLE),
+    ('bookings', 'provider_company_id', COMPANY_MAP_TABLE),
+]
+
+# Match keys and field precedence of the profiles and companies merge (see migration.merge)
+PROFILE_MERGE = dict(keys=('email',), protected=('id', 'email'), greatest=('updated_at',))
+COMPANY_MERGE = dict(keys=('slug', 'name'), protected=('id', 'slug', 'name'))
+
+# Service columns an existing unified service takes from the source
+SERVICE_UPDATES = ['title', 'description', 'price', 'status']
+
+# Source tables → unified columns (service ids are remapped on write, see SERVICE_REMAPS)
+CONTRACT_PROFILES = TableMapping('profiles', [
+    Column('id', 'user_id', 'id'),
+    Column('email'),
+    Column('full_name'),
+    Column('phone'),
+    Column('address'),
+    Column('preferences'),
+    Column('created_at'),
+    Column('updated_at'),
+])
+
+HUB_PROFILES = TableMapping('profiles', [
+    Column('id'),
+    Column('email'),
+    Column('full_name'),
+    Column('phone'),
+    Column('country'),
+    Column('company_id'),  # Will be mapped later
+    Column('is_verified'),
+    Column('role'),
+    Column('created_at'),
+    Column('updated_at'),
+])
+
+CONTRACT_COMPANIES = TableMapping('companies', [
+    Column('id'),
+    Column('name'),
+    Column('slug'),
+    Column('description'),
+    Column('logo_url'),
+    Column('website'),
+    Column('email'),
+    Column('phone'),
+    Column('address'),
+    Column('status', 'is_active', values={True: 'active'}, otherwise='inactive'),
+    Column('created_at'),
+    Column('updated_at'),
+])
+
+HUB_COMPANIES = TableMapping('companies', [
+    Column('id'),
+    Column('name'),
+    Column('slug', SLUG_SQL, fallback=lambda row: row['name'] and slugify(row['name'])),
+    Column('logo_url'),
+    Column('cr_number'),
+    Column('vat_number'),
+    Column('status', Sql("'active'")),
+    Column('created_at'),
+])
+
+CONTRACT_SERVICES = TableMapping('services', [
+    Column('id'),
+    Column('provider_id', 'created_by'),
+    Column('provider_company_id', 'company_id'),
+    Column('title', 'name'),
+    Column('description'),
+    Column('category'),
+    Column('price', 'price_base'),
+    Column('currency', 'price_currency', default='USD', blank_is_null=True),
+    Column('duration_minutes'),
+    Column('max_participants'),
+    Column('status', values=SERVICE_STATUSES, otherwise='active'),
+    Column('metadata', default=Sql("'{}'")),
+    Column('created_at'),
+    Column('updated_at'),
+], update=SERVICE_UPDATES)
+
+HUB_SERVICES = TableMapping('services', [
+    Column('id'),
+    Column('provider_id'),
+    Column('title'),
+    Column('description'),
+    Column('category'),
+    Column('price', 'base_price'),
+    Column('currency', default='USD', blank_is_null=True),
+    Column('location'),
+    Column('tags'),
+    Column('requirements'),
+    Column('cover_image_url'),
+    Column('featured'),
+    Column('rating', default=0),
+    Column('review_count', default=0),
+    Column('booking_count', default=0),
+    Column('status', Sql("""CASE
+        WHEN status::text IS DISTINCT FROM 'active'
+          OR COALESCE(approval_status::text, '') NOT IN ('', 'approved') THEN 'pending'
+        ELSE 'active'
+    END""", 'status', 'approval_status'), Sql("""CASE
+        WHEN status::text IS DISTINCT FROM 'active' THEN 'pending'
+        ELSE 'active'
+    END""", 'status'), default='active'),
+    Column('created_at'),
+    Column('updated_at'),
+], update=SERVICE_UPDATES)
+
 class DataMigrator:
-    def __init__(self):
+    def __init__(self, batch_size=BATCH_SIZE, refresh_index=False, state=None, incremental=False,
+                 metrics=None, pipeline=False, adaptive_batches=False):
         self.contract_conn = None
         self.services_conn = None
         self.unified_conn = None
+        self.batch_size = batch_size
+        self.itersize = max(batch_size, 2000)
+        
+        # Rows per transaction: one set-based batch, or COMMIT_ROWS savepointed
+        # rows when writing row by row
+        self.commit_rows = batch_size if batch_size > 1 else COMMIT_ROWS
+        
+        # Existing unified companies/profiles, loaded once; reloaded per stage if refresh_index
+        self.target_index = TargetIndex()
+        self.refresh_index = refresh_index
+        
+        # Source id range handled by this migrator (None = whole table)
+        self.key_range = None
+        
+        # ID mapping tables (compact UUID maps; see migration.idmap)
+        self.profile_id_map = IdMap()
+        self.company_id_map = IdMap()
+        
+        # Watermarks, saved ID maps and checkpoints; incremental runs only read rows
+        # changed since the last run, resumed runs continue after the last committed batch
+        self.state = state or MigrationState()
+        self.incremental = incremental
+        if incremental or self.state.resumed:
+            self.profile_id_map = self.state.load_id_map('profile_id_map')
+            self.company_id_map = self.state.load_id_map('company_id_map')
+        
+        # Rows the unified DB refused; they are logged and skipped instead of aborting the run
+        self.rejects = RejectLog()
+        
+        # Per-stage row counts, timings and round trips (shared with forked workers)
+        self.metrics = metrics or Metrics('migrate_data')
         
-        # ID mapping tables
-        self.profile_id_map = {}
-        self.company_id_map = {}
+        # Read and map the next batches while the previous one is being written
+        self.pipeline = pipeline
+        
+        # Tune commit_rows per stage from the observed write latency (see migration.batching)
+        self.adaptive_batches = adaptive_batches
+        
+        # Whether this session's services staging table exists (see _create_services_stage)
+        self._services_stage = False
         
     def connect(self):
         """Connect to all three databases"""
@@ -52,19 +265,19 @@ class DataMigrator:
         
         try:
             if CONTRACT_DB_URL:
-                self.contract_conn = psycopg2.connect(CONTRACT_DB_URL)
+                self.contract_conn = self.metrics.connect(CONTRACT_DB_URL)
                 print("✅ Connected to Contract-Management-System")
             else:
                 print("⚠️  CONTRACT_DB_URL not set, skipping Contract-Management-System")
                 
             if SERVICES_DB_URL:
-                self.services_conn = psycopg2.connect(SERVICES_DB_URL)
+                self.services_conn = self.metrics.connect(SERVICES_DB_URL)
                 print("✅ Connected to business-services-hub")
             else:
                 print("⚠️  SERVICES_DB_URL not set, skipping business-services-hub")
                 
             if UNIFIED_DB_URL:
-                self.unified_conn = psycopg2.connect(UNIFIED_DB_URL)
+                self.unified_conn = self.metrics.connect(UNIFIED_DB_URL)
                 print("✅ Connected to unified database")
             else:
                 print("❌ UNIFIED_DB_URL is required!")
@@ -83,382 +296,776 @@ class DataMigrator:
         if self.unified_conn:
             self.unified_conn.close()
     
+    def fork(self, key_range=None):
+        """Create a migrator on its own connections that shares this one's ID maps"""
+        worker = DataMigrator(self.batch_size, self.refresh_index, self.state, metrics=self.metrics,
+                              pipeline=self.pipeline, adaptive_batches=self.adaptive_batches)
+        worker.incremental = self.incremental
+        worker.profile_id_map = self.profile_id_map
+        worker.company_id_map = self.company_id_map
+        worker.target_index = self.target_index
+        worker.rejects = self.rejects
+        worker.key_range = key_range
+        
+        if self.contract_conn:
+            worker.contract_conn = self.metrics.connect(CONTRACT_DB_URL)
+        if self.services_conn:
+            worker.services_conn = self.metrics.connect(SERVICES_DB_URL)
+        worker.unified_conn = self.metrics.connect(UNIFIED_DB_URL)
+        return worker
+    
+    def _index(self):
+        """The unified DB key index, loaded on first use"""
+        return self.target_index.load(self.unified_conn)
+    
+    def _refresh_index(self):
+        """Reload the key index at the start of a stage when refresh_index is set"""
+        if self.refresh_index:
+            self.target_index.load(self.unified_conn, refresh=True)
+    
+    def _source_filter(self, source, table, changed_column="COALESCE(updated_at, created_at)"):
+        """WHERE clause limiting a source query to this migrator's id range and,
+        in incremental mode, to rows changed since the last successful run"""
+        since = self.state.since(source, table) if self.incremental else None
+        if since:
+            print(f"   ↪ {source}.{table}: rows changed since {since.isoformat()}")
+        after = self.state.position(self._checkpoint_name(source, table))
+        if after:
+            print(f"   ↪ {source}.{table}: resuming after {after}")
+        if not since:
+            conn = self.contract_conn if source == 'contract' else self.services_conn
+            self.metrics.expect(estimate_rows(conn, table, self.key_range, after))
+        return where_clause(
+            key_range_condition(self.key_range),
+            changed_since_condition(since, changed_column),
+            after_key_condition(after)
+        )
+    
+    def _extract(self, source, mapping, keyed=False, **filter_args):
+        """Stream the rows of `mapping` from `source`, compiled against its schema;
+        returns (rows, transform). Keyed rows become (old_id, row) pairs."""
+        conn = self.contract_conn if source == 'contract' else self.services_conn
+        compiled = mapping.compile(conn)
+        query = compiled.query(self._source_filter(source, mapping.source, **filter_args), keyed=keyed)
+        rows = self.state.track(source, mapping.source, self.metrics.read(
+            stream_rows(conn, query, itersize=self.itersize)))
+        return rows, compiled.transformer(keyed=keyed)
+    
+    def _checkpoint_name(self, source, table):
+        """Checkpoint name of a source table within this migrator's id range"""
+        if self.key_range:
+            lo, hi = self.key_range
+            return f"{source}.{table}[{lo or ''}:{hi or ''}]"
+        return f"{source}.{table}"
+    
+    def _already_migrated(self, source, table):
+        """True (and say so) when the run being resumed already finished this source table"""
+        if self.state.is_complete(self._checkpoint_name(source, table)):
+            print(f"   ⏭️  {source}.{table} already migrated")
+            return True
+        return False
+    
+    def _checkpoint(self, source, table, last_key, **old_ids):
+        """Record that a source table is committed up to `last_key`
+        
+        Keyword arguments name an ID map and the old ids of the batch, so the
+        entries the batch added to it (rejected rows have none) are saved with
+        the checkpoint.
+        """
+        id_maps = {name: getattr(self, name) for name in old_ids}
+        self.state.checkpoint(self._checkpoint_name(source, table), last_key, {
+            name: [(old_id, id_maps[name][old_id]) for old_id in ids if old_id in id_maps[name]]
+            for name, ids in old_ids.items()
+        })
+    
+    def save_state(self):
+        """Advance watermarks and save ID maps after a successful run"""
+        self.state.save({
+            'profile_id_map': self.profile_id_map,
+            'company_id_map': self.company_id_map,
+        })
+    
+    def _run_stage(self, method, key_range=None):
+        """Run one migrate_* method on a forked migrator"""
+        worker = self.fork(key_range)
+        try:
+            getattr(worker, method)()
+        finally:
+            worker.close()
+    
+    def run_parallel(self, workers, chunks=1):
+        """Run the migration stages concurrently, as far as their dependencies allow
+        
+        Profiles and companies are independent; their ID maps are then shipped
+        to the unified DB, where services (split into `chunks` id ranges) and
+        references are remapped.
+        """
+        run_stages([
+            Stage('profiles', partial(self._run_stage, 'migrate_profiles')),
+            Stage('companies', partial(self._run_stage, 'migrate_companies')),
+            Stage('id_maps', partial(self._run_stage, 'ship_id_maps'),
+                  depends_on=['profiles', 'companies']),
+            Stage('services', partial(self._run_stage, 'migrate_services'),
+                  depends_on=['id_maps'], chunks=chunks),
+            Stage('company_references', partial(self._run_stage, 'update_company_references'),
+                  depends_on=['id_maps']),
+        ], workers)
+    
+    def _migrate_rows(self, source, table, rows, transform, flush):
+        """Map batches of source rows with `transform` and write them with `flush` in
+        commit_rows batches, checkpointing after each; returns the number written
+        
+        `transform` maps a whole batch. When pipelined, reading, mapping and
+        writing overlap.
+        """
+        def checkpoint(batch, written):
+            self._checkpoint(source, table, batch[-1]['id'])
+        
+        sizer = self._batch_sizer()
+        total = write_batches(
+            self.metrics, self.metrics.batches(rows, sizer or self.commit_rows), [flush], checkpoint,
+            transform=transform, pipeline=self.pipeline, sizer=sizer
+        )
+        self.state.complete(self._checkpoint_name(source, table))
+        return total
+    
+    def _batch_sizer(self):
+        """The current stage's AdaptiveBatches, or None with fixed commit_rows batches"""
+        return self.metrics.batch_sizer(self.commit_rows) if self.adaptive_batches else None
+    
+    def _merge_sources(self, table, extracts, merge, flush, id_map):
+        """Read `table` from both databases at once, merge the rows into one
+        entity per match key and write each entity once; returns the number of
+        entities written
+        
+        `extracts` lists (source, mapping, filter arguments); each source is
+        read on its own thread into a MergeSet (`merge` gives its keys and
+        precedence), and the sets are folded together in that order, so rows
+        merge as if the sources had been written one after the other. Flushes
+        take (old_ids, row) pairs and record every old id in the ID map named
+        `id_map`. A resumed run merges again and skips the entities whose old
+        ids all have ID map entries journaled with the checkpoints: matching by
+        content rather than position, since the sources may have changed since
+        the interrupted run.
+        """
+        extracts = [(source, mapping, filter_args) for source, mapping, filter_args in extracts
+                    if (self.contract_conn if source == 'contract' else self.services_conn)
+                    and not self._already_migrated(source, table)]
+        if not extracts:
+            return 0
+        
+        def extract(source, mapping, filter_args, merged):
+            rows, transform = self._extract(source, mapping, keyed=True, **filter_args)
+            for batch in batched(rows, self.itersize):
+                for old_id, row in transform(batch):
+                    merged.add([old_id], row)
+        
+        sets = [MergeSet(**merge) for _ in extracts]
+        try:
+            with ThreadPoolExecutor(max_workers=len(extracts), thread_name_prefix='extract') as pool:
+                reads = [pool.submit(self.metrics.bind(extract), *args, merged)
+                         for args, merged in zip(extracts, sets)]
+                for read in reads:
+                    read.result()
+            merged = sets[0]
+            for other in sets[1:]:
+                merged.update(other)
+            print(f"   🔀 {merged.rows} source rows merged into {len(merged)} {table}"
+                  + (" (spilled to disk)" if merged.spilled else ""))
+            
+            name = self._checkpoint_name('merged', table)
+            done = int(self.state.position(name) or 0)
+            entities = iter(merged)
+            if done:
+                written = self.state.journaled(id_map)
+                print(f"   ↪ {table}: resuming, skipping entities already written ({len(written)} source rows)")
+                entities = ((old_ids, row) for old_ids, row in merged
+                            if not all(old_id in written for old_id in old_ids))
+            
+            def checkpoint(batch, written):
+                nonlocal done
+                done += len(batch)
+                self._checkpoint('merged', table, done,
+                                 **{id_map: [old_id for old_ids, _ in batch for old_id in old_ids]})
+            
+            sizer = self._batch_sizer()
+            total = write_batches(
+                self.metrics, self.metrics.batches(entities, sizer or self.commit_rows),
+                [flush], checkpoint, pipeline=self.pipeline, sizer=sizer
+            )
+        finally:
+            for merged in sets:
+                merged.close()
+        
+        for source, _, _ in extracts:
+            self.state.complete(self._checkpoint_name(source, table))
+        self.state.complete(name)
+        return total
+    
+    @measured('profiles')
     def migrate_profiles(self):
-        """Migrate profiles from both databases"""
+        """Migrate profiles from both databases, merged by email"""
         print("\n📋 Migrating profiles...")
+        self._refresh_index()
         
-        total_migrated = 0
+        total_migrated = self._merge_sources('profiles', [
+            ('contract', CONTRACT_PROFILES, {}),    # Contract-Management-System
+            ('services', HUB_PROFILES, {}),         # business-services-hub
+        ], PROFILE_MERGE, self._flush_profiles, 'profile_id_map')
         
-        # Migrate from Contract-Management-System
-        if self.contract_conn:
-            with self.contract_conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id, user_id, email, full_name, avatar_url, phone, 
-                           address, preferences, created_at, updated_at
-                    FROM profiles
-                """)
-                
-                for row in cur.fetchall():
-                    old_id = row['id']
-                    new_id = self._insert_or_update_profile(
-                        id=row['user_id'] or row['id'],
-                        email=row['email'],
-                        full_name=row['full_name'],
-                        phone=row['phone'],
-                        address=row['address'],
-                        preferences=row['preferences'],
-                        created_at=row['created_at'],
-                        updated_at=row['updated_at']
-                    )
-                    self.profile_id_map[old_id] = new_id
-                    total_migrated += 1
+        print(f"✅ Migrated {total_migrated} profiles")
+    
+    def _flush_profiles(self, pending):
+        """Write a batch of (old_ids, profile) pairs and record their new ids"""
+        index = self._index()     # loads (and commits) before the transaction below starts
+        new_ids = None
+        if self.batch_size > 1:
+            try:
+                new_ids = self._upsert_profiles_batch([profile for _, profile in pending])
+            except BACK_OFF_ERRORS:
+                self.unified_conn.rollback()
+                raise
+            except ROW_ERRORS as e:
+                self.unified_conn.rollback()
+                print(f"   ⚠️  Profile batch failed, retrying row by row: {str(e).splitlines()[0]}")
         
-        # Migrate from business-services-hub
-        if self.services_conn:
-            with self.services_conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id, email, full_name, phone, country, company_id, 
-                           is_verified, role, created_at, updated_at
-                    FROM profiles
-                """)
-                
-                for row in cur.fetchall():
-                    old_id = row['id']
-                    new_id = self._insert_or_update_profile(
-                        id=row['id'],
-                        email=row['email'],
-                        full_name=row['full_name'],
-                        phone=row['phone'],
-                        country=row['country'],
-                        company_id=row['company_id'],  # Will be mapped later
-                        is_verified=row['is_verified'],
-                        role=row['role'],
-                        created_at=row['created_at'],
-                        updated_at=row['updated_at']
-                    )
-                    self.profile_id_map[old_id] = new_id
-                    total_migrated += 1
+        if new_ids is None:
+            with RowTransaction(self.unified_conn, self.rejects, 'profiles') as tx:
+                new_ids = self._write_profile_rows(tx, pending)
         
-        print(f"✅ Migrated {total_migrated} profiles")
+        written = 0
+        for (old_ids, profile), new_id in zip(pending, new_ids):
+            if new_id is None:
+                continue    # rejected
+            for old_id in old_ids:
+                self.profile_id_map[old_id] = new_id
+            if not index.has_profile(new_id):
+                index.add_profile(new_id, profile['email'])
+            written += 1
+        
+        return written
     
-    def _insert_or_update_profile(self, **kwargs):
-        """Insert or update a profile in unified database"""
-        with self.unified_conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Check if profile exists by email
-            cur.execute("SELECT id FROM profiles WHERE email = %s", (kwargs['email'],))
-            existing = cur.fetchone()
+    def _upsert_profiles_batch(self, profiles):
+        """Upsert a batch of profiles with set-based statements, returning new ids in order"""
+        if len({tuple(profile) for profile in profiles}) > 1:
+            return self._by_shape(profiles, self._upsert_profiles_batch)
+        
+        # A reused id under a different email must see the earlier row committed first
+        seen_ids = {}
+        for i, profile in enumerate(profiles):
+            if seen_ids.setdefault(profile['id'], profile['email']) != profile['email']:
+                return self._upsert_profiles_batch(profiles[:i]) + self._upsert_profiles_batch(profiles[i:])
+        
+        merged, positions = self._merge_batch(profiles, **PROFILE_MERGE)
+        fields = list(merged[0].keys())
+        columns = ', '.join(fields)
+        assignments = [f"{f} = COALESCE(s.{f}, p.{f})" for f in fields if f not in ('id', 'email', 'updated_at')]
+        if 'updated_at' in fields:
+            assignments.append("updated_at = GREATEST(p.updated_at, s.updated_at)")
+        
+        with self.unified_conn.cursor() as cur:
+            cur.execute(f"""
+                CREATE TEMP TABLE _stage_profiles ON COMMIT DROP AS
+                SELECT {columns} FROM profiles WITH NO DATA
+            """)
+            execute_values(
+                cur,
+                f"INSERT INTO _stage_profiles ({columns}) VALUES %s",
+                [tuple(profile[f] for f in fields) for profile in merged],
+                page_size=len(merged)
+            )
             
-            if existing:
-                # Update existing profile
-                update_fields = []
-                update_values = []
-                
-                for key, value in kwargs.items():
-                    if key != 'email' and key != 'id' and value is not None:
-                        update_fields.append(f"{key} = %s")
-                        update_values.append(value)
-                
-                update_values.append(kwargs['email'])
-                
-                cur.execute(f"""
-                    UPDATE profiles 
-                    SET {', '.join(update_fields)}, updated_at = GREATEST(updated_at, %s)
-                    WHERE email = %s
-                    RETURNING id
-                """, update_values + [datetime.now(), kwargs['email']])
-                
-                return cur.fetchone()['id']
+            # Existing profiles matched by email keep their id and take non-null fields
+            cur.execute(f"""
+                UPDATE profiles p
+                SET {', '.join(assignments)}
+                FROM _stage_profiles s
+                WHERE p.email = s.email
+            """)
+            
+            cur.execute(f"""
+                INSERT INTO profiles ({columns})
+                SELECT {columns} FROM _stage_profiles s
+                WHERE NOT EXISTS (SELECT 1 FROM profiles p WHERE p.email = s.email)
+                ON CONFLICT (id) DO UPDATE SET
+                    email = EXCLUDED.email,
+                    full_name = COALESCE(EXCLUDED.full_name, profiles.full_name),
+                    updated_at = GREATEST(profiles.updated_at, EXCLUDED.updated_at)
+            """)
+            
+            cur.execute("""
+                SELECT s.email, p.id
+                FROM _stage_profiles s
+                JOIN profiles p ON p.email = s.email
+            """)
+            ids_by_email = dict(cur.fetchall())
+        
+        self.unified_conn.commit()
+        return [ids_by_email[merged[pos]['email']] for pos in positions]
+    
+    @staticmethod
+    def _by_shape(rows, upsert):
+        """`upsert` the rows of each set of columns apart (rows merged from both
+        databases have the columns of both); returns the new ids in order"""
+        shapes = {}
+        for i, row in enumerate(rows):
+            shapes.setdefault(tuple(row), []).append(i)
+        new_ids = [None] * len(rows)
+        for positions in shapes.values():
+            for i, new_id in zip(positions, upsert([rows[i] for i in positions])):
+                new_ids[i] = new_id
+        return new_ids
+    
+    @staticmethod
+    def _merge_batch(rows, keys, protected, greatest=()):
+        """Collapse rows that share a match key, as sequential row-by-row updates would
+        
+        Returns the merged rows and, for every input row, the index of its merged row.
+        Later non-null values win, except for protected fields and `greatest` fields.
+        """
+        merged = []
+        positions = []
+        index = {}
+        
+        for row in rows:
+            pos = next(
+                (index[(k, row[k])] for k in keys if row.get(k) is not None and (k, row[k]) in index),
+                None
+            )
+            if pos is None:
+                pos = len(merged)
+                merged.append(dict(row))
+                for k in keys:
+                    if row.get(k) is not None:
+                        index.setdefault((k, row[k]), pos)
             else:
-                # Insert new profile
-                fields = list(kwargs.keys())
-                values = list(kwargs.values())
-                placeholders = ['%s'] * len(values)
-                
-                cur.execute(f"""
-                    INSERT INTO profiles ({', '.join(fields)})
-                    VALUES ({', '.join(placeholders)})
-                    ON CONFLICT (id) DO UPDATE SET
-                        email = EXCLUDED.email,
-                        full_name = COALESCE(EXCLUDED.full_name, profiles.full_name),
-                        updated_at = GREATEST(profiles.updated_at, EXCLUDED.updated_at)
+                target = merged[pos]
+                for k, v in row.items():
+                    if k in protected or v is None:
+                        continue
+                    if k in greatest and target.get(k) is not None:
+                        v = max(v, target[k])
+                    target[k] = v
+            positions.append(pos)
+        
+        return merged, positions
+    
+    def _write_profile_rows(self, tx, pending):
+        """Write (old_ids, profile) pairs row by row in `tx`, up to ROWS_PER_ROUND_TRIP
+        per round trip; returns their new ids (None where rejected)"""
+        index = self._index()
+        statements = prepared_statements(self.unified_conn)
+        new_ids = []
+        group, inserts, emails = [], [], set()
+        
+        def send():
+            ids = tx.write_all(group)
+            for (email, insert), new_id in zip(inserts, ids):
+                if insert and new_id is not None:
+                    index.add_profile(new_id, email)
+            new_ids.extend(ids)
+            group.clear()
+            inserts.clear()
+            emails.clear()
+        
+        with self.unified_conn.cursor() as cur:
+            for old_ids, profile in pending:
+                # A row must see the profile an earlier row of its group inserts
+                if profile['email'] in emails or len(group) == ROWS_PER_ROUND_TRIP:
+                    send()
+                shape, build, params, profile_id = self._profile_upsert(index, profile)
+                group.append((old_ids[0], profile, statements.bind(cur, shape, build, params), profile_id,
+                              partial(self._insert_or_update_profile, **profile)))
+                inserts.append((profile['email'], shape[1] == 'insert'))
+                emails.add(profile['email'])
+            send()
+        
+        return new_ids
+    
+    @staticmethod
+    def _profile_upsert(index, kwargs):
+        """(shape, build, params, id) of the prepared statement writing one profile:
+        an update of the existing profile with its email, or an insert"""
+        existing = index.find_profile(kwargs['email'])
+        
+        if existing:
+            # Null fields keep their current value
+            fields = [key for key in kwargs if key not in ['email', 'id', 'updated_at']]
+            
+            def build():
+                assignments = [f"{field} = COALESCE(${i}, {field})" for i, field in enumerate(fields, 1)]
+                assignments.append(f"updated_at = GREATEST(updated_at, ${len(fields) + 1})")
+                return f"""
+                    UPDATE profiles 
+                    SET {', '.join(assignments)}
+                    WHERE email = ${len(fields) + 2}
                     RETURNING id
-                """, values)
-                
-                result = cur.fetchone()
-                self.unified_conn.commit()
-                return result['id'] if result else kwargs.get('id')
+                """
+            
+            params = [kwargs[field] for field in fields] + [kwargs.get('updated_at'), kwargs['email']]
+            return ('profiles', 'update', tuple(fields)), build, params, existing
+        
+        fields = list(kwargs.keys())
+        
+        def build():
+            return f"""
+                INSERT INTO profiles ({', '.join(fields)})
+                VALUES ({placeholders(len(fields))})
+                ON CONFLICT (id) DO UPDATE SET
+                    email = EXCLUDED.email,
+                    full_name = COALESCE(EXCLUDED.full_name, profiles.full_name),
+                    updated_at = GREATEST(profiles.updated_at, EXCLUDED.updated_at)
+                RETURNING id
+            """
+        
+        return ('profiles', 'insert', tuple(fields)), build, list(kwargs.values()), kwargs.get('id')
     
+    def _insert_or_update_profile(self, **kwargs):
+        """Insert or update a profile in unified database"""
+        index = self._index()
+        shape, build, params, profile_id = self._profile_upsert(index, kwargs)
+        
+        with self.unified_conn.cursor(cursor_factory=RealDictCursor) as cur:
+            prepared_statements(self.unified_conn).execute(cur, shape, build, params)
+            result = cur.fetchone()
+        
+        if shape[1] == 'update':
+            return result['id']
+        
+        profile_id = result['id'] if result else profile_id
+        index.add_profile(profile_id, kwargs['email'])
+        return profile_id
+    
+    @measured('companies')
     def migrate_companies(self):
-        """Migrate companies from both databases"""
+        """Migrate companies from both databases, merged by slug or name"""
         print("\n🏢 Migrating companies...")
+        self._refresh_index()
         
-        total_migrated = 0
+        total_migrated = self._merge_sources('companies', [
+            ('contract', CONTRACT_COMPANIES, {}),
+            ('services', HUB_COMPANIES, {'changed_column': 'created_at'}),
+        ], COMPANY_MERGE, self._flush_companies, 'company_id_map')
         
-        # Migrate from Contract-Management-System
-        if self.contract_conn:
-            with self.contract_conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id, name, slug, description, logo_url, website, 
-                           email, phone, address, settings, is_active, 
-                           created_at, updated_at
-                    FROM companies
-                """)
-                
-                for row in cur.fetchall():
-                    old_id = row['id']
-                    new_id = self._insert_or_update_company(
-                        id=row['id'],
-                        name=row['name'],
-                        slug=row['slug'],
-                        description=row['description'],
-                        logo_url=row['logo_url'],
-                        website=row['website'],
-                        email=row['email'],
-                        phone=row['phone'],
-                        address=row['address'],
-                        status='active' if row.get('is_active', True) else 'inactive',
-                        created_at=row['created_at'],
-                        updated_at=row['updated_at']
-                    )
-                    self.company_id_map[old_id] = new_id
-                    total_migrated += 1
+        print(f"✅ Migrated {total_migrated} companies")
+    
+    def _flush_companies(self, pending):
+        """Write a batch of (old_ids, company) pairs and record their new ids"""
+        index = self._index()     # loads (and commits) before the transaction below starts
+        new_ids = None
+        if self.batch_size > 1:
+            try:
+                new_ids = self._upsert_companies_batch([company for _, company in pending])
+            except BACK_OFF_ERRORS:
+                self.unified_conn.rollback()
+                raise
+            except ROW_ERRORS as e:
+                self.unified_conn.rollback()
+                print(f"   ⚠️  Company batch failed, retrying row by row: {str(e).splitlines()[0]}")
         
-        # Migrate from business-services-hub
-        if self.services_conn:
-            with self.services_conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id, owner_id, name, cr_number, vat_number, 
-                           logo_url, created_at
-                    FROM companies
+        if new_ids is None:
+            with RowTransaction(self.unified_conn, self.rejects, 'companies') as tx:
+                new_ids = [
+                    tx.write(old_ids[0], company, self._insert_or_update_company, **company)
+                    for old_ids, company in pending
+                ]
+        
+        written = 0
+        for (old_ids, company), new_id in zip(pending, new_ids):
+            if new_id is None:
+                continue    # rejected
+            for old_id in old_ids:
+                self.company_id_map[old_id] = new_id
+            if not index.has_company(new_id):
+                index.add_company(new_id, company['slug'], company['name'])
+            written += 1
+        
+        return written
+    
+    def _upsert_companies_batch(self, companies):
+        """Upsert a batch of companies with set-based statements, returning new ids in order"""
+        if len({tuple(company) for company in companies}) > 1:
+            return self._by_shape(companies, self._upsert_companies_batch)
+        
+        merged, positions = self._merge_batch(companies, **COMPANY_MERGE)
+        fields = list(merged[0].keys())
+        columns = ', '.join(fields)
+        assignments = [f"{f} = COALESCE(s.{f}, c.{f})" for f in fields if f not in ('id', 'slug', 'name')]
+        
+        with self.unified_conn.cursor() as cur:
+            cur.execute(f"""
+                CREATE TEMP TABLE _stage_companies ON COMMIT DROP AS
+                SELECT {columns}, id AS target_id FROM companies WITH NO DATA
+            """)
+            execute_values(
+                cur,
+                f"INSERT INTO _stage_companies ({columns}) VALUES %s",
+                [tuple(company[f] for f in fields) for company in merged],
+                page_size=len(merged)
+            )
+            
+            # Match existing companies by slug first, then by name
+            cur.execute("""
+                UPDATE _stage_companies s SET target_id = c.id
+                FROM companies c
+                WHERE c.slug = s.slug
+            """)
+            cur.execute("""
+                UPDATE _stage_companies s SET target_id = c.id
+                FROM companies c
+                WHERE s.target_id IS NULL AND c.name = s.name
+            """)
+            
+            if assignments:
+                cur.execute(f"""
+                    UPDATE companies c
+                    SET {', '.join(assignments)}
+                    FROM _stage_companies s
+                    WHERE c.id = s.target_id
                 """)
-                
-                for row in cur.fetchall():
-                    old_id = row['id']
-                    # Generate slug from name
-                    slug = row['name'].lower().replace(' ', '-').replace('/', '-')
-                    slug = ''.join(c if c.isalnum() or c == '-' else '' for c in slug)
-                    
-                    new_id = self._insert_or_update_company(
-                        id=row['id'],
-                        name=row['name'],
-                        slug=slug,
-                        logo_url=row['logo_url'],
-                        cr_number=row['cr_number'],
-                        vat_number=row['vat_number'],
-                        status='active',
-                        created_at=row['created_at']
-                    )
-                    self.company_id_map[old_id] = new_id
-                    total_migrated += 1
+            
+            cur.execute(f"""
+                INSERT INTO companies ({columns})
+                SELECT {columns} FROM _stage_companies
+                WHERE target_id IS NULL
+                ON CONFLICT (slug) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    description = COALESCE(companies.description, EXCLUDED.description)
+            """)
+            
+            cur.execute("SELECT id, COALESCE(target_id, id) FROM _stage_companies")
+            ids = dict(cur.fetchall())
         
-        print(f"✅ Migrated {total_migrated} companies")
+        self.unified_conn.commit()
+        return [ids[merged[pos]['id']] for pos in positions]
     
     def _insert_or_update_company(self, **kwargs):
         """Insert or update a company in unified database"""
+        index = self._index()
+        statements = prepared_statements(self.unified_conn)
+        
         with self.unified_conn.cursor(cursor_factory=RealDictCursor) as cur:
             # Check if company exists by slug or name
-            cur.execute("""
-                SELECT id FROM companies 
-                WHERE slug = %s OR name = %s
-            """, (kwargs.get('slug'), kwargs.get('name')))
-            
-            existing = cur.fetchone()
+            existing = index.find_company(kwargs.get('slug'), kwargs.get('name'))
             
             if existing:
-                # Update existing company
-                update_fields = []
-                update_values = []
+                # Update existing company; null fields keep their current value
+                fields = [key for key in kwargs if key not in ['id', 'slug', 'name']]
                 
-                for key, value in kwargs.items():
-                    if key not in ['id', 'slug', 'name'] and value is not None:
-                        update_fields.append(f"{key} = %s")
-                        update_values.append(value)
+                if all(kwargs[field] is None for field in fields):
+                    return existing
                 
-                update_values.append(kwargs.get('slug'))
+                def build():
+                    assignments = [f"{field} = COALESCE(${i}, {field})" for i, field in enumerate(fields, 1)]
+                    return f"""
+                        UPDATE companies 
+                        SET {', '.join(assignments)}
+                        WHERE id = ${len(fields) + 1}
+                        RETURNING id
+                    """
                 
-                cur.execute(f"""
-                    UPDATE companies 
-                    SET {', '.join(update_fields)}
-                    WHERE slug = %s
-                    RETURNING id
-                """, update_values + [kwargs.get('slug')])
+                statements.execute(cur, ('companies', 'update', tuple(fields)), build,
+                                   [kwargs[field] for field in fields] + [existing])
                 
                 result = cur.fetchone()
-                self.unified_conn.commit()
                 return result['id'] if result else kwargs.get('id')
             else:
                 # Insert new company
                 fields = list(kwargs.keys())
-                values = list(kwargs.values())
-                placeholders = ['%s'] * len(values)
                 
-                cur.execute(f"""
-                    INSERT INTO companies ({', '.join(fields)})
-                    VALUES ({', '.join(placeholders)})
-                    ON CONFLICT (slug) DO UPDATE SET
-                        name = EXCLUDED.name,
-                        description = COALESCE(companies.description, EXCLUDED.description)
-                    RETURNING id
-                """, values)
+                def build():
+                    return f"""
+                        INSERT INTO companies ({', '.join(fields)})
+                        VALUES ({placeholders(len(fields))})
+                        ON CONFLICT (slug) DO UPDATE SET
+                            name = EXCLUDED.name,
+                            description = COALESCE(companies.description, EXCLUDED.description)
+                        RETURNING id
+                    """
+                
+                statements.execute(cur, ('companies', 'insert', tuple(fields)), build, list(kwargs.values()))
                 
                 result = cur.fetchone()
-                self.unified_conn.commit()
-                return result['id'] if result else kwargs.get('id')
+                company_id = result['id'] if result else kwargs.get('id')
+                index.add_company(company_id, kwargs.get('slug'), kwargs.get('name'))
+                return company_id
     
+    @measured('services')
     def migrate_services(self):
         """Migrate services from both databases"""
         print("\n🔧 Migrating services...")
+        self._refresh_index()
         
         total_migrated = 0
         
         # Migrate from Contract-Management-System
-        if self.contract_conn:
-            with self.contract_conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id, company_id, name, description, category, 
-                           price_base, price_currency, duration_minutes,
-                           max_participants, status, metadata, created_by,
-                           created_at, updated_at
-                    FROM services
-                """)
-                
-                for row in cur.fetchall():
-                    # Map IDs
-                    provider_id = self.profile_id_map.get(row['created_by'])
-                    company_id = self.company_id_map.get(row['company_id'])
-                    
-                    if not company_id and row['company_id']:
-                        # Try direct lookup
-                        with self.unified_conn.cursor(cursor_factory=RealDictCursor) as check_cur:
-                            check_cur.execute("SELECT id FROM companies WHERE id = %s", (row['company_id'],))
-                            if check_cur.fetchone():
-                                company_id = row['company_id']
-                    
-                    self._insert_service(
-                        id=row['id'],
-                        provider_id=provider_id,
-                        provider_company_id=company_id,
-                        title=row['name'],
-                        description=row['description'],
-                        category=row['category'],
-                        price=row['price_base'],
-                        currency=row['price_currency'] or 'USD',
-                        duration_minutes=row['duration_minutes'],
-                        max_participants=row['max_participants'],
-                        status=self._map_service_status(row['status']),
-                        metadata=row['metadata'] or {},
-                        created_at=row['created_at'],
-                        updated_at=row['updated_at']
-                    )
-                    total_migrated += 1
+        if self.contract_conn and not self._already_migrated('contract', 'services'):
+            rows, transform = self._extract('contract', CONTRACT_SERVICES)
+            total_migrated += self._migrate_rows('contract', 'services', rows, transform,
+                                                 partial(self._flush_services, 'contract'))
         
         # Migrate from business-services-hub
-        if self.services_conn:
-            with self.services_conn.cursor(cursor_factory=RealDictCursor) as cur:
+        if self.services_conn and not self._already_migrated('services', 'services'):
+            rows, transform = self._extract('services', HUB_SERVICES)
+            total_migrated += self._migrate_rows('services', 'services', rows, transform,
+                                                 partial(self._flush_services, 'services'))
+        
+        print(f"✅ Migrated {total_migrated} services")
+    
+    def _flush_services(self, source, pending):
+        """Write a batch of services from `source`, returning how many were written"""
+        self._create_services_stage()
+        if self.batch_size > 1:
+            try:
+                self._insert_services_batch(source, pending)
+                return len(pending)
+            except BACK_OFF_ERRORS:
+                self.unified_conn.rollback()
+                raise
+            except ROW_ERRORS as e:
+                self.unified_conn.rollback()
+                print(f"   ⚠️  Service batch failed, retrying row by row: {str(e).splitlines()[0]}")
+        
+        statements = prepared_statements(self.unified_conn)
+        with RowTransaction(self.unified_conn, self.rejects, 'services') as tx:
+            with self.unified_conn.cursor() as cur:
+                for group in batched(pending, ROWS_PER_ROUND_TRIP):
+                    tx.write_all([
+                        (service['id'], service, statements.bind(cur, *self._service_insert(source, service)),
+                         service['id'], partial(self._insert_service, source, **service))
+                        for service in group
+                    ])
+        
+        return len(pending) - tx.rejected
+    
+    def _create_services_stage(self):
+        """Create the session's staging table services pass through to be remapped"""
+        if not self._services_stage:
+            with self.unified_conn.cursor() as cur:
                 cur.execute("""
-                    SELECT id, provider_id, title, description, category, 
-                           base_price, currency, estimated_duration, location,
-                           tags, requirements, cover_image_url, status,
-                           approval_status, featured, rating, review_count,
-                           booking_count, created_at, updated_at
-                    FROM services
+                    CREATE TEMP TABLE IF NOT EXISTS migration_services_stage
+                    (LIKE services INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
                 """)
-                
-                for row in cur.fetchall():
-                    # Map provider ID
-                    provider_id = self.profile_id_map.get(row['provider_id'])
-                    if not provider_id and row['provider_id']:
-                        provider_id = row['provider_id']
-                    
-                    status = 'active'
-                    if row['status'] != 'active' or (row.get('approval_status') and row['approval_status'] != 'approved'):
-                        status = 'pending'
-                    
-                    self._insert_service(
-                        id=row['id'],
-                        provider_id=provider_id,
-                        title=row['title'],
-                        description=row['description'],
-                        category=row['category'],
-                        price=row['base_price'],
-                        currency=row['currency'] or 'USD',
-                        location=row['location'],
-                        tags=row['tags'],
-                        requirements=row['requirements'],
-                        cover_image_url=row['cover_image_url'],
-                        featured=row['featured'],
-                        rating=row['rating'] or 0,
-                        review_count=row['review_count'] or 0,
-                        booking_count=row['booking_count'] or 0,
-                        status=self._map_service_status(status),
-                        created_at=row['created_at'],
-                        updated_at=row['updated_at']
-                    )
-                    total_migrated += 1
+            self.unified_conn.commit()
+            self._services_stage = True
+    
+    @staticmethod
+    def _services_sql(source, fields, values):
+        """INSERT of services `fields` from `values` (source ids) that remaps the ids
+        by SERVICE_REMAPS on the way from the staging table into services"""
+        select, joins = remapped_columns(fields, SERVICE_REMAPS[source])
+        return f"""
+            WITH s AS (
+                INSERT INTO migration_services_stage ({', '.join(fields)})
+                VALUES {values}
+                RETURNING *
+            )
+            INSERT INTO services ({', '.join(fields)})
+            SELECT {select} FROM s {joins}
+            ON CONFLICT (id) DO UPDATE SET {', '.join(f"{c} = EXCLUDED.{c}" for c in SERVICE_UPDATES)}
+        """
+    
+    def _insert_services_batch(self, source, services):
+        """Insert or update a batch of services, one statement per distinct set of non-null columns"""
+        # Null columns are left out (as in _insert_service) so they keep their defaults
+        by_fields = {}
+        for service in services:
+            fields = tuple(k for k, v in service.items() if v is not None)
+            by_fields.setdefault(fields, []).append(tuple(service[k] for k in fields))
         
-        print(f"✅ Migrated {total_migrated} services")
+        with self.unified_conn.cursor() as cur:
+            for fields, values in by_fields.items():
+                execute_values(cur, self._services_sql(source, fields, '%s'), values, page_size=len(values))
+        
+        self.unified_conn.commit()
     
-    def _insert_service(self, **kwargs):
+    @classmethod
+    def _service_insert(cls, source, service):
+        """(shape, build, params) of the prepared statement inserting or updating one service"""
+        # Null columns are left out so they keep their defaults
+        fields = [k for k, v in service.items() if v is not None]
+        
+        def build():
+            return cls._services_sql(source, fields, f"({placeholders(len(fields))})")
+        
+        return ('services', 'insert', source, tuple(fields)), build, [service[field] for field in fields]
+    
+    def _insert_service(self, source, **kwargs):
         """Insert or update a service in unified database"""
+        self._create_services_stage()
         with self.unified_conn.cursor() as cur:
-            fields = [k for k, v in kwargs.items() if v is not None]
-            values = [v for v in kwargs.values() if v is not None]
-            placeholders = ['%s'] * len(values)
-            
-            cur.execute(f"""
-                INSERT INTO services ({', '.join(fields)})
-                VALUES ({', '.join(placeholders)})
-                ON CONFLICT (id) DO UPDATE SET
-                    title = EXCLUDED.title,
-                    description = EXCLUDED.description,
-                    price = EXCLUDED.price,
-                    status = EXCLUDED.status
-            """, values)
-            
-            self.unified_conn.commit()
+            prepared_statements(self.unified_conn).execute(cur, *self._service_insert(source, kwargs))
+    
+    @measured('id_maps')
+    def ship_id_maps(self):
+        """Load the profile and company ID maps into mapping tables on the unified DB"""
+        print("\n🗺️  Shipping ID maps to the unified database...")
+        profiles = ship_id_map(self.unified_conn, PROFILE_MAP_TABLE, self.profile_id_map)
+        companies = ship_id_map(self.unified_conn, COMPANY_MAP_TABLE, self.company_id_map)
+        print(f"✅ Shipped {profiles} profile and {companies} company ID mappings")
     
-    def _map_service_status(self, status):
-        """Map old status to unified status"""
-        status_map = {
-            'active': 'active',
-            'inactive': 'inactive',
-            'draft': 'draft',
-            'pending': 'pending',
-            'approved': 'active',
-            'rejected': 'inactive'
-        }
-        return status_map.get(status, 'active')
+    def drop_id_map_tables(self):
+        """Drop the mapping tables once every stage using them is done"""
+        drop_id_maps(self.unified_conn, PROFILE_MAP_TABLE, COMPANY_MAP_TABLE)
     
+    @measured('company_references')
     def update_company_references(self):
-        """Update company_id in profiles after companies are migrated"""
+        """Point profile and booking references at merged profiles and companies,
+        one UPDATE ... FROM the shipped mapping tables per column"""
         print("\n🔄 Updating company references in profiles...")
         
-        # This would update company_id in profiles using the mapping
-        # For now, profiles already have company_id if it was set during migration
-        print("✅ Company references updated")
+        updated = 0
+        for table, column, map_table in COMPANY_REFERENCES:
+            if not self._has_column(table, column):
+                continue
+            count = update_references(self.unified_conn, table, column, map_table)
+            if count:
+                print(f"   ↪ {table}.{column}: {count} rows")
+            updated += count
+        self.unified_conn.commit()
+        
+        print(f"✅ Company references updated ({updated} rows)")
     
-    def print_summary(self):
-        """Print migration summary"""
+    def _has_column(self, table, column):
+        """Whether the unified DB has `table`.`column` (bookings may not exist yet)"""
+        with self.unified_conn.cursor() as cur:
+            cur.execute("""
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = 'public' AND table_name = %s AND column_name = %s
+            """, (table, column))
+            return cur.fetchone() is not None
+    
+    def verify(self, workers=VERIFY_WORKERS):
+        """Compare the unified services with both sources by chunked checksums;
+        returns whether they match
+        
+        Profiles and companies are merged by email and slug, so their rows don't
+        correspond one to one and are left to the summary counts.
+        """
+        sources = [(db, mapping) for db, url, mapping in (
+            ('contract', CONTRACT_DB_URL, CONTRACT_SERVICES),
+            ('services', SERVICES_DB_URL, HUB_SERVICES),
+        ) if url]
+        remapped = {column for remaps in SERVICE_REMAPS.values() for column in remaps}
+        verifier = Verifier({'contract': CONTRACT_DB_URL, 'services': SERVICES_DB_URL, 'unified': UNIFIED_DB_URL},
+                            'unified', workers)
+        return verified(verifier.run([Check('services', sources, exclude=remapped)]))
+    
+    def print_summary(self, exact_counts=False):
+        """Print migration summary (from the run's counters; table sizes are
+        planner estimates unless `exact_counts`)"""
         print("\n" + "="*50)
         print("📊 MIGRATION SUMMARY")
         print("="*50)
         
-        with self.unified_conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT COUNT(*) as count FROM profiles")
-            profiles = cur.fetchone()['count']
-            
-            cur.execute("SELECT COUNT(*) as count FROM companies")
-            companies = cur.fetchone()['count']
-            
-            cur.execute("SELECT COUNT(*) as count FROM services")
-            services = cur.fetchone()['count']
-            
-            print(f"✅ Profiles: {profiles}")
-            print(f"✅ Companies: {companies}")
-            print(f"✅ Services: {services}")
-            print(f"✅ Profile ID mappings: {len(self.profile_id_map)}")
-            print(f"✅ Company ID mappings: {len(self.company_id_map)}")
+        self.metrics.print_tables(self.unified_conn, ['profiles', 'companies', 'services'], exact_counts)
+        print(f"✅ Profile ID mappings: {len(self.profile_id_map)}")
+        print(f"✅ Company ID mappings: {len(self.company_id_map)}")
+        if self.rejects.count:
+            print(f"⚠️  Rejected rows: {self.rejects.count} (see {self.rejects.path})")
         
+        print("-"*50)
+        self.metrics.print_stages()
         print("="*50)
         print("\n🎉 Migration completed!")
         print("\nNext steps:")
@@ -468,23 +1075,75 @@ class DataMigrator:
 
 def main():
     """Main migration function"""
+    parser = argparse.ArgumentParser(description="Migrate data into the unified SmartPro database")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="run independent stages in parallel on this many connections")
+    parser.add_argument('--chunks', type=int, default=None,
+                        help="split large tables into this many id ranges (default: --workers)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only migrate rows changed since the last successful run")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue an interrupted run from its last checkpoint "
+                             "(use the same --chunks as the interrupted run)")
+    parser.add_argument('--refresh-index', action='store_true',
+                        help="reload existing unified ids/emails/slugs before each stage "
+                             "(when other writers touch the unified DB during the run)")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="read and map the next batches while the previous one is being written")
+    parser.add_argument('--adaptive-batches', action='store_true',
+                        help="grow or shrink each stage's batch size from the observed write latency, "
+                             "backing off on timeouts and lock failures")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="write per-stage metrics to FILE at the end "
+                             "(Prometheus text for .prom/.txt, JSON otherwise)")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="sample each stage's stacks and trace its allocations; write per-stage "
+                             "collapsed stacks (for flame graphs) and allocations.txt to DIR")
+    parser.add_argument('--verify', action='store_true',
+                        help="instead of migrating, compare the migrated services with the sources "
+                             "by chunked checksums (--workers ranges at a time)")
+    parser.add_argument('--exact-counts', action='store_true',
+                        help="count the unified tables with COUNT(*) for the summary "
+                             "(default: planner estimates, no table scans)")
+    args = parser.parse_args()
+    
     print("🚀 SmartPro Data Migration")
     print("="*50)
     
-    migrator = DataMigrator()
+    if args.verify:
+        matched = DataMigrator().verify(args.workers if args.workers > 1 else VERIFY_WORKERS)
+        sys.exit(0 if matched else 1)
+    
+    state = MigrationState.for_run('migrate_data', CONTRACT_DB_URL, SERVICES_DB_URL, UNIFIED_DB_URL,
+                                   resume=args.resume)
+    if args.resume:
+        print("♻️  Resuming from checkpoint" if state.resumed else "⚠️  No checkpoint found, starting from the beginning")
+    migrator = DataMigrator(refresh_index=args.refresh_index, state=state, incremental=args.incremental,
+                            pipeline=args.pipeline, adaptive_batches=args.adaptive_batches)
+    profiler = Profiler(migrator.metrics) if args.profile else None
+    if profiler:
+        profiler.start()
+    migrator.metrics.start_progress()
     
     try:
         # Connect to databases
         migrator.connect()
         
         # Migrate data
-        migrator.migrate_profiles()
-        migrator.migrate_companies()
-        migrator.migrate_services()
-        migrator.update_company_references()
+        if args.workers > 1:
+            migrator.run_parallel(args.workers, args.chunks or args.workers)
+        else:
+            migrator.migrate_profiles()
+            migrator.migrate_companies()
+            migrator.ship_id_maps()
+            migrator.migrate_services()
+            migrator.update_company_references()
+        migrator.drop_id_map_tables()
+        
+        migrator.save_state()
         
         # Print summary
-        migrator.print_summary()
+        migrator.print_summary(args.exact_counts)
         
     except Exception as e:
         print(f"\n❌ Error during migration: {e}")
@@ -492,6 +1151,14 @@ def main():
         traceback.print_exc()
         sys.exit(1)
     finally:
+        migrator.metrics.stop_progress()
+        if args.metrics:
+            migrator.metrics.dump(args.metrics)
+            print(f"📈 Metrics written to {args.metrics}")
+        if profiler:
+            profiler.stop()
+            profiler.write(args.profile)
+            print(f"🔬 Stage profiles written to {args.profile}")
         migrator.close()
 
 if __name__ == "__main__":
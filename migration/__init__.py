@@ -0,0 +1,45 @@
+"""
+Shared helpers for the SmartPro migration scripts
+=================================================
+Used by migrate_data.py and migrate_between_projects.py.
+"""
+
+from migration.streaming import stream_rows, batched, where_clause
+from migration.bulk import copy_between
+from migration.scheduler import Stage, run_stages, key_ranges, key_range_condition
+from migration.index import TargetIndex
+from migration.state import MigrationState, changed_since_condition, after_key_condition
+from migration.commits import RowTransaction, RejectLog, COMMIT_ROWS, ROW_ERRORS
+from migration.metrics import Metrics, measured, estimate_rows, target_rows
+from migration.pipeline import write_batches, run_pipeline, PIPELINE_BATCHES
+from migration.statements import prepared_statements, placeholders, ROWS_PER_ROUND_TRIP
+from migration.mapping import TableMapping, Column, Sql, source_schema
+from migration.idmap import IdMap
+from migration.remap import ship_id_map, drop_id_maps, remapped_columns, update_references
+from migration.verify import Check, Verifier, verified, VERIFY_WORKERS
+from migration.merge import MergeSet, MERGE_ROWS
+from migration.batching import AdaptiveBatches, BACK_OFF_ERRORS
+from migration.profiling import Profiler
+from migration.bulkload import BulkLoad, BULK_SESSION
+from migration.snapshot import Snapshot, SnapshotWriter
+from migration.replication import (
+    ChangeStream, Change, Commit, Truncate, create_replication, drop_replication,
+    SYNC_SLOT, SYNC_PUBLICATION, SYNC_BATCH_ROWS, SYNC_BATCH_SECONDS, SYNC_IDLE_CONFIRM_SECONDS
+)
+
+__all__ = [
+    'stream_rows', 'batched', 'where_clause', 'copy_between',
+    'Stage', 'run_stages', 'key_ranges', 'key_range_condition',
+    'TargetIndex', 'MigrationState', 'changed_since_condition', 'after_key_condition',
+    'RowTransaction', 'RejectLog', 'COMMIT_ROWS', 'ROW_ERRORS',
+    'Metrics', 'measured', 'estimate_rows', 'target_rows',
+    'write_batches', 'run_pipeline', 'PIPELINE_BATCHES',
+    'prepared_statements', 'placeholders', 'ROWS_PER_ROUND_TRIP',
+    'TableMapping', 'Column', 'Sql', 'source_schema',
+    'IdMap', 'ship_id_map', 'drop_id_maps', 'remapped_columns', 'update_references',
+    'Check', 'Verifier', 'verified', 'VERIFY_WORKERS',
+    'MergeSet', 'MERGE_ROWS', 'AdaptiveBatches', 'BACK_OFF_ERRORS', 'Profiler',
+    'BulkLoad', 'BULK_SESSION', 'Snapshot', 'SnapshotWriter',
+    'ChangeStream', 'Change', 'Commit', 'Truncate', 'create_replication', 'drop_replication',
+    'SYNC_SLOT', 'SYNC_PUBLICATION', 'SYNC_BATCH_ROWS', 'SYNC_BATCH_SECONDS', 'SYNC_IDLE_CONFIRM_SECONDS',
+]
@@ -0,0 +1,157 @@
+"""
+Batch sizes tuned at runtime from how the target keeps up.
+
+A fixed MIGRATION_BATCH_SIZE / MIGRATION_COMMIT_ROWS is a guess: too small
+and every batch pays a round trip and a commit for little work, too large
+and batches hold locks for long, hit statement_timeout or pile up behind
+other sessions. AdaptiveBatches starts from the configured size and
+
+- doubles it after every window of MIGRATION_BATCH_WINDOW batches whose
+  throughput (rows written per second of wall time, across all writers)
+  beat the previous window's by MIGRATION_BATCH_GAIN; once a step brings
+  no gain it goes back to the best size seen and stays there,
+- halves it when a batch takes longer than MIGRATION_BATCH_TARGET_SECONDS
+  (slow statements, waits on other sessions' locks),
+- halves it when a batch fails with one of BACK_OFF_ERRORS, and writes that
+  batch again in two halves; the writer must have rolled the failed batch
+  back.
+
+A size that was halved caps the growth from then on. Every change is kept,
+with its reason, for the run report.
+"""
+
+import os
+import threading
+import time
+from itertools import islice
+
+import psycopg2.errors
+import psycopg2.extensions
+
+# Bounds of adaptive batch sizes (rows)
+BATCH_MIN_ROWS = int(os.getenv('MIGRATION_BATCH_MIN_ROWS', '50'))
+BATCH_MAX_ROWS = int(os.getenv('MIGRATION_BATCH_MAX_ROWS', '20000'))
+
+# A batch writing for longer than this halves the size
+BATCH_TARGET_SECONDS = float(os.getenv('MIGRATION_BATCH_TARGET_SECONDS', '2'))
+
+# Batches per throughput measurement, and the gain that makes the size grow again
+BATCH_WINDOW = int(os.getenv('MIGRATION_BATCH_WINDOW', '3'))
+BATCH_GAIN = float(os.getenv('MIGRATION_BATCH_GAIN', '0.05'))
+
+# Failures a smaller batch may avoid: statement_timeout and lock_timeout
+# cancellations, deadlocks and serialization failures
+BACK_OFF_ERRORS = (psycopg2.errors.QueryCanceled, psycopg2.errors.LockNotAvailable,
+                   psycopg2.extensions.TransactionRollbackError)
+
+# Size changes kept for the report
+MAX_CHANGES = 100
+
+
+class AdaptiveBatches:
+    """Batch size starting at `size` rows, tuned by the writes it times
+
+    Shared by every thread writing one stage.
+    """
+
+    def __init__(self, size, minimum=BATCH_MIN_ROWS, maximum=BATCH_MAX_ROWS,
+                 target_seconds=BATCH_TARGET_SECONDS, window=BATCH_WINDOW, gain=BATCH_GAIN):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.initial = self.size = min(max(size, self.minimum), self.maximum)
+        self.target_seconds = target_seconds
+        self.window = window
+        self.gain = gain
+        self.back_offs = 0
+        self.changes = []           # [batch number, new size, reason]
+        self._batches = 0
+        self._ceiling = self.maximum
+        self._growing = True
+        self._rate = None           # throughput of the best size so far
+        self._best = self.size
+        self._window_rows = 0
+        self._window_batches = 0
+        self._window_started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def batched(self, items):
+        """Yield lists of `items`, each as long as the size when it is started"""
+        iterator = iter(items)
+        while True:
+            batch = list(islice(iterator, self.size))
+            if not batch:
+                return
+            yield batch
+
+    def write(self, write, batch, *args):
+        """Call `write(batch, *args)` and return what it returns, timing it;
+        a batch failing with a BACK_OFF_ERROR is written again in halves"""
+        started = time.monotonic()
+        try:
+            written = write(batch, *args)
+        except BACK_OFF_ERRORS as e:
+            if len(batch) <= self.minimum:
+                raise
+            self._back_off(len(batch), e)
+            half = len(batch) // 2
+            return self.write(write, batch[:half], *args) + self.write(write, batch[half:], *args)
+        self._observe(len(batch), time.monotonic() - started)
+        return written
+
+    def to_dict(self):
+        sizes = [self.initial] + [size for _, size, _ in self.changes]
+        return {
+            'initial': self.initial,
+            'final': self.size,
+            'min': min(sizes),
+            'max': max(sizes),
+            'back_offs': self.back_offs,
+            'changes': self.changes,
+        }
+
+    def _observe(self, rows, seconds):
+        with self._lock:
+            self._batches += 1
+            if seconds > self.target_seconds and rows > self.minimum:
+                self._shrink(rows, f"batch took {seconds:.1f}s")
+                return
+
+            self._window_rows += rows
+            self._window_batches += 1
+            if self._window_batches < self.window:
+                return
+            now = time.monotonic()
+            rate = self._window_rows / max(now - self._window_started, 1e-6)
+            self._window_rows, self._window_batches, self._window_started = 0, 0, now
+
+            if self._rate is None or rate > self._rate * (1 + self.gain):
+                self._rate, self._best = rate, self.size
+                if self._growing and self.size < self._ceiling:
+                    self._resize(min(self.size * 2, self._ceiling), f"{rate:,.0f} rows/s")
+            else:
+                # The last step gained nothing: settle on the best size
+                self._growing = False
+                if self.size != self._best:
+                    self._resize(self._best, f"{rate:,.0f} rows/s, no gain")
+
+    def _back_off(self, rows, error):
+        message = error.diag.message_primary or str(error).strip().splitlines()[0]
+        with self._lock:
+            self.back_offs += 1
+            self._shrink(rows, message)
+        print(f"   ⚠️  Batch of {rows} rows failed, retrying in halves: {message}")
+
+    def _shrink(self, rows, reason):
+        """Size down to half the `rows` that failed or were slow (if not already
+        smaller) and cap growth there"""
+        size = max(min(self.size, rows // 2), self.minimum)
+        self._ceiling = size
+        self._rate = None
+        self._window_rows, self._window_batches, self._window_started = 0, 0, time.monotonic()
+        if size != self.size:
+            self._resize(size, reason)
+
+    def _resize(self, size, reason):
+        self.size = size
+        if len(self.changes) < MAX_CHANGES:
+            self.changes.append([self._batches, size, reason])
@@ -0,0 +1,39 @@
+"""
+COPY-based bulk transfer between two databases.
+
+Rows are piped from `COPY (SELECT ...) TO STDOUT` on the source straight into
+`COPY ... FROM STDIN` on the target, without building Python tuples.
+"""
+
+import os
+import threading
+
+COPY_BUFFER_SIZE = 1 << 20
+
+
+def copy_between(src_conn, src_sql, dst_conn, dst_sql):
+    """Pipe a COPY TO STDOUT on `src_conn` into a COPY FROM STDIN on `dst_conn`,
+    returning the number of rows copied"""
+    read_fd, write_fd = os.pipe()
+    errors = []
+    
+    def produce():
+        try:
+            with os.fdopen(write_fd, 'wb') as sink, src_conn.cursor() as cur:
+                cur.copy_expert(src_sql, sink, size=COPY_BUFFER_SIZE)
+        except BaseException as e:  # re-raised in the calling thread
+            errors.append(e)
+    
+    producer = threading.Thread(target=produce, name='copy-producer', daemon=True)
+    producer.start()
+    try:
+        with os.fdopen(read_fd, 'rb') as source, dst_conn.cursor() as cur:
+            cur.copy_expert(dst_sql, source, size=COPY_BUFFER_SIZE)
+            copied = cur.rowcount
+    finally:
+        producer.join()
+    
+    # A failed producer closes the pipe early, which looks like a clean EOF to COPY FROM
+    if errors:
+        raise errors[0]
+    return copied
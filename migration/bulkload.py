@@ -0,0 +1,189 @@
+"""
+Bulk-load mode for the tables a migration writes.
+
+Loading millions of rows into tables that keep every secondary index,
+trigger and foreign key up to date row by row is slow. BulkLoad.prepare()
+records and then
+
+- drops the secondary indexes (non-unique indexes not backing a
+  constraint; primary keys and unique indexes stay, upserts look rows up
+  through them),
+- disables the user triggers, except those named in
+  MIGRATION_BULK_KEEP_TRIGGERS,
+- optionally makes foreign keys DEFERRABLE, so that all-or-nothing loads
+  can check them at commit (SET CONSTRAINTS ALL DEFERRED). Row-by-row
+  writes keep checking them at once, or a bad row could not be rejected
+  on its own.
+
+Writer sessions run with BULK_SESSION. BulkLoad.restore() undoes it all:
+indexes are rebuilt in parallel with a large maintenance_work_mem, and the
+tables are ANALYZEd so the application gets good plans right away.
+
+What is about to change is written to a file first, so a run killed in the
+middle of a load can still be restored by the next one.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2 import sql
+
+# Indexes rebuilt (and tables analyzed) at once after a bulk load
+BULK_INDEX_WORKERS = int(os.getenv('MIGRATION_BULK_INDEX_WORKERS', '4'))
+
+# maintenance_work_mem of the index rebuilds
+BULK_MAINTENANCE_WORK_MEM = os.getenv('MIGRATION_BULK_MAINTENANCE_WORK_MEM', '1GB')
+
+# Triggers left enabled during a bulk load (comma-separated names)
+BULK_KEEP_TRIGGERS = {name.strip() for name in os.getenv('MIGRATION_BULK_KEEP_TRIGGERS', '').split(',')
+                      if name.strip()}
+
+# Settings of writer sessions. A commit returns before its WAL reaches disk:
+# a crash of the database server (not of this script) can lose the last
+# few commits, so rerun such a load without --resume.
+BULK_SESSION = "SET synchronous_commit = off"
+
+
+class BulkLoad:
+    """Bulk-load mode for `tables` on `conn`, recorded in the file `path`
+
+    `connect(dsn)` opens the extra connections rebuilding indexes.
+    """
+
+    def __init__(self, conn, dsn, tables, path, workers=BULK_INDEX_WORKERS, defer_foreign_keys=False,
+                 connect=psycopg2.connect):
+        self.conn = conn
+        self.dsn = dsn
+        self.tables = tables
+        self.path = path
+        self.workers = workers
+        self.defer_foreign_keys = defer_foreign_keys
+        self.connect = connect
+
+    @property
+    def interrupted(self):
+        """Whether an earlier bulk load was never restored"""
+        return bool(self.path) and os.path.exists(self.path)
+
+    def prepare(self):
+        """Drop the secondary indexes, disable the triggers and (optionally)
+        make foreign keys deferrable; returns what was changed"""
+        changes = self._load()
+        found = self._find()
+        for kind, items in found.items():
+            known = {(item['table'], item['name']) for item in changes[kind]}
+            changes[kind] += [item for item in items if (item['table'], item['name']) not in known]
+        self._save(changes)
+
+        with self.conn.cursor() as cur:
+            for index in found['indexes']:
+                cur.execute(f"DROP INDEX IF EXISTS {index['qualified']}")
+            for trigger in found['triggers']:
+                cur.execute(sql.SQL("ALTER TABLE {} DISABLE TRIGGER {}").format(
+                    sql.SQL(trigger['table']), sql.Identifier(trigger['name'])))
+            for constraint in found['constraints']:
+                cur.execute(sql.SQL("ALTER TABLE {} ALTER CONSTRAINT {} DEFERRABLE").format(
+                    sql.SQL(constraint['table']), sql.Identifier(constraint['name'])))
+        self.conn.commit()
+        return changes
+
+    def restore(self):
+        """Rebuild the indexes, re-enable the triggers, restore the foreign
+        keys and ANALYZE the tables; returns what was restored (None if
+        nothing was recorded)"""
+        if not self.interrupted:
+            return None
+        changes = self._load()
+        self.conn.rollback()    # after a failed load the connection may be mid-transaction
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bulk-load') as pool:
+            for _ in pool.map(self._rebuild, changes['indexes']):
+                pass
+
+            with self.conn.cursor() as cur:
+                for trigger in changes['triggers']:
+                    cur.execute(sql.SQL("ALTER TABLE {} ENABLE TRIGGER {}").format(
+                        sql.SQL(trigger['table']), sql.Identifier(trigger['name'])))
+                for constraint in changes['constraints']:
+                    cur.execute(sql.SQL("ALTER TABLE {} ALTER CONSTRAINT {} NOT DEFERRABLE").format(
+                        sql.SQL(constraint['table']), sql.Identifier(constraint['name'])))
+            self.conn.commit()
+
+            for _ in pool.map(self._analyze, self.tables):
+                pass
+
+        os.remove(self.path)
+        return changes
+
+    def _find(self):
+        """Secondary indexes, enabled user triggers and immediate foreign keys of the tables"""
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT i.indrelid::regclass::text, c.relname, i.indexrelid::regclass::text,
+                       pg_get_indexdef(i.indexrelid)
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE i.indrelid = ANY(%s::regclass[])
+                  AND NOT i.indisunique AND NOT i.indisprimary
+                  AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid)
+                ORDER BY 1, 2
+            """, (self.tables,))
+            indexes = [{'table': table, 'name': name, 'qualified': qualified, 'definition': definition}
+                       for table, name, qualified, definition in cur.fetchall()]
+
+            cur.execute("""
+                SELECT tgrelid::regclass::text, tgname
+                FROM pg_trigger
+                WHERE tgrelid = ANY(%s::regclass[]) AND NOT tgisinternal AND tgenabled <> 'D'
+                ORDER BY 1, 2
+            """, (self.tables,))
+            triggers = [{'table': table, 'name': name} for table, name in cur.fetchall()
+                        if name not in BULK_KEEP_TRIGGERS]
+
+            constraints = []
+            if self.defer_foreign_keys:
+                cur.execute("""
+                    SELECT conrelid::regclass::text, conname
+                    FROM pg_constraint
+                    WHERE conrelid = ANY(%s::regclass[]) AND contype = 'f' AND NOT condeferrable
+                    ORDER BY 1, 2
+                """, (self.tables,))
+                constraints = [{'table': table, 'name': name} for table, name in cur.fetchall()]
+        self.conn.commit()
+        return {'indexes': indexes, 'triggers': triggers, 'constraints': constraints}
+
+    def _rebuild(self, index):
+        conn = self.connect(self.dsn)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SET maintenance_work_mem = %s", (BULK_MAINTENANCE_WORK_MEM,))
+                cur.execute(index['definition'].replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1))
+        finally:
+            conn.close()
+
+    def _analyze(self, table):
+        conn = self.connect(self.dsn)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"ANALYZE {table}")
+        finally:
+            conn.close()
+
+    def _load(self):
+        if not self.interrupted:
+            return {'indexes': [], 'triggers': [], 'constraints': []}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def _save(self, changes):
+        # Written aside and renamed, so a crash never leaves a truncated record
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(changes, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + '.tmp', self.path)
@@ -0,0 +1,158 @@
+"""
+Row writes grouped into transactions, with per-row savepoints.
+
+Committing after every row forces a WAL flush on the target for each row.
+A RowTransaction commits once per group of rows instead (and early, once it
+has been open for MIGRATION_COMMIT_SECONDS). Each row runs inside a
+savepoint, so a row the target refuses is rolled back on its own and written
+to the reject log while the rest of the transaction carries on.
+write_all sends a group of rows in one round trip under a single savepoint,
+and only falls back to a savepoint per row when one of them fails.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+
+# Rows per transaction for row-by-row writes
+COMMIT_ROWS = int(os.getenv('MIGRATION_COMMIT_ROWS', '500'))
+
+# Longest a row-by-row transaction stays open before it is committed early
+COMMIT_SECONDS = float(os.getenv('MIGRATION_COMMIT_SECONDS', '5'))
+
+REJECT_LOG = os.getenv('MIGRATION_REJECT_LOG', 'migration_rejects.jsonl')
+
+# Errors caused by the row itself. Anything else (a lost connection, a missing
+# column) would fail every row the same way, so it still aborts the run.
+ROW_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+
+
+class RejectLog:
+    """Append-only JSON-lines log of source rows the target refused"""
+
+    def __init__(self, path=REJECT_LOG):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, table, key, row, error):
+        """Log `row` of `table` (source key `key`) as rejected with `error`"""
+        message = error.diag.message_primary or str(error).strip()
+        entry = {
+            'at': datetime.now(timezone.utc).isoformat(),
+            'table': table,
+            'key': str(key),
+            'error': message,
+            'row': row,
+        }
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry, default=str) + '\n')
+            self.count += 1
+        print(f"   ⚠️  Rejected {table} {key}: {message}")
+
+
+class RowTransaction:
+    """A transaction of row writes on `conn`, each isolated by a savepoint
+
+    Use as a context manager: the transaction is committed when the block
+    exits normally and rolled back if it raises.
+    """
+
+    def __init__(self, conn, rejects, table, seconds=COMMIT_SECONDS):
+        self.conn = conn
+        self.rejects = rejects
+        self.table = table
+        self.seconds = seconds
+        self.rejected = 0
+        self.commits = 0
+        self._started = None
+        self._savepoint = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type:
+            self.conn.rollback()
+        else:
+            self.commit()
+        return False
+
+    def write(self, key, row, write, *args, **kwargs):
+        """Call `write(*args, **kwargs)` as the write of one row
+
+        Returns what `write` returns, or None if the target refused the row.
+        """
+        if self._started is None:
+            self._started = time.monotonic()
+
+        with self.conn.cursor() as cur:
+            # Reuse one savepoint name; releasing the previous one keeps the
+            # subtransaction stack flat and costs no extra round trip
+            if self._savepoint:
+                cur.execute("RELEASE SAVEPOINT migration_row; SAVEPOINT migration_row")
+            else:
+                cur.execute("SAVEPOINT migration_row")
+        self._savepoint = True
+
+        try:
+            result = write(*args, **kwargs)
+        except ROW_ERRORS as e:
+            with self.conn.cursor() as cur:
+                cur.execute("ROLLBACK TO SAVEPOINT migration_row")
+            self.rejects.add(self.table, key, row, e)
+            self.rejected += 1
+            result = None
+
+        if time.monotonic() - self._started >= self.seconds:
+            self.commit()
+        return result
+
+    def write_all(self, rows):
+        """Write several rows with one round trip
+
+        `rows` holds (key, row, statement, result, write) tuples: `statement`
+        is the row's SQL with its values bound, and `result` what writing the
+        row returns. If any statement fails, they are all rolled back and the
+        rows are written again one at a time with `write()`, so only the
+        failing rows are rejected. Returns the results (None if rejected).
+        """
+        if not rows:
+            return []
+        if self._started is None:
+            self._started = time.monotonic()
+
+        release = "RELEASE SAVEPOINT migration_row; " if self._savepoint else ""
+        self._savepoint = False
+        statements = '; '.join(statement for _, _, statement, _, _ in rows)
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(f"{release}SAVEPOINT migration_rows; {statements}; RELEASE SAVEPOINT migration_rows")
+            results = [result for _, _, _, result, _ in rows]
+        except ROW_ERRORS:
+            with self.conn.cursor() as cur:
+                cur.execute("ROLLBACK TO SAVEPOINT migration_rows")
+            commits = self.commits
+            results = [self.write(key, row, write) for key, row, _, _, write in rows]
+            if self.commits == commits:
+                # Drops the row savepoints along with the group's; a commit
+                # during the retries (COMMIT_SECONDS passing) already did
+                with self.conn.cursor() as cur:
+                    cur.execute("RELEASE SAVEPOINT migration_rows")
+                self._savepoint = False
+
+        if self._started is not None and time.monotonic() - self._started >= self.seconds:
+            self.commit()
+        return results
+
+    def commit(self):
+        """Commit the rows written so far"""
+        self.conn.commit()
+        self.commits += 1
+        self._started = None
+        self._savepoint = False
@@ -0,0 +1,288 @@
+"""
+Compact old id → new id maps.
+
+A dict of UUID strings costs well over 100 bytes per entry, which adds up to
+gigabytes on the largest tenants. An IdMap keeps 16-byte binary UUIDs in two
+open-addressing hash tables held in mmaps:
+
+- identity entries (new id = old id, the usual case) store only the key;
+- other entries store the key and the new id, 32 bytes per slot.
+
+Lookups hash the key and probe linearly, so they stay O(1). With
+MIGRATION_ID_MAP_DIR set, the tables live in (unlinked) files in that
+directory instead of anonymous memory, so the kernel can page them out and
+a map can outgrow RAM. save() writes a snapshot; load() maps it back
+copy-on-write, so reloading a saved map on a later run takes no time
+whatever its size. Keys or values that aren't canonical UUID strings are
+kept in a small dict on the side.
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+# Directory for file-backed maps (unset = anonymous memory)
+ID_MAP_DIR = os.getenv('MIGRATION_ID_MAP_DIR') or None
+
+MAGIC = b'IDMAP\x00\x01\x00'
+HEADER = struct.Struct('<8sQQQQQ')    # magic, capacity and count of each table, overlap
+HEADER_SIZE = 64
+
+LOAD_FACTOR = 0.7
+MIN_CAPACITY = 1031
+EMPTY = bytes(16)
+
+
+def _key(uuid):
+    """16 bytes of a UUID string, else None"""
+    if type(uuid) is not str:
+        return None
+    try:
+        key = bytes.fromhex(uuid.replace('-', ''))
+    except ValueError:
+        return None
+    # The nil UUID marks empty slots
+    return key if len(key) == 16 and key != EMPTY else None
+
+
+def _pack(uuid):
+    """_key() of a canonical (lowercase, dashed) UUID string, which _unpack()
+    gives back unchanged, else None"""
+    if type(uuid) is not str or len(uuid) != 36 or uuid.lower() != uuid:
+        return None
+    key = _key(uuid)
+    return key if key is not None and _unpack(key) == uuid else None
+
+
+def _unpack(key):
+    h = key.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _prime_at_least(n):
+    """Smallest prime >= n: the hash is the key modulo the capacity, which
+    mixes in all 128 bits (sequential v1/v7 UUIDs differ in only a few)"""
+    n |= 1
+    while any(n % d == 0 for d in range(3, int(n ** 0.5) + 1, 2)):
+        n += 2
+    return n
+
+
+class _Table:
+    """Open-addressing hash table of 16-byte keys, each followed by
+    `slot - 16` bytes of value, in `buffer` from `offset`"""
+
+    def __init__(self, capacity, slot, directory=None, buffer=None, offset=0, count=0):
+        self.capacity = capacity
+        self.slot = slot
+        self.count = count
+        self.offset = offset
+        self.size = capacity * slot
+        if buffer is None:
+            buffer = _allocate(self.size, directory)
+        self.buffer = buffer
+
+    def find(self, key):
+        """Slot offset holding `key`, or -(offset) of the empty slot where it would go"""
+        capacity = self.capacity
+        i = int.from_bytes(key, 'little') % capacity
+        buffer, slot, base = self.buffer, self.slot, self.offset
+        while True:
+            at = base + i * slot
+            found = buffer[at:at + 16]
+            if found == key:
+                return at
+            if found == EMPTY:
+                return -at - 1
+            i += 1
+            if i == capacity:
+                i = 0
+
+    def value(self, at):
+        return self.buffer[at + 16:at + self.slot]
+
+    def put(self, at, key, value=b''):
+        """Fill the empty slot `-at - 1` returned by find()"""
+        at = -at - 1
+        # Value first: readers don't lock, and a key makes the slot live
+        self.buffer[at + 16:at + self.slot] = value
+        self.buffer[at:at + 16] = key
+        self.count += 1
+
+    def entries(self):
+        """(key, value) of every live slot"""
+        buffer, slot = self.buffer, self.slot
+        for at in range(self.offset, self.offset + self.size, slot):
+            key = buffer[at:at + 16]
+            if key != EMPTY:
+                yield key, buffer[at + 16:at + slot]
+
+    def full(self):
+        return self.count + 1 > self.capacity * LOAD_FACTOR
+
+
+def _allocate(size, directory):
+    """Zeroed mmap of `size` bytes, file-backed in `directory` if given"""
+    if not directory:
+        return mmap.mmap(-1, size)
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix='idmap-', dir=directory)
+    try:
+        os.unlink(path)    # space is freed when the mapping goes away
+        os.ftruncate(fd, size)
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+
+class IdMap:
+    """Map of old id → new id with the dict methods the migrators use
+    (get, [], in, len, update, items)"""
+
+    def __init__(self, entries=None, capacity=MIN_CAPACITY, directory=ID_MAP_DIR):
+        self.directory = directory
+        capacity = _prime_at_least(capacity)
+        self._identity = _Table(capacity, 16, directory)
+        self._mapped = _Table(capacity, 32, directory)
+        self._both = 0      # ids in both tables: the mapped entry wins
+        self._other = {}
+        self._shadowed = 0  # ids in _other and a table: _other wins
+        self._lock = threading.Lock()
+        if entries:
+            self.update(entries)
+
+    def __len__(self):
+        return (self._identity.count + self._mapped.count - self._both
+                + len(self._other) - self._shadowed)
+
+    def get(self, old_id, default=None):
+        if self._other and old_id in self._other:
+            return self._other[old_id]
+        key = _key(old_id)
+        if key is None:
+            return default
+        if not self._both and self._identity.find(key) >= 0:
+            return old_id
+        mapped = self._mapped
+        at = mapped.find(key) if mapped.count else -1
+        if at >= 0:
+            return _unpack(mapped.value(at))
+        if self._both and self._identity.find(key) >= 0:
+            return old_id
+        return default
+
+    def __getitem__(self, old_id):
+        new_id = self.get(old_id, self)
+        if new_id is self:
+            raise KeyError(old_id)
+        return new_id
+
+    def __contains__(self, old_id):
+        return self.get(old_id, self) is not self
+
+    def __setitem__(self, old_id, new_id):
+        key = _pack(old_id)
+        value = key if new_id == old_id else _pack(new_id)
+        with self._lock:
+            if key is None or value is None:
+                if old_id not in self._other and self._in_tables(old_id):
+                    self._shadowed += 1
+                self._other[old_id] = new_id
+                return
+            if old_id in self._other:
+                del self._other[old_id]
+                if self._in_tables(old_id):
+                    self._shadowed -= 1
+            mapped = self._mapped
+            at = mapped.find(key) if mapped.count else None
+            if at is not None and at >= 0:
+                mapped.buffer[at + 16:at + 32] = value
+                return
+            found = self._identity.find(key)
+            if value == key:
+                if found < 0:
+                    self._insert('_identity', key, at=found)
+            else:
+                self._insert('_mapped', key, value, at)
+                if found >= 0:
+                    self._both += 1
+
+    def _in_tables(self, old_id):
+        key = _pack(old_id)
+        return key is not None and (self._identity.find(key) >= 0 or self._mapped.find(key) >= 0)
+
+    def _insert(self, name, key, value=b'', at=None):
+        """Add `key` to table `name`; `at` is its find() result, if known"""
+        table = getattr(self, name)
+        if table.full():
+            table = self._grow(name)
+            at = None
+        table.put(table.find(key) if at is None else at, key, value)
+
+    def _grow(self, name):
+        """Move table `name` into one twice its size"""
+        old = getattr(self, name)
+        table = _Table(_prime_at_least(old.capacity * 2), old.slot, self.directory)
+        for key, value in old.entries():
+            table.put(table.find(key), key, value)
+        setattr(self, name, table)
+        return table
+
+    def update(self, entries):
+        """Add the entries of a dict, IdMap or iterable of pairs"""
+        if hasattr(entries, 'items'):
+            entries = entries.items()
+        for old_id, new_id in entries:
+            self[old_id] = new_id
+
+    def items(self):
+        """(old_id, new_id) pairs, in no particular order"""
+        other = self._other
+        for key, value in self._mapped.entries():
+            old_id = _unpack(key)
+            if old_id not in other:
+                yield old_id, _unpack(value)
+        for key, _ in self._identity.entries():
+            old_id = _unpack(key)
+            if old_id not in other and (not self._both or self._mapped.find(key) < 0):
+                yield old_id, old_id
+        yield from list(other.items())
+
+    def save(self, path):
+        """Write the map to `path` (aside, then renamed into place)"""
+        with self._lock:
+            identity, mapped = self._identity, self._mapped
+            with open(path + '.tmp', 'wb') as f:
+                f.write(HEADER.pack(MAGIC, identity.capacity, identity.count,
+                                    mapped.capacity, mapped.count, self._both).ljust(HEADER_SIZE, b'\0'))
+                for table in (identity, mapped):
+                    f.write(memoryview(table.buffer)[table.offset:table.offset + table.size])
+                f.write(json.dumps(self._other).encode())
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, directory=ID_MAP_DIR):
+        """Map saved with save(), mapped copy-on-write: loading reads only the
+        header, and later changes never reach the file"""
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, identity_capacity, identity_count, mapped_capacity, mapped_count, both = \
+            HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an ID map")
+        id_map = cls.__new__(cls)
+        id_map.directory = directory
+        id_map._lock = threading.Lock()
+        id_map._identity = _Table(identity_capacity, 16, buffer=buffer, offset=HEADER_SIZE,
+                                  count=identity_count)
+        offset = HEADER_SIZE + id_map._identity.size
+        id_map._mapped = _Table(mapped_capacity, 32, buffer=buffer, offset=offset, count=mapped_count)
+        id_map._both = both
+        id_map._other = json.loads(buffer[offset + id_map._mapped.size:])
+        id_map._shadowed = sum(1 for old_id in id_map._other if id_map._in_tables(old_id))
+        return id_map
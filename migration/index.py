@@ -0,0 +1,101 @@
+"""
+In-memory index of the keys already present in the target database.
+
+Loaded with one bulk query per table, so resolving a foreign key or finding
+an existing row by email, slug or name is a dictionary probe instead of a
+SELECT round trip per source row. Writers keep it current through the
+add_* methods; `refresh` reloads it when other writers may have changed the
+target.
+"""
+
+import threading
+from itertools import count
+
+_cursor_ids = count(1)
+
+
+class TargetIndex:
+    """Existing company ids/slugs/names and profile ids/emails in the target"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._reset()
+
+    def _reset(self):
+        self.company_keys = {}      # id -> (slug, name)
+        self.company_by_slug = {}
+        self.company_by_name = {}
+        self.profile_emails = {}    # id -> email
+        self.profile_by_email = {}
+
+    def load(self, conn, refresh=False):
+        """Load the index from `conn` unless already loaded; returns self"""
+        with self._lock:
+            if self.loaded and not refresh:
+                return self
+
+            # Build aside and swap in, so concurrent readers never see a partial index
+            fresh = TargetIndex()
+            for company_id, slug, name in self._stream(conn, "SELECT id, slug, name FROM companies"):
+                fresh.add_company(company_id, slug, name)
+            for profile_id, email in self._stream(conn, "SELECT id, email FROM profiles"):
+                fresh.add_profile(profile_id, email)
+            conn.commit()
+
+            self.company_keys = fresh.company_keys
+            self.company_by_slug = fresh.company_by_slug
+            self.company_by_name = fresh.company_by_name
+            self.profile_emails = fresh.profile_emails
+            self.profile_by_email = fresh.profile_by_email
+            self.loaded = True
+        return self
+
+    @staticmethod
+    def _stream(conn, query):
+        with conn.cursor(name=f"migration_index_{next(_cursor_ids)}") as cur:
+            cur.itersize = 10000
+            cur.execute(query)
+            yield from cur
+
+    def has_company(self, company_id):
+        return company_id in self.company_keys
+
+    def find_company(self, slug, name):
+        """Id of the company matching `slug`, else `name` (None if neither exists)"""
+        if slug is not None and slug in self.company_by_slug:
+            return self.company_by_slug[slug]
+        if name is not None:
+            return self.company_by_name.get(name)
+        return None
+
+    def add_company(self, company_id, slug, name):
+        """Record a company, replacing whatever slug/name it had before"""
+        old = self.company_keys.get(company_id)
+        if old:
+            if self.company_by_slug.get(old[0]) == company_id:
+                del self.company_by_slug[old[0]]
+            if self.company_by_name.get(old[1]) == company_id:
+                del self.company_by_name[old[1]]
+
+        self.company_keys[company_id] = (slug, name)
+        if slug is not None:
+            self.company_by_slug[slug] = company_id
+        if name is not None:
+            self.company_by_name.setdefault(name, company_id)
+
+    def has_profile(self, profile_id):
+        return profile_id in self.profile_emails
+
+    def find_profile(self, email):
+        """Id of the profile with `email` (None if it does not exist)"""
+        return self.profile_by_email.get(email)
+
+    def add_profile(self, profile_id, email):
+        """Record a profile, replacing whatever email it had before"""
+        old = self.profile_emails.get(profile_id)
+        if old is not None and self.profile_by_email.get(old) == profile_id:
+            del self.profile_by_email[old]
+
+        self.profile_emails[profile_id] = email
+        self.profile_by_email[email] = profile_id
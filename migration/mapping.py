@@ -0,0 +1,262 @@
+"""
+Declarative source → unified table mappings.
+
+A TableMapping lists the unified columns of a table and where each one comes
+from in a source table: fallback source columns, a default, an enum map, an
+ID-map remap or a Python function. It is compiled against the source schema
+(read once per source database and cached for the run) into
+
+- a SELECT doing the COALESCE/CASE work on the source server. A fallback
+  column the source lacks is left out, so one mapping covers the variants of
+  a table across old projects; and
+- a batch transformer doing only what SQL can't (ID remaps, Python
+  functions), a column at a time over each fetched batch rather than row by
+  row.
+
+A mapping with a target and conflict key also compiles to a prepared upsert,
+so a new table needs no per-row Python code to be migrated.
+"""
+
+import threading
+
+from psycopg2.extras import RealDictCursor
+
+_schemas = {}
+_schemas_lock = threading.Lock()
+
+TEXT_TYPES = ('text', 'character varying', 'character')
+
+
+def source_schema(conn):
+    """{table: {column: data_type}} of the public schema behind `conn`, read once per database"""
+    with _schemas_lock:
+        schema = _schemas.get(conn.dsn)
+        if schema is None:
+            schema = {}
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT table_name, column_name, data_type
+                    FROM information_schema.columns
+                    WHERE table_schema = 'public'
+                    ORDER BY table_name, ordinal_position
+                """)
+                for row in cur:
+                    schema.setdefault(row['table_name'], {})[row['column_name']] = row['data_type']
+            _schemas[conn.dsn] = schema
+        return schema
+
+
+class Sql:
+    """A SQL expression used as a column source; skipped unless the source has
+    all of `columns`"""
+
+    def __init__(self, text, *columns):
+        self.text = text
+        self.columns = columns
+
+
+class Column:
+    """One unified column and how to read it from the source table
+
+    `sources` are source column names or Sql expressions, tried in order;
+    without any, the source column of the same name is used. `default` is
+    used when they are all null. `values` maps source values to unified ones
+    and `otherwise` replaces the values it doesn't list (default: keep them).
+    `blank_is_null` treats empty source strings as null.
+
+    `remap` names an ID map (or lookup function) handed to the transformer;
+    ids it doesn't know are kept, or nulled with unmapped=None. `apply` is a
+    Python function run on non-null values. `fallback` is a Python function
+    of the whole row, giving the value for rows the SQL left null (e.g. the
+    rare rows an SQL expression can't reproduce exactly). `cast` is the
+    unified enum type.
+    """
+
+    def __init__(self, name, *sources, default=None, values=None, otherwise=None,
+                 blank_is_null=False, remap=None, unmapped='keep', apply=None, fallback=None,
+                 cast=None):
+        self.name = name
+        self.sources = sources or (name,)
+        self.default = default
+        self.values = values
+        self.otherwise = otherwise
+        self.blank_is_null = blank_is_null
+        self.remap = remap
+        self.unmapped = unmapped
+        self.apply = apply
+        self.fallback = fallback
+        self.cast = cast
+
+
+class TableMapping:
+    """How the rows of source table `source` become rows of unified `target`
+
+    `key` is the source key (ordering, id ranges and checkpoints). `conflict`
+    and `update` describe the upsert: the unified unique key, and the columns
+    an existing row takes from the source.
+    """
+
+    def __init__(self, source, columns, target=None, key='id', conflict='id', update=()):
+        self.source = source
+        self.columns = columns
+        self.target = target or source
+        self.key = key
+        self.conflict = conflict
+        self.update = tuple(update)
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def compile(self, conn):
+        """This mapping compiled against the source database behind `conn`"""
+        with self._lock:
+            compiled = self._compiled.get(conn.dsn)
+        if compiled is None:
+            schema = source_schema(conn)
+            if self.source not in schema:
+                raise ValueError(f"Source table {self.source} not found")
+            compiled = self.compile_types(conn.dsn, schema[self.source])
+        return compiled
+
+    def compile_types(self, name, types):
+        """This mapping compiled against source columns `types` ({column: data_type},
+        e.g. as recorded in a snapshot), cached as `name`"""
+        with self._lock:
+            compiled = self._compiled.get(name)
+            if compiled is None:
+                compiled = self._compiled[name] = CompiledMapping(self, types)
+            return compiled
+
+
+class CompiledMapping:
+    """A TableMapping resolved against one source schema"""
+
+    def __init__(self, mapping, types):
+        self.mapping = mapping
+        self.columns = [column.name for column in mapping.columns]
+        self.casts = {column.name: column.cast for column in mapping.columns if column.cast}
+        # Unified column → SQL computing it from the source table
+        self.expressions = {column.name: _expression(column, types) for column in mapping.columns}
+        self.select = ',\n    '.join(expression if expression == name else f"{expression} AS {name}"
+                                     for name, expression in self.expressions.items())
+
+    def query(self, where='', keyed=False):
+        """The extract query; `where` filters the source, `keyed` adds its key as _key"""
+        # Qualified, as a unified column may share the key's name
+        key = f"{self.mapping.source}.{self.mapping.key}"
+        extra = f",\n    {key} AS _key" if keyed else ''
+        return f"SELECT\n    {self.select}{extra}\nFROM {self.mapping.source} {where}\nORDER BY {key}"
+
+    def transformer(self, maps=None, keyed=False):
+        """Function finishing a batch of extracted rows in place and returning it:
+        ID remaps through `maps` ({remap name: dict or function}), `apply` and
+        `fallback` functions. With `keyed` it returns (source key, row) pairs
+        for query(keyed=True) rows."""
+        steps = []
+        fallbacks = []
+        for column in self.mapping.columns:
+            if column.remap:
+                steps.append((column.name, _remapper(maps[column.remap], column.unmapped)))
+            if column.apply:
+                steps.append((column.name, _non_null(column.apply)))
+            if column.fallback:
+                fallbacks.append((column.name, column.fallback))
+
+        def transform(batch):
+            # A column at a time: dict remaps run as one C-level map() per batch
+            for name, step in steps:
+                for row, value in zip(batch, step([row[name] for row in batch])):
+                    row[name] = value
+            for name, fallback in fallbacks:
+                for row in batch:
+                    if row[name] is None:
+                        row[name] = fallback(row)
+            if keyed:
+                return [(row.pop('_key'), row) for row in batch]
+            return batch
+
+        return transform
+
+    def upsert(self):
+        """(shape, build) of the prepared statement inserting or updating one row
+        (see migration.statements); its parameters are params(row)"""
+        mapping = self.mapping
+        columns = self.columns
+        casts = self.casts
+
+        def build():
+            values = ', '.join(f"${i}::{casts[c]}" if c in casts else f"${i}"
+                               for i, c in enumerate(columns, 1))
+            updates = ', '.join(f"{c} = EXCLUDED.{c}" for c in mapping.update)
+            return f"""
+                INSERT INTO {mapping.target} ({', '.join(columns)})
+                VALUES ({values})
+                ON CONFLICT ({mapping.conflict}) {f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'}
+            """
+
+        return (mapping.target, 'upsert', tuple(columns)), build
+
+    def params(self, row):
+        """Parameters of upsert() for `row`"""
+        return [row[c] for c in self.columns]
+
+
+def _expression(column, types):
+    """SQL computing `column` from a source table with columns `types`"""
+    textual = column.values is not None or isinstance(column.default, str)
+    parts = []
+    for source in column.sources:
+        if isinstance(source, Sql):
+            if all(c in types for c in source.columns):
+                parts.append(source.text)
+        elif source in types:
+            expression = source
+            if textual and types[source] == 'USER-DEFINED':
+                expression = f"{source}::text"    # compare enums by label
+            if column.blank_is_null and types[source] in TEXT_TYPES:
+                expression = f"NULLIF({expression}, '')"
+            parts.append(expression)
+    if column.default is not None:
+        parts.append(_literal(column.default))
+
+    if not parts:
+        expression = 'NULL'
+    elif len(parts) == 1:
+        expression = parts[0]
+    else:
+        expression = f"COALESCE({', '.join(parts)})"
+
+    if column.values is None:
+        return expression
+    if any(isinstance(value, str) for value in column.values) and not expression.endswith('::text'):
+        expression = f"({expression})::text"
+    cases = ' '.join(f"WHEN {_literal(value)} THEN {_literal(mapped)}"
+                     for value, mapped in column.values.items())
+    otherwise = expression if column.otherwise is None else _literal(column.otherwise)
+    return f"CASE {expression} {cases} ELSE {otherwise} END"
+
+
+def _literal(value):
+    """SQL literal of a Python value (or the text of a Sql expression)"""
+    if isinstance(value, Sql):
+        return value.text
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _non_null(function):
+    """`function` applied to each non-null value of a list"""
+    return lambda values: [None if value is None else function(value) for value in values]
+
+
+def _remapper(lookup, unmapped):
+    """Function remapping a list of values through an ID map (dict) or lookup function"""
+    if callable(lookup):
+        return _non_null(lookup)
+    if unmapped == 'keep':
+        return lambda values: list(map(lookup.get, values, values))
+    return lambda values: list(map(lookup.get, values))
@@ -0,0 +1,157 @@
+"""
+Fan-in of several sources into one set of merged rows.
+
+migrate_data.py reads profiles and companies from two databases that share
+users and companies. Rather than writing every source row and merging in
+the target (an insert, then an update of the same row by email or slug),
+the sources are read side by side, each into a MergeSet that collapses the
+rows sharing a match key, and the sets are then folded together in source
+order, so every entity is written once.
+
+The result is that of writing the rows one after another, sources in
+order and each source's rows by key:
+
+- a row joins the entity whose first row has any of its match keys (tried
+  in order), else it starts a new entity;
+- an entity keeps the `protected` fields (its id and match keys) of its
+  first row;
+- every other field takes the last non-null value, except `greatest`
+  fields, which keep the largest.
+
+A MergeSet holds up to MIGRATION_MERGE_ROWS entities in memory. Beyond
+that it moves them to a temporary SQLite database (in MIGRATION_MERGE_DIR
+if set), so the merge can outgrow RAM.
+"""
+
+import os
+import pickle
+import sqlite3
+import tempfile
+
+# Entities a merge set keeps in memory before spilling to disk
+MERGE_ROWS = int(os.getenv('MIGRATION_MERGE_ROWS', '200000'))
+
+# Directory for spilled merge sets (unset = the system temporary directory)
+MERGE_DIR = os.getenv('MIGRATION_MERGE_DIR') or None
+
+
+class MergeSet:
+    """Rows collapsed by match `keys`, each entity with the old ids of its rows"""
+
+    def __init__(self, keys, protected=(), greatest=(), max_rows=MERGE_ROWS, directory=MERGE_DIR):
+        self.keys = tuple(keys)
+        self.protected = frozenset(protected)
+        self.greatest = frozenset(greatest)
+        self.max_rows = max_rows
+        self.directory = directory
+        self.rows = 0           # source rows added
+        self._index = {}        # (key, value) -> position of the entity
+        self._entities = []     # [old_ids, row] by position
+        self._db = None
+        self._path = None
+        self._count = 0
+
+    @property
+    def spilled(self):
+        return self._db is not None
+
+    def __len__(self):
+        return self._count
+
+    def add(self, old_ids, row):
+        """Merge `row` (from source rows `old_ids`) into its entity, or start one"""
+        self.rows += len(old_ids)
+        if self._db is not None:
+            self._add_spilled(old_ids, row)
+            return
+
+        pos = next((self._index[(k, row[k])] for k in self.keys
+                    if row.get(k) is not None and (k, row[k]) in self._index), None)
+        if pos is not None:
+            entity = self._entities[pos]
+            entity[0].extend(old_ids)
+            self._merge(entity[1], row)
+            return
+
+        pos = len(self._entities)
+        self._entities.append([list(old_ids), dict(row)])
+        for k in self.keys:
+            if row.get(k) is not None:
+                self._index.setdefault((k, row[k]), pos)
+        self._count += 1
+        if self._count > self.max_rows:
+            self._spill()
+
+    def update(self, other):
+        """Fold in the entities of `other`, as if its rows came after these"""
+        for old_ids, row in other:
+            self.add(old_ids, row)
+
+    def __iter__(self):
+        """(old_ids, row) of every entity, in the order they were started"""
+        if self._db is None:
+            for old_ids, row in self._entities:
+                yield old_ids, row
+            return
+        cur = self._db.execute("SELECT old_ids, row FROM entities ORDER BY pos")
+        for old_ids, row in cur:
+            yield pickle.loads(old_ids), pickle.loads(row)
+
+    def close(self):
+        """Drop the entities (and the spill file)"""
+        self._index, self._entities = {}, []
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            os.remove(self._path)
+
+    def _merge(self, target, row):
+        for k, v in row.items():
+            if k in self.protected or v is None:
+                continue
+            if k in self.greatest and target.get(k) is not None:
+                v = max(v, target[k])
+            target[k] = v
+
+    def _spill(self):
+        """Move the entities and their keys into a temporary SQLite database"""
+        fd, self._path = tempfile.mkstemp(prefix='merge-', suffix='.sqlite', dir=self.directory)
+        os.close(fd)
+        # Used by the thread that fills the set, then by the one writing it out
+        db = sqlite3.connect(self._path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute("CREATE TABLE keys (key TEXT, value, pos INTEGER, PRIMARY KEY (key, value)) WITHOUT ROWID")
+        db.execute("CREATE TABLE entities (pos INTEGER PRIMARY KEY, old_ids BLOB, row BLOB)")
+        db.executemany("INSERT INTO keys VALUES (?, ?, ?)",
+                       ((k, v, pos) for (k, v), pos in self._index.items()))
+        db.executemany("INSERT INTO entities VALUES (?, ?, ?)",
+                       ((pos, pickle.dumps(old_ids), pickle.dumps(row))
+                        for pos, (old_ids, row) in enumerate(self._entities)))
+        self._db = db
+        self._index, self._entities = {}, []
+
+    def _add_spilled(self, old_ids, row):
+        db = self._db
+        pos = None
+        for k in self.keys:
+            if row.get(k) is not None:
+                found = db.execute("SELECT pos FROM keys WHERE key = ? AND value = ?", (k, row[k])).fetchone()
+                if found:
+                    pos = found[0]
+                    break
+
+        if pos is not None:
+            stored_ids, stored = db.execute("SELECT old_ids, row FROM entities WHERE pos = ?", (pos,)).fetchone()
+            stored_ids, stored = pickle.loads(stored_ids), pickle.loads(stored)
+            stored_ids.extend(old_ids)
+            self._merge(stored, row)
+            db.execute("UPDATE entities SET old_ids = ?, row = ? WHERE pos = ?",
+                       (pickle.dumps(stored_ids), pickle.dumps(stored), pos))
+            return
+
+        pos = self._count
+        db.execute("INSERT INTO entities VALUES (?, ?, ?)", (pos, pickle.dumps(list(old_ids)), pickle.dumps(dict(row))))
+        db.executemany("INSERT OR IGNORE INTO keys VALUES (?, ?, ?)",
+                       [(k, row[k], pos) for k in self.keys if row.get(k) is not None])
+        self._count += 1
@@ -0,0 +1,607 @@
+"""
+Per-stage metrics for a migration run.
+
+Each migration stage (a @measured migrator method) gets counters for rows
+read, written, rejected and skipped, its database round trips, batch
+timings, and how its time splits between fetching source rows, writing to
+the target and everything in between (mapping rows in Python, bookkeeping).
+Parallel chunks of a stage add up into the same counters. The end-of-run
+summary is built from these counters and the planner's row estimates, so it
+doesn't scan the target tables.
+
+Round trips are counted by MeteredConnection: one per statement sent, per
+FETCH of a server-side cursor, per COMMIT/ROLLBACK and per implicit BEGIN.
+
+While a run is in progress a line per active stage is printed every
+MIGRATION_PROGRESS_SECONDS with its throughput and, when the source size is
+known, an ETA. At the end the metrics can be written as JSON or in the
+Prometheus text format.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from uuid import UUID
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extensions import STATUS_READY
+
+from migration.batching import AdaptiveBatches
+from migration.streaming import batched
+
+# Seconds between progress lines (0 = no progress lines)
+PROGRESS_SECONDS = float(os.getenv('MIGRATION_PROGRESS_SECONDS', '10'))
+
+# Bucket for work done outside any stage (connecting, summaries)
+OTHER = 'other'
+
+ROW_COUNTERS = ('rows_read', 'rows_written', 'rows_rejected')
+
+
+class StageMetrics:
+    """Counters and timings of one stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows_read = 0
+        self.rows_written = 0
+        self.rows_rejected = 0
+        self.expected_rows = None
+        self.round_trips = 0
+        self.fetch_seconds = 0.0
+        self.write_seconds = 0.0
+        self.batch_seconds = []
+        self.lag_seconds = None     # replication lag, for stages following a change stream
+        self.lag_bytes = None
+        self.batch_sizer = None     # AdaptiveBatches tuning this stage's batch size, if any
+        self.started = None
+        self.finished = None
+        self.active = 0
+        self.lock = threading.Lock()
+
+    @property
+    def rows_skipped(self):
+        """Rows read that were neither written nor rejected"""
+        return max(self.rows_read - self.rows_written - self.rows_rejected, 0)
+
+    @property
+    def wall_seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished if self.active == 0 else time.monotonic()) - self.started
+
+    @property
+    def transform_seconds(self):
+        """Batch time not spent fetching or writing"""
+        return max(sum(self.batch_seconds) - self.fetch_seconds - self.write_seconds, 0.0)
+
+    def rate(self):
+        """Rows read per second of wall time"""
+        wall = self.wall_seconds
+        return self.rows_read / wall if wall else 0.0
+
+    def to_dict(self):
+        batches = sorted(self.batch_seconds)
+        return {
+            'wall_seconds': round(self.wall_seconds, 4),
+            'rows_read': self.rows_read,
+            'rows_written': self.rows_written,
+            'rows_skipped': self.rows_skipped,
+            'rows_rejected': self.rows_rejected,
+            'rows_per_second': round(self.rate(), 1),
+            'round_trips': self.round_trips,
+            'fetch_seconds': round(self.fetch_seconds, 4),
+            'write_seconds': round(self.write_seconds, 4),
+            'transform_seconds': round(self.transform_seconds, 4),
+            'lag_seconds': None if self.lag_seconds is None else round(self.lag_seconds, 3),
+            'lag_bytes': self.lag_bytes,
+            'batch_size': self.batch_sizer.to_dict() if self.batch_sizer else None,
+            'batches': {
+                'count': len(batches),
+                'mean_seconds': round(sum(batches) / len(batches), 4) if batches else None,
+                'p50_seconds': round(_quantile(batches, 0.5), 4) if batches else None,
+                'p95_seconds': round(_quantile(batches, 0.95), 4) if batches else None,
+                'max_seconds': round(batches[-1], 4) if batches else None,
+            },
+        }
+
+
+class Metrics:
+    """Metrics of one migration run, shared by the migrator and its forks"""
+
+    def __init__(self, script, progress_seconds=PROGRESS_SECONDS):
+        self.script = script
+        self.progress_seconds = progress_seconds
+        self.started_at = datetime.now(timezone.utc)
+        self.stages = {OTHER: StageMetrics(OTHER)}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._progress = None
+        self._threads = {}          # thread ident -> name of the stage it works on
+        self.profiler = None        # Profiler told as stages start and finish (--profile)
+
+    # -- stages ---------------------------------------------------------------
+
+    def stage(self, name):
+        """Context manager recording the work of this thread as stage `name`"""
+        return _StageScope(self, name)
+
+    def current(self):
+        """The stage this thread is working on"""
+        return getattr(self._local, 'stage', None) or self.stages[OTHER]
+
+    def bind(self, fn):
+        """`fn`, recording its work as this thread's current stage wherever it
+        is called, e.g. on a pipeline thread"""
+        name = self.current().name
+        @wraps(fn)
+        def run(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return run
+
+    def thread_stages(self):
+        """{thread ident: stage name} of the threads working on a stage"""
+        return dict(self._threads)
+
+    def _enter(self, name):
+        with self._lock:
+            stage = self.stages.setdefault(name, StageMetrics(name))
+        with stage.lock:
+            starting = stage.active == 0
+            if starting and stage.started is None:
+                stage.started = time.monotonic()
+            stage.active += 1
+        previous = getattr(self._local, 'stage', None)
+        self._local.stage = stage
+        self._threads[threading.get_ident()] = name
+        profiler = self.profiler
+        if profiler and starting and name != OTHER:
+            profiler.stage_started(name)
+        return previous
+
+    def _exit(self, previous):
+        stage = self._local.stage
+        with stage.lock:
+            stage.active -= 1
+            finishing = stage.active == 0
+            if finishing:
+                stage.finished = time.monotonic()
+        self._local.stage = previous
+        if previous is None:
+            self._threads.pop(threading.get_ident(), None)
+        else:
+            self._threads[threading.get_ident()] = previous.name
+        profiler = self.profiler
+        if profiler and finishing and stage.name != OTHER:
+            profiler.stage_finished(stage.name)
+
+    # -- recording ------------------------------------------------------------
+
+    def read(self, rows):
+        """Wrap a source row iterator, timing fetches and counting rows read"""
+        stage = self.current()
+        iterator = iter(rows)
+        pending_rows, pending_seconds = 0, 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    row = next(iterator)
+                except StopIteration:
+                    pending_seconds += time.perf_counter() - started
+                    return
+                pending_seconds += time.perf_counter() - started
+                pending_rows += 1
+                # Publish in blocks; a lock per row costs more than the fetch
+                if pending_rows == 1000:
+                    with stage.lock:
+                        stage.fetch_seconds += pending_seconds
+                        stage.rows_read += pending_rows
+                    pending_rows, pending_seconds = 0, 0.0
+                yield row
+        finally:
+            with stage.lock:
+                stage.fetch_seconds += pending_seconds
+                stage.rows_read += pending_rows
+
+    def batches(self, items, size):
+        """batched(items, size), timing each batch from its first row to its
+        write being finished; `size` may be an AdaptiveBatches"""
+        stage = self.current()
+        iterator = size.batched(items) if isinstance(size, AdaptiveBatches) else batched(items, size)
+        while True:
+            started = time.perf_counter()
+            batch = next(iterator, None)
+            if batch is None:
+                return
+            yield batch
+            with stage.lock:
+                stage.batch_seconds.append(time.perf_counter() - started)
+
+    def write(self, write, batch, *args):
+        """Call `write(batch, *args)`, which returns the rows it wrote; the rest
+        of the batch counts as rejected"""
+        stage = self.current()
+        started = time.perf_counter()
+        written = write(batch, *args)
+        with stage.lock:
+            stage.write_seconds += time.perf_counter() - started
+            stage.rows_written += written
+            stage.rows_rejected += len(batch) - written
+        return written
+
+    def batch_sizer(self, size):
+        """The AdaptiveBatches of this thread's stage, starting at `size` rows
+        (shared by its parallel chunks)"""
+        stage = self.current()
+        with stage.lock:
+            if stage.batch_sizer is None:
+                stage.batch_sizer = AdaptiveBatches(size)
+            return stage.batch_sizer
+
+    def count(self, **counters):
+        """Add to the row counters (rows_read=..., rows_written=...) of this thread's stage"""
+        stage = self.current()
+        with stage.lock:
+            for counter, value in counters.items():
+                if counter not in ROW_COUNTERS:
+                    raise ValueError(f"Unknown row counter: {counter}")
+                setattr(stage, counter, getattr(stage, counter) + value)
+
+    def expect(self, rows):
+        """Add `rows` to the source rows this thread's stage is expected to read"""
+        if rows is None:
+            return
+        stage = self.current()
+        with stage.lock:
+            stage.expected_rows = (stage.expected_rows or 0) + rows
+
+    def lag(self, seconds, size):
+        """Record how far this thread's stage trails its change stream, in seconds and WAL bytes"""
+        stage = self.current()
+        with stage.lock:
+            stage.lag_seconds = seconds
+            stage.lag_bytes = size
+
+    def round_trip(self, count=1):
+        stage = self.current()
+        with stage.lock:
+            stage.round_trips += count
+
+    def connect(self, dsn):
+        """Connect to `dsn` with round trips counted against the running stage"""
+        conn = psycopg2.connect(dsn, connection_factory=MeteredConnection)
+        conn.metrics = self
+        return conn
+
+    # -- progress -------------------------------------------------------------
+
+    def start_progress(self):
+        """Print a progress line per active stage every progress_seconds"""
+        if self.progress_seconds <= 0 or self._progress:
+            return
+        self._stop.clear()
+        self._progress = threading.Thread(target=self._report_progress, name='migration-progress', daemon=True)
+        self._progress.start()
+
+    def stop_progress(self):
+        if self._progress:
+            self._stop.set()
+            self._progress.join()
+            self._progress = None
+
+    def _report_progress(self):
+        while not self._stop.wait(self.progress_seconds):
+            for stage in list(self.stages.values()):
+                if stage.active and stage.name != OTHER:
+                    print(self.progress_line(stage))
+
+    def progress_line(self, stage):
+        if not stage.rows_read and not stage.expected_rows:
+            return f"   📈 {stage.name}: running for {timedelta(seconds=round(stage.wall_seconds))}"
+        rate = stage.rate()
+        line = (f"   📈 {stage.name}: {stage.rows_read:,} read, {stage.rows_written:,} written, "
+                f"{stage.rows_rejected:,} rejected, {rate:,.0f} rows/s")
+        if stage.expected_rows:
+            done = min(stage.rows_read / stage.expected_rows, 1)
+            line += f", {done:.0%}"
+            if rate:
+                eta = max(stage.expected_rows - stage.rows_read, 0) / rate
+                line += f", ETA {timedelta(seconds=round(eta))}"
+        if stage.lag_seconds is not None:
+            line += f", lag {stage.lag_seconds:.1f}s ({stage.lag_bytes:,} bytes of WAL)"
+        return line
+
+    # -- reporting ------------------------------------------------------------
+
+    def to_dict(self):
+        stages = {name: stage.to_dict() for name, stage in self.stages.items()
+                  if name != OTHER or stage.round_trips}
+        return {
+            'script': self.script,
+            'started_at': self.started_at.isoformat(),
+            'totals': {
+                counter: sum(stage[counter] for stage in stages.values())
+                for counter in ('rows_read', 'rows_written', 'rows_skipped', 'rows_rejected', 'round_trips')
+            },
+            'stages': stages,
+        }
+
+    def to_prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        data = self.to_dict()
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                labels = dict({'script': self.script}, **labels)
+                rendered = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{rendered}}} {value}")
+
+        stages = data['stages'].items()
+        family('migration_rows_total', 'counter', "Source rows by stage and outcome", [
+            ({'stage': name, 'outcome': outcome}, stage[f"rows_{outcome}"])
+            for name, stage in stages for outcome in ('read', 'written', 'skipped', 'rejected')
+        ])
+        family('migration_stage_seconds', 'gauge', "Stage time by phase (fetch/write/transform are summed over workers)", [
+            ({'stage': name, 'phase': phase}, stage[f"{phase}_seconds"])
+            for name, stage in stages for phase in ('wall', 'fetch', 'write', 'transform')
+        ])
+        family('migration_round_trips_total', 'counter', "Database round trips by stage", [
+            ({'stage': name}, stage['round_trips']) for name, stage in stages
+        ])
+        family('migration_rows_per_second', 'gauge', "Source rows read per second of stage wall time", [
+            ({'stage': name}, stage['rows_per_second']) for name, stage in stages
+        ])
+        lagging = [(name, stage) for name, stage in stages if stage['lag_seconds'] is not None]
+        if lagging:
+            family('migration_lag_seconds', 'gauge', "Time from a source commit to its changes being applied", [
+                ({'stage': name}, stage['lag_seconds']) for name, stage in lagging
+            ])
+            family('migration_lag_bytes', 'gauge', "Source WAL not yet applied", [
+                ({'stage': name}, stage['lag_bytes']) for name, stage in lagging
+            ])
+        sized = [(name, stage) for name, stage in stages if stage['batch_size']]
+        if sized:
+            family('migration_batch_rows', 'gauge', "Adaptive batch size the stage ended with", [
+                ({'stage': name}, stage['batch_size']['final']) for name, stage in sized
+            ])
+            family('migration_batch_back_offs_total', 'counter', "Batches retried in halves after a timeout or lock failure", [
+                ({'stage': name}, stage['batch_size']['back_offs']) for name, stage in sized
+            ])
+
+        lines.append("# HELP migration_batch_seconds Time per batch, from its first row to its write finishing")
+        lines.append("# TYPE migration_batch_seconds summary")
+        for name, stage in self.stages.items():
+            if not stage.batch_seconds:
+                continue
+            batches = sorted(stage.batch_seconds)
+            labels = f'script="{self.script}",stage="{name}"'
+            for q in (0.5, 0.95, 0.99):
+                lines.append(f'migration_batch_seconds{{{labels},quantile="{q}"}} {_quantile(batches, q):.6f}')
+            lines.append(f"migration_batch_seconds_sum{{{labels}}} {sum(batches):.6f}")
+            lines.append(f"migration_batch_seconds_count{{{labels}}} {len(batches)}")
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """Write the metrics to `path`: Prometheus text for .prom/.txt, JSON otherwise"""
+        if path.endswith(('.prom', '.txt')):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2) + '\n'
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def print_tables(self, conn, tables, exact=False):
+        """Print what this run did to each of `tables` (stages of the same name)
+        and how many rows the target has: estimated, or counted with `exact`"""
+        for table in tables:
+            stage = self.stages.get(table)
+            if stage is None or stage.started is None:
+                done = "not migrated in this run"
+            else:
+                done = (f"{stage.rows_written:,} written, {stage.rows_skipped:,} unchanged, "
+                        f"{stage.rows_rejected:,} rejected")
+            rows = target_rows(conn, table, exact)
+            if rows is None:
+                size = "not in target"
+            else:
+                size = f"{rows:,} in target" if exact else f"~{rows:,} in target (estimate)"
+            print(f"✅ {table.capitalize()}: {done}; {size}")
+
+    def print_stages(self):
+        """Print the per-stage breakdown"""
+        for name, stage in self.stages.items():
+            if name == OTHER or stage.started is None:
+                continue
+            print(f"⏱️  {name}: {stage.wall_seconds:.1f}s, {stage.rows_read:,} read, "
+                  f"{stage.rows_written:,} written, {stage.rows_skipped:,} skipped, "
+                  f"{stage.rows_rejected:,} rejected, {stage.rate():,.0f} rows/s, "
+                  f"{stage.round_trips:,} round trips")
+            if stage.batch_seconds:
+                print(f"     fetch {stage.fetch_seconds:.1f}s, write {stage.write_seconds:.1f}s, "
+                      f"transform {stage.transform_seconds:.1f}s over {len(stage.batch_seconds):,} batches "
+                      f"(p95 {_quantile(sorted(stage.batch_seconds), 0.95):.3f}s)")
+            if stage.batch_sizer:
+                sizes = stage.batch_sizer.to_dict()
+                print(f"     batch size {sizes['initial']:,} → {sizes['final']:,} rows "
+                      f"(range {sizes['min']:,}-{sizes['max']:,}, {sizes['back_offs']} back-offs)")
+
+
+class _StageScope:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = self.metrics._enter(self.name)
+        return self.metrics.current()
+
+    def __exit__(self, *exc):
+        self.metrics._exit(self.previous)
+        return False
+
+
+def measured(name):
+    """Decorator recording a migrator method (which has .metrics) as stage `name`"""
+    def decorate(method):
+        @wraps(method)
+        def run(self, *args, **kwargs):
+            with self.metrics.stage(name):
+                return method(self, *args, **kwargs)
+        return run
+    return decorate
+
+
+def estimate_rows(conn, table, key_range=None, after=None):
+    """Planner estimate of the rows of `table` with ids in `key_range` and
+    after `after` (None when the table has never been analyzed)
+
+    Ids are v4 UUIDs, spread evenly over the keyspace, so a slice of the
+    keyspace holds the same share of the rows.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+        row = cur.fetchone()
+    if not row or row[0] < 0:
+        return None
+    lo, hi = key_range or (None, None)
+    lo = max(UUID(lo).int if lo else 0, UUID(after).int if after else 0)
+    hi = UUID(hi).int if hi else 1 << 128
+    return int(row[0] * max(hi - lo, 0) / (1 << 128))
+
+
+def target_rows(conn, table, exact=False):
+    """Rows of `table` without scanning it, or with COUNT(*) if `exact`; None
+    if there is no such table
+
+    An analyzed table gets the planner's estimate (its pg_class statistics
+    scaled to the table's current size); one never analyzed, such as a table
+    just loaded, gets the live row count of the statistics system.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT reltuples >= 0 FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        if exact:
+            cur.execute(f"SELECT COUNT(*) FROM {table}")
+            return cur.fetchone()[0]
+        if row[0]:
+            cur.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {table}")
+            return int(cur.fetchone()[0][0]['Plan']['Plan Rows'])
+        if conn.server_version >= 150000:
+            # This session's own writes are only reported once it goes idle
+            cur.execute("SELECT pg_stat_force_next_flush()")
+        conn.commit()
+        cur.execute("SELECT n_live_tup FROM pg_stat_user_tables WHERE relid = to_regclass(%s)", (table,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _quantile(ordered, q):
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class _MeteredCursorMixin:
+    """Counts the round trips a cursor makes on a MeteredConnection"""
+
+    def _sent(self, count=1):
+        # psycopg2 opens a transaction with a separate BEGIN before the first statement
+        if not self.connection.autocommit and self.connection.status == STATUS_READY:
+            count += 1
+        self.connection.metrics.round_trip(count)
+
+    def execute(self, query, vars=None):
+        self._sent()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        self._sent(len(vars_list))
+        return super().executemany(query, vars_list)
+
+    def callproc(self, procname, parameters=None):
+        self._sent()
+        return super().callproc(procname, parameters)
+
+    def copy_expert(self, sql, file, size=8192):
+        self._sent()
+        return super().copy_expert(sql, file, size)
+
+    def copy_from(self, file, table, *args, **kwargs):
+        self._sent()
+        return super().copy_from(file, table, *args, **kwargs)
+
+    def copy_to(self, file, table, *args, **kwargs):
+        self._sent()
+        return super().copy_to(file, table, *args, **kwargs)
+
+    # Server-side (named) cursors fetch from the server on every call
+
+    def fetchone(self):
+        if self.name is not None:
+            self.connection.metrics.round_trip()
+        return super().fetchone()
+
+    def fetchmany(self, size=None):
+        if self.name is not None:
+            self.connection.metrics.round_trip()
+        return super().fetchmany() if size is None else super().fetchmany(size)
+
+    def fetchall(self):
+        if self.name is not None:
+            self.connection.metrics.round_trip()
+        return super().fetchall()
+
+    def close(self):
+        # Closing an executed server-side cursor inside a transaction sends CLOSE
+        if self.name is not None and not self.closed and self.query is not None \
+                and self.connection.status != STATUS_READY:
+            self.connection.metrics.round_trip()
+        return super().close()
+
+    def __iter__(self):
+        if self.name is None:
+            return super().__iter__()
+        return self._iter_named()
+
+    def _iter_named(self):
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if not rows:
+                return
+            yield from rows
+
+
+_metered_cursors = {}
+
+
+class MeteredConnection(psycopg2.extensions.connection):
+    """psycopg2 connection reporting its round trips to `self.metrics`"""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        if base not in _metered_cursors:
+            _metered_cursors[base] = type(f"Metered{base.__name__}", (_MeteredCursorMixin, base), {})
+        kwargs['cursor_factory'] = _metered_cursors[base]
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        if self.status != STATUS_READY:
+            self.metrics.round_trip()
+        return super().commit()
+
+    def rollback(self):
+        if self.status != STATUS_READY:
+            self.metrics.round_trip()
+        return super().rollback()
@@ -0,0 +1,142 @@
+"""
+Asyncio pipeline that overlaps source reads, transforms and target writes.
+
+A stage normally fetches a batch, maps it, writes it and only then fetches
+the next one, so the source sits idle while the target works and the other
+way round. Here a reader, a transformer and one or more writers run side by
+side, connected by bounded queues. psycopg2 calls block, so each of them
+runs on its own thread (libpq releases the GIL while it waits on the
+network); the coroutines only hand batches from one queue to the next.
+
+At most MIGRATION_PIPELINE_BATCHES batches per writer (plus one being read)
+are in flight at any time; the reader waits once that many are queued or
+being written, which keeps memory bounded however fast the source is.
+Completed batches are reported in source order, so checkpoints never skip
+past a batch that is still being written.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# Batches each writer may have queued or in progress
+PIPELINE_BATCHES = int(os.getenv('MIGRATION_PIPELINE_BATCHES', '2'))
+
+_END = object()
+
+
+def write_batches(metrics, batches, writers, done, transform=None, pipeline=False, sizer=None):
+    """Write `batches` and return the number of rows written
+
+    Each batch goes through `transform` (if given) and is written with
+    `metrics.write(writer, batch)`; `done(batch, written)` follows every
+    batch, in order. Without `pipeline` the batches are handled one at a
+    time with writers[0]; with it they run through run_pipeline across all
+    `writers`, recorded as the caller's current stage. With a `sizer`
+    (the AdaptiveBatches `batches` come from) every write is timed by it
+    and retried in halves when it backs off.
+    """
+    if sizer:
+        writers = [partial(sizer.write, writer) for writer in writers]
+    total = 0
+    if not pipeline:
+        for batch in batches:
+            if transform:
+                batch = transform(batch)
+            written = metrics.write(writers[0], batch)
+            done(batch, written)
+            total += written
+        return total
+
+    def finished(batch, written):
+        nonlocal total
+        done(batch, written)
+        total += written
+
+    run_pipeline(
+        metrics.bind(partial(next, batches, None)),
+        [metrics.bind(partial(metrics.write, writer)) for writer in writers],
+        finished,
+        transform=metrics.bind(transform) if transform else None
+    )
+    return total
+
+
+def run_pipeline(read, writers, done, transform=None, queue_batches=PIPELINE_BATCHES):
+    """Run a read → transform → write pipeline to completion
+
+    `read()` returns the next batch, or None when the source is exhausted.
+    `transform(batch)`, if given, returns the batch to write. Each callable in
+    `writers` writes a batch on its own connection and returns a result;
+    `done(batch, result)` is then called for every batch in the order they
+    were read. The first exception raised anywhere stops the pipeline and
+    is re-raised here.
+    """
+    asyncio.run(_pipeline(read, writers, done, transform, queue_batches))
+
+
+async def _pipeline(read, writers, done, transform, queue_batches):
+    loop = asyncio.get_running_loop()
+    capacity = queue_batches * len(writers)
+    in_flight = asyncio.Semaphore(capacity + 1)
+    to_transform = asyncio.Queue(capacity)
+    to_write = asyncio.Queue(capacity)
+    finished = {}
+    next_done = 0
+
+    executors = [ThreadPoolExecutor(1, thread_name_prefix=f'pipeline-{role}')
+                 for role in ['read', 'transform'] + [f'write-{i}' for i in range(len(writers))]]
+    read_executor, transform_executor, write_executors = executors[0], executors[1], executors[2:]
+
+    async def reader():
+        seq = 0
+        while True:
+            await in_flight.acquire()
+            batch = await loop.run_in_executor(read_executor, read)
+            if batch is None:
+                await to_transform.put(_END)
+                return
+            await to_transform.put((seq, batch))
+            seq += 1
+
+    async def transformer():
+        while True:
+            item = await to_transform.get()
+            if item is _END:
+                for _ in writers:
+                    await to_write.put(_END)
+                return
+            seq, batch = item
+            if transform:
+                batch = await loop.run_in_executor(transform_executor, transform, batch)
+            await to_write.put((seq, batch))
+
+    async def writer(write, executor):
+        nonlocal next_done
+        while True:
+            item = await to_write.get()
+            if item is _END:
+                return
+            seq, batch = item
+            finished[seq] = (batch, await loop.run_in_executor(executor, write, batch))
+            # Report in source order; a later batch waits for slower earlier ones
+            while next_done in finished:
+                done(*finished.pop(next_done))
+                next_done += 1
+                in_flight.release()
+
+    tasks = [asyncio.ensure_future(reader()), asyncio.ensure_future(transformer())]
+    tasks += [asyncio.ensure_future(writer(write, executor))
+              for write, executor in zip(writers, write_executors)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        # Let a read or write already running on a thread finish before returning
+        for executor in executors:
+            executor.shutdown(wait=True)
@@ -0,0 +1,195 @@
+"""
+Per-stage sampling profiles and allocation tracking (--profile).
+
+A background thread samples the stack of every thread working on a stage
+(see Metrics.thread_stages) every MIGRATION_PROFILE_INTERVAL seconds, via
+sys._current_frames(), and counts each distinct stack per stage. The
+counts are written as one collapsed-stack file per stage, the input of
+flamegraph.pl, speedscope or inferno. Samples are wall-clock: time spent
+waiting on a database appears under the cursor call that waits
+(execute/fetchmany in metrics.py), time spent building rows and mapping
+them under the Python frames doing it. Each stack starts with the name of
+the thread that ran it (MainThread, pipeline-write-0_0, ...).
+
+tracemalloc traces allocations for the whole run. Per stage the report
+gives the peak of traced memory while it ran, the top allocation sites
+near that peak, and what it left allocated when it finished. Stages that
+run at the same time see each other's allocations.
+
+tracemalloc slows Python code down noticeably; profile a representative
+subset rather than a production run.
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# Seconds between stack samples
+PROFILE_INTERVAL = float(os.getenv('MIGRATION_PROFILE_INTERVAL', '0.01'))
+
+# Allocation sites listed per stage
+PROFILE_TOP = int(os.getenv('MIGRATION_PROFILE_TOP', '15'))
+
+# A stage's peak is snapshotted again once traced memory grows this much past
+# the last one, at most every PEAK_SECONDS (snapshots are slow)
+PEAK_GROWTH = 1.1
+PEAK_SECONDS = 2
+
+# Allocations left out of the reports (the profiler's own, the import system's)
+IGNORED = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+           tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+           tracemalloc.Filter(False, '<unknown>'))
+
+
+class Profiler:
+    """Samples the stacks of the threads working on stages of `metrics`
+    and traces their allocations; start(), stop(), then write(directory)"""
+
+    def __init__(self, metrics, interval=PROFILE_INTERVAL, top=PROFILE_TOP):
+        self.metrics = metrics
+        self.interval = interval
+        self.top = top
+        self.stacks = {}            # stage -> Counter of collapsed stacks
+        self.samples = Counter()    # stage -> samples taken
+        self._started = {}          # stage -> snapshot when it started
+        self._finished = {}         # stage -> snapshot when it finished
+        self._peaks = {}            # stage -> (traced bytes, snapshot at the time)
+        self._peak_bytes = {}       # stage -> most traced bytes sampled while it ran
+        self._names = {}            # thread ident -> name
+        self._labels = {}           # code object -> its frame's label in stacks
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.metrics.profiler = self
+        self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.metrics.profiler = None
+        tracemalloc.stop()
+
+    # -- called by Metrics as stages start and finish -------------------------
+
+    def stage_started(self, name):
+        if name not in self._started:
+            self._started[name] = tracemalloc.take_snapshot()
+
+    def stage_finished(self, name):
+        self._finished[name] = tracemalloc.take_snapshot()
+
+    # -- sampling -------------------------------------------------------------
+
+    def _sample(self):
+        last_snapshot = 0
+        while not self._stop.wait(self.interval):
+            stages = self.metrics.thread_stages()
+            if not stages:
+                continue
+            frames = sys._current_frames()
+            traced = tracemalloc.get_traced_memory()[0]
+            with self._lock:
+                for ident, stage in stages.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self.stacks.setdefault(stage, Counter())[self._collapse(ident, frame)] += 1
+                        self.samples[stage] += 1
+            del frames
+            for stage in set(stages.values()):
+                self._peak_bytes[stage] = max(self._peak_bytes.get(stage, 0), traced)
+            growing = [stage for stage in set(stages.values())
+                       if stage not in self._peaks or traced > self._peaks[stage][0] * PEAK_GROWTH]
+            first = any(stage not in self._peaks for stage in growing)
+            if growing and (first or time.monotonic() - last_snapshot >= PEAK_SECONDS):
+                snapshot, last_snapshot = tracemalloc.take_snapshot(), time.monotonic()
+                for stage in growing:
+                    self._peaks[stage] = (traced, snapshot)
+
+    def _collapse(self, ident, frame):
+        """The stack of `frame` as 'thread;outermost;...;innermost'"""
+        names = []
+        labels = self._labels
+        while frame is not None:
+            code = frame.f_code
+            label = labels.get(code)
+            if label is None:
+                label = labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            names.append(label)
+            frame = frame.f_back
+        names.append(self._thread_name(ident))
+        return ';'.join(reversed(names))
+
+    def _thread_name(self, ident):
+        if ident not in self._names:
+            self._names.update((thread.ident, thread.name) for thread in threading.enumerate())
+        return self._names.get(ident, str(ident))
+
+    # -- reporting ------------------------------------------------------------
+
+    def write(self, directory):
+        """Write <stage>.collapsed per stage and allocations.txt to `directory`;
+        returns the paths written"""
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        with self._lock:
+            stacks = {stage: Counter(counts) for stage, counts in self.stacks.items()}
+        for stage, counts in sorted(stacks.items()):
+            path = os.path.join(directory, f"{stage}.collapsed")
+            with open(path, 'w') as f:
+                for stack, count in counts.most_common():
+                    f.write(f"{stack} {count}\n")
+            paths.append(path)
+
+        path = os.path.join(directory, 'allocations.txt')
+        with open(path, 'w') as f:
+            f.write(f"Allocations traced by tracemalloc, by stage (top {self.top} sites)\n"
+                    f"Stages running at the same time include each other's allocations.\n")
+            for stage in self._started:
+                f.write(self._allocations(stage))
+        paths.append(path)
+        return paths
+
+    def _allocations(self, stage):
+        lines = [f"\n== {stage} ({self.samples[stage]:,} stack samples)"]
+        peak = self._peaks.get(stage)
+        if peak:
+            traced, snapshot = peak
+            lines.append(f"Peak traced memory {_size(self._peak_bytes[stage])}; "
+                         f"largest allocation sites at {_size(traced)}:")
+            lines += _top(snapshot.filter_traces(IGNORED).statistics('lineno'), self.top)
+        finished = self._finished.get(stage)
+        if finished:
+            growth = finished.filter_traces(IGNORED).compare_to(self._started[stage].filter_traces(IGNORED),
+                                                                 'lineno')
+            total = sum(stat.size_diff for stat in growth)
+            lines.append(f"Traced memory from start to finish: {'+' if total >= 0 else ''}{_size(total)}; "
+                         f"sites that grew:")
+            lines += _top([stat for stat in growth if stat.size_diff > 0], self.top, diff=True)
+        return '\n'.join(lines) + '\n'
+
+
+def _top(stats, count, diff=False):
+    lines = []
+    for stat in stats[:count]:
+        frame = stat.traceback[0]
+        size = f"+{_size(stat.size_diff)}" if diff else _size(stat.size)
+        blocks = stat.count_diff if diff else stat.count
+        lines.append(f"  {size:>12}  {blocks:>9,} blocks  {frame.filename}:{frame.lineno}")
+    return lines
+
+
+def _size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return f"{size:,.1f} {unit}"
+        size /= 1024
+    return f"{size:,.1f} GiB"
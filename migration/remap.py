@@ -0,0 +1,95 @@
+"""
+Foreign keys remapped on the target server, through ID maps shipped to it.
+
+Once the profiles and companies stages have built their ID maps, the maps
+are bulk-loaded with COPY into mapping tables on the unified database
+(old_id → new_id, UNLOGGED: they only live for the run). Rows referencing
+profiles or companies are then written with their source ids and remapped
+by a join in the same INSERT, and references already in the database are
+rewritten with one UPDATE ... FROM per column, so no id is looked up in
+Python row by row.
+"""
+
+COPY_BUFFER_SIZE = 1 << 20
+
+
+class _Lines:
+    """File-like object over an iterator of text lines, for copy_expert()"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = ''.join(line for _, line in zip(range(4096), self.lines))
+            if not chunk:
+                break
+            self.buffer += chunk.encode()
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def ship_id_map(conn, table, id_map):
+    """(Re)create mapping table `table` holding the entries of `id_map`;
+    returns the number of entries shipped"""
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+        cur.execute(f"CREATE UNLOGGED TABLE {table} (old_id UUID NOT NULL, new_id UUID NOT NULL)")
+        cur.copy_expert(f"COPY {table} (old_id, new_id) FROM STDIN",
+                        _Lines(f"{old_id}\t{new_id}\n" for old_id, new_id in id_map.items()),
+                        size=COPY_BUFFER_SIZE)
+        shipped = cur.rowcount
+        # Indexed after loading, which is much faster than maintaining it row by row
+        cur.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (old_id)")
+        cur.execute(f"ANALYZE {table}")
+    conn.commit()
+    return shipped
+
+
+def drop_id_maps(conn, *tables):
+    """Drop mapping tables created by ship_id_map()"""
+    with conn.cursor() as cur:
+        for table in tables:
+            cur.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.commit()
+
+
+def remapped_columns(columns, remaps, source='s'):
+    """SELECT list and joins reading `columns` from `source`, remapped by `remaps`
+
+    `remaps` maps a column to (mapping table, unmapped): ids missing from the
+    mapping table are kept with unmapped='keep', nulled with None, or, with a
+    table name, kept only if that table has a row with that id.
+    """
+    select, joins = [], []
+    for column in columns:
+        if column not in remaps:
+            select.append(f"{source}.{column}")
+            continue
+        table, unmapped = remaps[column]
+        alias = f"map_{column}"
+        joins.append(f"LEFT JOIN {table} {alias} ON {alias}.old_id = {source}.{column}")
+        if unmapped == 'keep':
+            select.append(f"COALESCE({alias}.new_id, {source}.{column})")
+        elif unmapped is None:
+            select.append(f"{alias}.new_id")
+        else:
+            known = f"known_{column}"
+            joins.append(f"LEFT JOIN {unmapped} {known} ON {known}.id = {source}.{column}")
+            select.append(f"COALESCE({alias}.new_id, {known}.id)")
+    return ', '.join(select), ' '.join(joins)
+
+
+def update_references(conn, table, column, map_table):
+    """Point `table`.`column` at new ids for every id `map_table` changes;
+    returns the number of rows updated"""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            UPDATE {table} t SET {column} = m.new_id
+            FROM {map_table} m
+            WHERE t.{column} = m.old_id AND m.new_id <> m.old_id
+        """)
+        return cur.rowcount
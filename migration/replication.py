@@ -0,0 +1,201 @@
+"""
+Changes streamed from a logical replication slot on the source database.
+
+A publication of the migrated tables and a pgoutput slot (built into
+Postgres, no extension needed) are created on the source; the slot keeps
+every change committed after its creation until it is read and confirmed.
+ChangeStream decodes the pgoutput messages into Change and Commit events:
+only the table, the kind of change and the row's key are kept. Callers
+re-read the changed rows through their mapped SELECT, so a change is
+migrated by exactly the same SQL as a full run, and replaying a change
+twice is harmless. A commit is only confirmed to the server once the
+changes before it are applied, so nothing is lost if the sync stops.
+"""
+
+import os
+import select
+import struct
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+from psycopg2.extras import LogicalReplicationConnection
+
+SYNC_SLOT = os.getenv('MIGRATION_SYNC_SLOT', 'smartpro_migration')
+SYNC_PUBLICATION = os.getenv('MIGRATION_SYNC_PUBLICATION', 'smartpro_migration')
+
+# A micro-batch is applied once it holds this many changed rows, or this many
+# seconds after its first change
+SYNC_BATCH_ROWS = int(os.getenv('MIGRATION_SYNC_BATCH_ROWS', '1000'))
+SYNC_BATCH_SECONDS = float(os.getenv('MIGRATION_SYNC_BATCH_SECONDS', '1'))
+
+# While no transaction is open the slot is confirmed up to the server's WAL
+# end at most this often, so it keeps up when nothing published changes
+# (Postgres 15+ sends no empty transactions)
+SYNC_IDLE_CONFIRM_SECONDS = 5
+
+# A row of `table` changed: kind is 'insert', 'update' or 'delete', key its key as text
+Change = namedtuple('Change', 'table kind key')
+
+# A transaction committed at `committed_at`; its changes are confirmed up to `lsn`
+Commit = namedtuple('Commit', 'lsn committed_at')
+
+# `tables` were truncated
+Truncate = namedtuple('Truncate', 'tables')
+
+POSTGRES_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+def create_replication(conn, tables, slot=SYNC_SLOT, publication=SYNC_PUBLICATION):
+    """Create the publication of `tables` and the slot, unless they exist;
+    returns True if the slot was created"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_publication WHERE pubname = %s", (publication,))
+        if not cur.fetchone():
+            cur.execute(f"CREATE PUBLICATION {publication} FOR TABLE {', '.join(tables)}")
+        conn.commit()
+        cur.execute("SELECT 1 FROM pg_replication_slots WHERE slot_name = %s", (slot,))
+        if cur.fetchone():
+            return False
+        cur.execute("SELECT pg_create_logical_replication_slot(%s, 'pgoutput')", (slot,))
+    conn.commit()
+    return True
+
+
+def drop_replication(conn, slot=SYNC_SLOT, publication=SYNC_PUBLICATION):
+    """Drop the slot (so the source stops keeping WAL for it) and the publication"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_drop_replication_slot(slot_name) FROM pg_replication_slots WHERE slot_name = %s",
+                    (slot,))
+        cur.execute(f"DROP PUBLICATION IF EXISTS {publication}")
+    conn.commit()
+
+
+class ChangeStream:
+    """Change, Commit and Truncate events of `publication` read from `slot` on `dsn`
+
+    `keys` maps each table to its key column.
+    """
+
+    def __init__(self, dsn, keys, slot=SYNC_SLOT, publication=SYNC_PUBLICATION):
+        self.keys = keys
+        self.conn = psycopg2.connect(dsn, connection_factory=LogicalReplicationConnection)
+        self.cur = self.conn.cursor()
+        self.cur.start_replication(slot_name=slot, decode=False,
+                                   options={'proto_version': '1', 'publication_names': publication})
+        self._relations = {}
+        self.in_transaction = False     # between a Begin and its Commit
+
+    def events(self, timeout):
+        """Yield events as they arrive, and None after `timeout` seconds without any"""
+        while True:
+            message = self.cur.read_message()
+            if message is None:
+                ready, _, _ = select.select([self.cur], [], [], timeout)
+                if not ready:
+                    yield None
+                continue
+            yield from self._decode(message.payload)
+
+    @property
+    def wal_end(self):
+        """Newest WAL position the server has reported (data or keepalive), for measuring lag"""
+        return self.cur.wal_end
+
+    def confirm(self, lsn):
+        """Tell the server every change up to `lsn` is applied, so the slot may release it"""
+        self.cur.send_feedback(write_lsn=lsn, flush_lsn=lsn, reply=True)
+
+    def close(self):
+        self.conn.close()
+
+    def _decode(self, payload):
+        """Events of one pgoutput message (none for the messages not needed here)"""
+        reader = _Reader(payload)
+        kind = reader.byte()
+        if kind == 'B':
+            self.in_transaction = True
+            return []
+        if kind == 'C':
+            self.in_transaction = False
+            reader.skip(9)      # flags, commit LSN
+            lsn = reader.int64()    # end of the transaction
+            return [Commit(lsn, POSTGRES_EPOCH + timedelta(microseconds=reader.int64()))]
+        if kind == 'R':
+            relid = reader.int32()
+            reader.string()
+            table = reader.string()
+            reader.skip(1)
+            columns = []
+            for _ in range(reader.int16()):
+                reader.skip(1)
+                columns.append(reader.string())
+                reader.skip(8)
+            self._relations[relid] = (table, columns.index(self.keys[table]) if table in self.keys else None)
+            return []
+        if kind in 'IUD':
+            table, key_column = self._relations[reader.int32()]
+            if key_column is None:
+                return []
+            # Inserts and updates carry the new row ('N'); deletes the old key ('K') or row ('O').
+            # An update changing the key carries the old one too, which counts as a delete.
+            tuple_kind = reader.byte()
+            key = reader.tuple()[key_column]
+            if kind == 'U' and tuple_kind in 'KO':
+                old_key = key
+                reader.byte()
+                key = reader.tuple()[key_column]
+                if old_key != key:
+                    return [Change(table, 'delete', old_key), Change(table, 'update', key)]
+            return [Change(table, {'I': 'insert', 'U': 'update', 'D': 'delete'}[kind], key)]
+        if kind == 'T':
+            count = reader.int32()
+            reader.skip(1)
+            return [Truncate([self._relations[reader.int32()][0] for _ in range(count)])]
+        return []       # Origin, Type, Message
+
+
+class _Reader:
+    """Reads the fields of one pgoutput message"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def skip(self, size):
+        self.pos += size
+
+    def byte(self):
+        self.pos += 1
+        return chr(self.data[self.pos - 1])
+
+    def int16(self):
+        self.pos += 2
+        return struct.unpack_from('!h', self.data, self.pos - 2)[0]
+
+    def int32(self):
+        self.pos += 4
+        return struct.unpack_from('!I', self.data, self.pos - 4)[0]
+
+    def int64(self):
+        self.pos += 8
+        return struct.unpack_from('!q', self.data, self.pos - 8)[0]
+
+    def string(self):
+        end = self.data.index(b'\0', self.pos)
+        value = self.data[self.pos:end].decode()
+        self.pos = end + 1
+        return value
+
+    def tuple(self):
+        """Column values of a TupleData as text (None for nulls and unchanged TOAST values)"""
+        values = []
+        for _ in range(self.int16()):
+            kind = self.byte()
+            if kind == 't':
+                size = self.int32()
+                values.append(self.data[self.pos:self.pos + size].decode())
+                self.pos += size
+            else:
+                values.append(None)
+        return values
@@ -0,0 +1,161 @@
+"""
+Local snapshots of extracted source rows.
+
+Extracting writes the rows of every mapped source query (the output of
+CompiledMapping.query, before the transformer) to a directory once; loading
+then replays them into the target instead of reading the source, so a load
+can be rehearsed any number of times at local-disk speed without touching
+the source database.
+
+A snapshot holds one directory per table of chunk files of up to
+MIGRATION_SNAPSHOT_CHUNK_ROWS rows, in source key order. Chunks are
+columnar: each column's values are pickled and zlib-compressed on their
+own, one after another. manifest.json records the source schema the
+mappings were compiled against, and per chunk its row count, first and last
+source key and the offset of every column. Chunks are read through mmap,
+each column decompressed straight from the mapped pages, and chunks outside
+a reader's key range are never opened.
+
+Snapshots are pickles: only load snapshots you made yourself.
+"""
+
+import json
+import mmap
+import os
+import pickle
+import zlib
+from datetime import datetime, timezone
+from uuid import UUID
+
+from migration.streaming import batched
+
+# Rows per chunk file
+SNAPSHOT_CHUNK_ROWS = int(os.getenv('MIGRATION_SNAPSHOT_CHUNK_ROWS', '50000'))
+
+# zlib level of the column data (1 = fastest, 9 = smallest)
+SNAPSHOT_COMPRESSION = int(os.getenv('MIGRATION_SNAPSHOT_COMPRESSION', '6'))
+
+VERSION = 1
+
+# Column holding each row's source key (see CompiledMapping.query(keyed=True))
+KEY = '_key'
+
+
+class SnapshotWriter:
+    """Writes a snapshot to directory `path`; close() writes the manifest"""
+
+    def __init__(self, path, chunk_rows=SNAPSHOT_CHUNK_ROWS, level=SNAPSHOT_COMPRESSION):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.level = level
+        self.bytes = 0
+        self.manifest = {
+            'version': VERSION,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'tables': {},
+        }
+
+    def write_table(self, table, types, rows):
+        """Write `rows` (dicts with a KEY column, in key order) as `table`, whose
+        source columns are `types`; returns the number of rows written"""
+        os.makedirs(os.path.join(self.path, table), exist_ok=True)
+        entry = {'types': types, 'rows': 0, 'chunks': []}
+        for number, chunk in enumerate(batched(rows, self.chunk_rows)):
+            name = os.path.join(table, f"{number:06d}.chunk")
+            columns = {}
+            offset = 0
+            with open(os.path.join(self.path, name), 'wb') as f:
+                for column in chunk[0]:
+                    data = zlib.compress(pickle.dumps([row[column] for row in chunk], pickle.HIGHEST_PROTOCOL),
+                                         self.level)
+                    f.write(data)
+                    columns[column] = [offset, len(data)]
+                    offset += len(data)
+            entry['chunks'].append({
+                'file': name, 'rows': len(chunk), 'columns': columns,
+                'first_key': str(chunk[0][KEY]), 'last_key': str(chunk[-1][KEY]),
+            })
+            entry['rows'] += len(chunk)
+            self.bytes += offset
+        self.manifest['tables'][table] = entry
+        return entry['rows']
+
+    def close(self):
+        # Written last and renamed into place: a snapshot without a manifest is incomplete
+        os.makedirs(self.path, exist_ok=True)
+        target = os.path.join(self.path, 'manifest.json')
+        with open(target + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(target + '.tmp', target)
+
+
+class Snapshot:
+    """A snapshot written by SnapshotWriter, read from directory `path`"""
+
+    def __init__(self, path):
+        self.path = path
+        manifest = os.path.join(path, 'manifest.json')
+        if not os.path.exists(manifest):
+            raise ValueError(f"No snapshot in {path} (manifest.json missing)")
+        with open(manifest) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != VERSION:
+            raise ValueError(f"Snapshot {path} has unsupported version {self.manifest.get('version')}")
+        # Names this snapshot wherever a source database's dsn would (e.g. compiled mapping caches)
+        self.name = f"snapshot:{os.path.abspath(path)}"
+
+    def types(self, table):
+        """{column: data_type} of source table `table` when it was extracted"""
+        if table not in self.manifest['tables']:
+            raise ValueError(f"Table {table} is not in snapshot {self.path}")
+        return self.manifest['tables'][table]['types']
+
+    def count(self, table, key_range=None, after=None):
+        """Rows of the chunks of `table` overlapping `key_range` after key `after`"""
+        return sum(chunk['rows'] for chunk in self._chunks(table, key_range, after))
+
+    def rows(self, table, key_range=None, after=None):
+        """Yield the rows of `table` (without their KEY) in key order, with keys in
+        `key_range` ((lo, hi), either None) and after `after`"""
+        lo, hi = _bounds(key_range, after)
+        for chunk in self._chunks(table, key_range, after):
+            first, last = UUID(chunk['first_key']), UUID(chunk['last_key'])
+            # Only chunks straddling a boundary need a look at every key
+            inside = (lo is None or first > lo) and (hi is None or last < hi)
+            columns = self._read(chunk)
+            keys = columns.pop(KEY)
+            names = list(columns)
+            for key, values in zip(keys, zip(*columns.values())):
+                if not inside:
+                    key = UUID(str(key))
+                    if (lo is not None and key <= lo) or (hi is not None and key >= hi):
+                        continue
+                yield dict(zip(names, values))
+
+    def _chunks(self, table, key_range, after):
+        lo, hi = _bounds(key_range, after)
+        if table not in self.manifest['tables']:
+            raise ValueError(f"Table {table} is not in snapshot {self.path}")
+        for chunk in self.manifest['tables'][table]['chunks']:
+            first, last = UUID(chunk['first_key']), UUID(chunk['last_key'])
+            if (lo is not None and last <= lo) or (hi is not None and first >= hi):
+                continue
+            yield chunk
+
+    def _read(self, chunk):
+        """{column: values} of a chunk, decompressed from its memory-mapped file"""
+        with open(os.path.join(self.path, chunk['file']), 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            return {column: pickle.loads(zlib.decompress(view[offset:offset + length]))
+                    for column, (offset, length) in chunk['columns'].items()}
+
+
+def _bounds(key_range, after):
+    """(exclusive lower, exclusive upper) key bound of `key_range` after key `after`
+    (either None when unbounded)"""
+    lo, hi = key_range or (None, None)
+    # Keys are UUIDs: the one before lo is lo - 1
+    lower = UUID(int=UUID(lo).int - 1) if lo and UUID(lo).int else None
+    if after and (lower is None or UUID(after) > lower):
+        lower = UUID(after)
+    return lower, UUID(hi) if hi else None
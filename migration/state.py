@@ -0,0 +1,225 @@
+"""
+Persistent migration state kept between runs.
+
+State lives in a local directory (MIGRATION_STATE_DIR, default
+.migration_state), one subdirectory per script and set of connection URLs,
+so state recorded against one database is never applied to another.
+
+Watermarks are the newest change time (updated_at, else created_at) seen per
+source table. An incremental run only reads rows changed since the previous
+watermark, minus a small overlap for transactions that committed late.
+Watermarks only move forward when save() is called after a successful run,
+so a failed run is simply redone from the old mark next time.
+
+While a run is in progress it also keeps a checkpoint: the source tables
+(per key-range chunk) it has finished, the last source key committed for
+each, and the ID-map entries written so far, appended to small journal
+files. A run started with resume=True picks up from that checkpoint instead
+of starting over; a successful save() clears it.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from uuid import UUID
+
+from migration.idmap import IdMap
+
+STATE_DIR = os.getenv('MIGRATION_STATE_DIR', '.migration_state')
+
+# Rows committed this long after their updated_at are still picked up
+WATERMARK_OVERLAP = timedelta(seconds=int(os.getenv('MIGRATION_WATERMARK_OVERLAP_SECONDS', '300')))
+
+
+class MigrationState:
+    """Watermarks, saved ID maps and the in-progress checkpoint for one
+    migration script and set of databases"""
+
+    def __init__(self, path=None, resume=False):
+        self.path = path
+        self.resumed = False
+        self._lock = threading.Lock()
+        self.watermarks = {}
+        self._observed = {}
+        self.completed = set()
+        self.positions = {}
+
+        if path and os.path.exists(os.path.join(path, 'state.json')):
+            with open(os.path.join(path, 'state.json')) as f:
+                data = json.load(f)
+            self.watermarks = {
+                key: datetime.fromisoformat(value)
+                for key, value in data.get('watermarks', {}).items()
+            }
+
+        if resume and path and os.path.exists(os.path.join(path, 'checkpoint.json')):
+            with open(os.path.join(path, 'checkpoint.json')) as f:
+                data = json.load(f)
+            self.completed = set(data['completed'])
+            self.positions = data['positions']
+            self._observed = {
+                key: datetime.fromisoformat(value)
+                for key, value in data['observed'].items()
+            }
+            self.resumed = True
+        elif path:
+            # A fresh run must not inherit journal entries from an abandoned one
+            self._clear_checkpoint()
+
+    @classmethod
+    def for_run(cls, name, *urls, resume=False):
+        """State directory for script `name` migrating between `urls`"""
+        return cls(cls.run_path(name, *urls), resume=resume)
+
+    @staticmethod
+    def run_path(name, *urls):
+        """Path in STATE_DIR for `name` and the databases `urls`"""
+        fingerprint = hashlib.sha256('\n'.join(u or '' for u in urls).encode()).hexdigest()[:12]
+        return os.path.join(STATE_DIR, f"{name}-{fingerprint}")
+
+    def since(self, source, table):
+        """Change time from which an incremental run must re-read `table` (None = everything)"""
+        mark = self.watermarks.get(f"{source}.{table}")
+        return mark - WATERMARK_OVERLAP if mark else None
+
+    def observe(self, source, table, changed_at):
+        """Record that a row of `table` changed at `changed_at`"""
+        if changed_at is None:
+            return
+        key = f"{source}.{table}"
+        with self._lock:
+            if key not in self._observed or changed_at > self._observed[key]:
+                self._observed[key] = changed_at
+
+    def track(self, source, table, rows):
+        """Pass `rows` through, observing each row's updated_at/created_at"""
+        for row in rows:
+            self.observe(source, table, row.get('updated_at') or row.get('created_at'))
+            yield row
+
+    def save(self, id_maps=None):
+        """Advance watermarks to everything observed and write the state directory
+
+        `id_maps` ({name: IdMap}) are written alongside so that a later
+        incremental run can resolve references to unchanged rows.
+        """
+        with self._lock:
+            for key, value in self._observed.items():
+                if key not in self.watermarks or value > self.watermarks[key]:
+                    self.watermarks[key] = value
+            self._observed = {}
+            self.completed = set()
+            self.positions = {}
+
+        if not self.path:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        self._write_json('state.json', {
+            'watermarks': {key: value.isoformat() for key, value in self.watermarks.items()},
+        })
+        for name, id_map in (id_maps or {}).items():
+            id_map.save(os.path.join(self.path, f"{name}.idmap"))
+            if os.path.exists(os.path.join(self.path, f"{name}.json")):
+                os.remove(os.path.join(self.path, f"{name}.json"))    # written by older versions
+        self._clear_checkpoint()
+
+    def load_id_map(self, name):
+        """IdMap saved by a previous run, plus entries journaled by an
+        interrupted run being resumed (empty if none)"""
+        id_map = IdMap()
+        if self.path and os.path.exists(os.path.join(self.path, f"{name}.idmap")):
+            id_map = IdMap.load(os.path.join(self.path, f"{name}.idmap"))
+        elif self.path and os.path.exists(os.path.join(self.path, f"{name}.json")):
+            with open(os.path.join(self.path, f"{name}.json")) as f:
+                id_map.update(json.load(f))
+        self._read_journal(name, id_map)
+        return id_map
+
+    def journaled(self, name):
+        """IdMap of the entries of ID map `name` journaled by an interrupted
+        run being resumed (empty if none), i.e. the rows it already wrote"""
+        return self._read_journal(name, IdMap())
+
+    def _read_journal(self, name, id_map):
+        if self.resumed and os.path.exists(os.path.join(self.path, f"{name}.journal")):
+            with open(os.path.join(self.path, f"{name}.journal")) as f:
+                for line in f:
+                    if line.endswith('\n'):     # a torn last line was never checkpointed
+                        old_id, new_id = line[:-1].split('\t')
+                        id_map[old_id] = new_id
+        return id_map
+
+    def is_complete(self, name):
+        """True if a resumed run already finished `name`"""
+        return name in self.completed
+
+    def position(self, name):
+        """Last source key committed for `name` (None to start from the beginning)"""
+        return self.positions.get(name)
+
+    def checkpoint(self, name, last_key, id_maps=None):
+        """Record that every source row of `name` up to `last_key` is committed
+
+        `id_maps` ({name: [(old_id, new_id), ...]}) are the ID-map entries
+        written by the committed batch.
+        """
+        with self._lock:
+            self.positions[name] = str(last_key)
+            if not self.path:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            for map_name, entries in (id_maps or {}).items():
+                with open(os.path.join(self.path, f"{map_name}.journal"), 'a') as f:
+                    f.writelines(f"{old_id}\t{new_id}\n" for old_id, new_id in entries)
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._write_checkpoint()
+
+    def complete(self, name):
+        """Record that every source row of `name` is committed"""
+        with self._lock:
+            self.completed.add(name)
+            self.positions.pop(name, None)
+            if self.path:
+                os.makedirs(self.path, exist_ok=True)
+                self._write_checkpoint()
+
+    def _write_checkpoint(self):
+        self._write_json('checkpoint.json', {
+            'completed': sorted(self.completed),
+            'positions': self.positions,
+            'observed': {key: value.isoformat() for key, value in self._observed.items()},
+        })
+
+    def _clear_checkpoint(self):
+        if not os.path.isdir(self.path):
+            return
+        for filename in os.listdir(self.path):
+            if filename == 'checkpoint.json' or filename.endswith('.journal'):
+                os.remove(os.path.join(self.path, filename))
+
+    def _write_json(self, filename, data):
+        # Write aside and rename so a crash never leaves a truncated file
+        target = os.path.join(self.path, filename)
+        with open(target + '.tmp', 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(target + '.tmp', target)
+
+
+def changed_since_condition(since, column="COALESCE(updated_at, created_at)"):
+    """SQL condition selecting rows changed at or after `since` (None when `since` is None)"""
+    if since is None:
+        return None
+    return f"{column} >= '{since.isoformat()}'::timestamptz"
+
+
+def after_key_condition(key, column='id'):
+    """SQL condition selecting rows whose `column` sorts after `key` (None when `key` is None)"""
+    if key is None:
+        return None
+    return f"{column} > '{UUID(key)}'::uuid"
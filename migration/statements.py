@@ -0,0 +1,71 @@
+"""
+Server-side prepared statements for row-by-row writes.
+
+Row-by-row upserts used to build their SQL per row, leaving out the columns
+that happened to be null, so the server parsed and planned every statement
+afresh. Here each statement shape (table, operation and column list) is
+PREPAREd once per connection and rows only send EXECUTE with their values.
+
+psycopg2 has no libpq pipeline mode. The nearest equivalent is to send the
+EXECUTEs of several rows as one multi-statement query: RowTransaction.write_all
+does so, MIGRATION_ROWS_PER_ROUND_TRIP rows at a time, which takes network
+latency off the critical path much like a pipeline would.
+"""
+
+import os
+import threading
+import weakref
+
+# Row statements sent to the target in one round trip
+ROWS_PER_ROUND_TRIP = int(os.getenv('MIGRATION_ROWS_PER_ROUND_TRIP', '100'))
+
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def prepared_statements(conn):
+    """The PreparedStatements of `conn`"""
+    with _caches_lock:
+        cache = _caches.get(conn)
+        if cache is None:
+            cache = _caches[conn] = PreparedStatements()
+        return cache
+
+
+class PreparedStatements:
+    """Statements prepared on one connection, by shape
+
+    A shape is any hashable key naming a statement, e.g.
+    ('profiles', 'insert', columns); `build()` returns its text with $1, $2, ...
+    placeholders and is only called the first time the shape is used.
+    """
+
+    def __init__(self):
+        self.names = {}
+
+    def _prepare(self, cur, shape, build):
+        name = self.names.get(shape)
+        if name is None:
+            # A separate round trip, once per shape: prepared statements outlive
+            # rollbacks, but a PREPARE sent behind a failing statement never runs
+            name = f"migration_stmt_{len(self.names) + 1}"
+            cur.execute(f"PREPARE {name} AS {build()}")
+            self.names[shape] = name
+        return name
+
+    def bind(self, cur, shape, build, params):
+        """The EXECUTE statement of `shape` with `params` bound, as text"""
+        name = self._prepare(cur, shape, build)
+        placeholders = ', '.join(['%s'] * len(params))
+        return cur.mogrify(f"EXECUTE {name} ({placeholders})", params).decode()
+
+    def execute(self, cur, shape, build, params):
+        """Execute `shape` with `params` on `cur`"""
+        name = self._prepare(cur, shape, build)
+        placeholders = ', '.join(['%s'] * len(params))
+        cur.execute(f"EXECUTE {name} ({placeholders})", params)
+
+
+def placeholders(count, start=1):
+    """'$1, $2, ...' for `count` parameters"""
+    return ', '.join(f"${i}" for i in range(start, start + count))
@@ -0,0 +1,38 @@
+"""
+Streaming extraction from source databases.
+
+Source tables are read through server-side (named) cursors, so only
+`itersize` rows are held client-side at a time and the writer can start on
+the first batch while the rest of the table is still on the server.
+"""
+
+from itertools import count, islice
+
+from psycopg2.extras import RealDictCursor
+
+_cursor_ids = count(1)
+
+
+def stream_rows(conn, query, params=None, itersize=2000):
+    """Yield rows of `query` as dicts from a server-side cursor"""
+    name = f"migration_stream_{next(_cursor_ids)}"
+    with conn.cursor(name=name, cursor_factory=RealDictCursor) as cur:
+        cur.itersize = itersize
+        cur.execute(query, params)
+        yield from cur
+
+
+def batched(iterable, size):
+    """Yield lists of up to `size` items from `iterable`"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def where_clause(*conditions):
+    """Join the non-empty SQL `conditions` into a WHERE clause ('' if there are none)"""
+    conditions = [c for c in conditions if c]
+    return 'WHERE ' + ' AND '.join(conditions) if conditions else ''
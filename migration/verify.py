@@ -0,0 +1,265 @@
+"""
+Chunked checksum verification of migrated tables.
+
+Each target table is split into key ranges. For every range the source and
+target servers each return a row count and the sum of 64-bit row hashes
+(md5 of the row's columns, cast to the target column types), so no row data
+crosses the wire. Sums add up across sources, which lets a target table be
+checked against every source table feeding it. Ranges whose totals differ
+are split again until they hold at most MIGRATION_VERIFY_ROWS rows, and
+those are compared row by row (ids and hashes only) to name the missing,
+extra and changed rows. Ranges are checked in parallel, each thread on its
+own connections.
+
+Only columns the source query computes are compared: ID remaps and Python
+functions run in the migrator, so those columns are left out. So are the
+columns an upsert leaves alone on rows the target already had (those not in
+TableMapping.update, e.g. created_at): they keep the target's values.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import psycopg2
+
+from migration.scheduler import key_ranges, key_range_condition
+from migration.streaming import where_clause
+
+# Key ranges a table is first split into, and how many rows a differing range
+# may hold before it is split again rather than compared row by row
+VERIFY_RANGES = int(os.getenv('MIGRATION_VERIFY_RANGES', '64'))
+VERIFY_ROWS = int(os.getenv('MIGRATION_VERIFY_ROWS', '5000'))
+
+# Ranges checked at once (each on its own source and target connections)
+VERIFY_WORKERS = int(os.getenv('MIGRATION_VERIFY_WORKERS', '4'))
+
+VERIFY_LOG = os.getenv('MIGRATION_VERIFY_LOG', 'migration_verify.jsonl')
+
+# Parts a differing range is split into
+SPLIT = 16
+
+# Settings that change the text form of values, made equal on both sides
+SESSION = "SET TimeZone = 'UTC'; SET DateStyle = 'ISO, MDY'; SET IntervalStyle = 'postgres'; " \
+          "SET extra_float_digits = 1"
+
+
+class Check:
+    """Target table `target` verified against `sources`, the (database name,
+    TableMapping) pairs feeding it. `key` is the unified key column;
+    `exclude` names columns not to compare (e.g. ids remapped on the target)."""
+
+    def __init__(self, target, sources, key='id', exclude=()):
+        self.target = target
+        self.sources = sources
+        self.key = key
+        self.exclude = set(exclude)
+
+
+class _Side:
+    """Queries hashing the rows of one table, on database `db`"""
+
+    def __init__(self, db, table, key, columns):
+        self.db = db
+        self.table = table
+        self.key = key
+        self.row_hash = f"('x' || left(md5(ROW({', '.join(columns)})::text), 16))::bit(64)::bigint"
+
+    def where(self, key_range):
+        return where_clause(key_range_condition(key_range, self.key))
+
+    def totals(self, cur, key_range):
+        cur.execute(f"SELECT count(*), COALESCE(sum({self.row_hash}), 0) FROM {self.table} "
+                    f"{self.where(key_range)}")
+        return cur.fetchone()
+
+    def rows(self, cur, key_range):
+        cur.execute(f"SELECT ({self.key})::text, {self.row_hash} FROM {self.table} {self.where(key_range)}")
+        return cur.fetchall()
+
+
+class Verifier:
+    """Runs Checks against the databases named in `urls`; `target` names the
+    unified one. Mismatched ids are written to `log` (JSON lines)."""
+
+    def __init__(self, urls, target, workers=VERIFY_WORKERS, ranges=VERIFY_RANGES, rows=VERIFY_ROWS,
+                 log=VERIFY_LOG):
+        self.urls = urls
+        self.target = target
+        self.workers = workers
+        self.ranges = ranges
+        self.rows = rows
+        self.log = log
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+
+    def _cursor(self, db):
+        """Cursor on this thread's connection to `db`"""
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+        if db not in conns:
+            conn = psycopg2.connect(self.urls[db])
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(SESSION)
+            conns[db] = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conns[db].cursor()
+
+    def close(self):
+        for conn in self._conns:
+            conn.close()
+        self._conns = []
+
+    def run(self, checks):
+        """Verify every check; returns a result dict per check"""
+        if self.log:
+            open(self.log, 'w').close()
+        results = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='verify') as pool:
+                for check in checks:
+                    result = self._verify(check, pool)
+                    self._report(result)
+                    results.append(result)
+        finally:
+            self.close()
+        return results
+
+    def _sides(self, check):
+        """(source sides, target side) of `check`, hashing the same columns cast to the target's types"""
+        with self._cursor(self.target) as cur:
+            types = target_types(cur, check.target)
+        columns = [c for c in types if c not in check.exclude]
+        compiled = []
+        for db, mapping in check.sources:
+            with self._cursor(db) as cur:
+                compiled.append((db, mapping.compile(cur.connection)))
+            checked = _checked_columns(mapping)
+            columns = [c for c in columns if c in checked]
+        if check.key not in columns:
+            raise ValueError(f"{check.target}: key column {check.key} is not compared")
+
+        sources = [_Side(db, c.mapping.source, c.expressions[check.key],
+                         [f"({c.expressions[name]})::{types[name]}" for name in columns])
+                   for db, c in compiled]
+        target = _Side(self.target, check.target, check.key,
+                       [f"{name}::{types[name]}" for name in columns])
+        return sources, target, columns
+
+    def _totals(self, sides, key_range):
+        """(count, hash sum) of `key_range` over `sides`"""
+        count = total = 0
+        for side in sides:
+            with self._cursor(side.db) as cur:
+                rows, hashes = side.totals(cur, key_range)
+            count += rows
+            total += hashes
+        return count, total
+
+    def _compare(self, sources, target, key_range):
+        """Range totals of the sources and of the target"""
+        return self._totals(sources, key_range), self._totals([target], key_range)
+
+    def _diff(self, sources, target, key_range):
+        """(missing, extra, changed) ids of `key_range`, compared row by row"""
+        expected = {}
+        for side in sources:
+            with self._cursor(side.db) as cur:
+                expected.update(side.rows(cur, key_range))
+        with self._cursor(target.db) as cur:
+            found = dict(target.rows(cur, key_range))
+        missing = [key for key in expected if key not in found]
+        extra = [key for key in found if key not in expected]
+        changed = [key for key, row_hash in expected.items() if key in found and found[key] != row_hash]
+        return missing, extra, changed
+
+    def _verify(self, check, pool):
+        sources, target, columns = self._sides(check)
+        result = {
+            'table': check.target, 'columns': columns, 'source_rows': 0, 'target_rows': 0,
+            'ranges': 0, 'differing_ranges': 0, 'missing': [], 'extra': [], 'changed': [],
+        }
+        print(f"\n🔍 Verifying {check.target} ({len(columns)} columns)...")
+
+        pending = key_ranges(self.ranges)
+        top = True
+        while pending:
+            compare = []
+            split = []
+            totals = pool.map(lambda key_range: self._compare(sources, target, key_range), pending)
+            for key_range, (source, found) in zip(pending, totals):
+                result['ranges'] += 1
+                if top:
+                    result['source_rows'] += source[0]
+                    result['target_rows'] += found[0]
+                if source == found:
+                    continue
+                result['differing_ranges'] += 1
+                parts = key_ranges(SPLIT, key_range)
+                if max(source[0], found[0]) <= self.rows or len(parts) == 1:
+                    compare.append(key_range)
+                else:
+                    split.extend(parts)
+
+            for missing, extra, changed in pool.map(
+                    lambda key_range: self._diff(sources, target, key_range), compare):
+                result['missing'] += missing
+                result['extra'] += extra
+                result['changed'] += changed
+            pending = split
+            top = False
+        return result
+
+    def _report(self, result):
+        table = result['table']
+        problems = [(problem, result[problem]) for problem in ('missing', 'extra', 'changed') if result[problem]]
+        if self.log and problems:
+            at = datetime.now(timezone.utc).isoformat()
+            with open(self.log, 'a') as f:
+                for problem, keys in problems:
+                    for key in keys:
+                        f.write(json.dumps({'at': at, 'table': table, 'key': key, 'problem': problem}) + '\n')
+
+        print(f"   {result['source_rows']} source rows, {result['target_rows']} target rows, "
+              f"{result['ranges']} ranges hashed ({result['differing_ranges']} differing)")
+        if not problems:
+            print(f"✅ {table} matches")
+            return
+        for problem, keys in problems:
+            shown = ', '.join(keys[:5]) + (', ...' if len(keys) > 5 else '')
+            print(f"   ❌ {len(keys)} {problem}: {shown}")
+        print(f"❌ {table} differs" + (f" (ids in {self.log})" if self.log else ""))
+
+
+def target_types(cur, table):
+    """{column: type to compare it as} of `table`; types defined in the database
+    (enums, domains) are compared as text, as the source may not have them"""
+    cur.execute("""
+        SELECT a.attname,
+               CASE WHEN t.typnamespace = 'pg_catalog'::regnamespace
+                    THEN format_type(a.atttypid, a.atttypmod) ELSE 'text' END
+        FROM pg_attribute a
+        JOIN pg_type t ON t.oid = a.atttypid
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum
+    """, (table,))
+    return dict(cur.fetchall())
+
+
+def _checked_columns(mapping):
+    """Columns of `mapping` computed entirely by its source query and written
+    over existing rows (its key and update columns)"""
+    written = {mapping.conflict, *mapping.update}
+    return {column.name for column in mapping.columns
+            if column.name in written and not (column.remap or column.apply or column.fallback)}
+
+
+def verified(results):
+    """Whether every verified table matched"""
+    return not any(result['missing'] or result['extra'] or result['changed'] for result in results)
@@ -0,0 +1,79 @@
+import uuid
+
+from migration.idmap import IdMap
+
+
+def ids(count):
+    return [str(uuid.uuid4()) for _ in range(count)]
+
+
+def test_identity_and_mapped_entries():
+    a, b, c = ids(3)
+    id_map = IdMap({a: a, b: c})
+    assert len(id_map) == 2
+    assert id_map[a] == a and id_map[b] == c
+    assert c not in id_map
+    assert id_map.get(c) is None
+    assert dict(id_map.items()) == {a: a, b: c}
+
+
+def test_overwrites_count_each_key_once():
+    a, b, c = ids(3)
+    id_map = IdMap()
+    id_map[a] = a
+    id_map[a] = b           # identity, then mapped
+    assert len(id_map) == 1 and id_map[a] == b
+    id_map[a] = c
+    assert len(id_map) == 1 and id_map[a] == c
+    id_map[a] = a           # back to identity: the mapped entry still wins
+    assert len(id_map) == 1 and id_map[a] == a
+
+
+def test_non_uuid_then_uuid_overwrite():
+    a, b = ids(2)
+    id_map = IdMap()
+    id_map[a] = 'legacy-7'
+    assert len(id_map) == 1 and id_map[a] == 'legacy-7'
+    id_map[a] = b
+    assert len(id_map) == 1 and id_map[a] == b
+    assert dict(id_map.items()) == {a: b}
+
+
+def test_uuid_then_non_uuid_overwrite():
+    a, b, c = ids(3)
+    id_map = IdMap({a: b})
+    id_map[a] = 'legacy-7'
+    assert len(id_map) == 1 and id_map[a] == 'legacy-7'
+    id_map[a] = c
+    assert len(id_map) == 1 and id_map[a] == c
+    id_map['legacy-8'] = a
+    assert len(id_map) == 2
+    assert dict(id_map.items()) == {a: c, 'legacy-8': a}
+
+
+def test_grows_past_its_capacity():
+    old, new = ids(3000), ids(3000)
+    id_map = IdMap(capacity=8)
+    id_map.update(zip(old, new))
+    id_map.update((old_id, old_id) for old_id in ids(2000))
+    assert len(id_map) == 5000
+    assert all(id_map[old_id] == new_id for old_id, new_id in zip(old, new))
+
+
+def test_save_and_load(tmp_path):
+    a, b, c, d = ids(4)
+    id_map = IdMap({a: a, b: c, 'legacy-7': d})
+    id_map[c] = c
+    id_map[c] = 'legacy-8'
+    path = str(tmp_path / 'ids.idmap')
+    id_map.save(path)
+
+    loaded = IdMap.load(path)
+    assert len(loaded) == len(id_map) == 4
+    assert dict(loaded.items()) == dict(id_map.items())
+
+    # Copy-on-write: changes to the loaded map never reach the file
+    loaded[d] = a
+    loaded[c] = b
+    assert len(loaded) == 5 and loaded[c] == b
+    assert len(IdMap.load(path)) == 4
@@ -0,0 +1,33 @@
+from migrate_between_projects import SERVICES
+from migrate_data import HUB_SERVICES
+from migration.mapping import TableMapping, Column, Sql
+
+SERVICE_TYPES = {'id': 'uuid', 'title': 'text', 'status': 'text', 'created_at': 'timestamp with time zone'}
+
+
+def test_sql_sources_need_all_their_columns():
+    mapping = TableMapping('t', [
+        Column('full_name', 'full_name', Sql("CONCAT(first_name, ' ', last_name)", 'first_name', 'last_name'),
+               Sql("split_part(email, '@', 1)", 'email')),
+    ])
+    compiled = mapping.compile_types('test', {'first_name': 'text', 'email': 'text'})
+    assert compiled.expressions['full_name'] == "split_part(email, '@', 1)"
+
+
+def test_service_status_without_approval_status():
+    status = SERVICES.compile_types('no-approval', SERVICE_TYPES).expressions['status']
+    assert 'approval_status' not in status
+    assert "WHEN status = 'draft' THEN 'draft'" in status
+    assert "THEN 'inactive'" in status and "THEN 'pending'" in status
+
+    status = HUB_SERVICES.compile_types('no-approval', SERVICE_TYPES).expressions['status']
+    assert 'approval_status' not in status
+    assert "THEN 'pending'" in status
+
+
+def test_service_status_with_approval_status():
+    types = dict(SERVICE_TYPES, approval_status='text')
+    for mapping in (SERVICES, HUB_SERVICES):
+        status = mapping.compile_types('approval', types).expressions['status']
+        # The full CASE comes first and never yields null, so it decides
+        assert status.startswith('COALESCE(CASE') and 'approval_status' in status.split('END')[0]
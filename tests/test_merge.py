@@ -0,0 +1,59 @@
+import random
+from datetime import datetime, timedelta
+
+from migration.merge import MergeSet
+
+
+def rows(count, seed):
+    """Profiles-like rows sharing emails and phones, some of them null"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    for n in range(count):
+        yield [f"old-{seed}-{n}"], {
+            'id': f"id-{seed}-{n}",
+            'email': f"user{rng.randrange(count // 3)}@example.com" if rng.random() < 0.9 else None,
+            'phone': f"+968{rng.randrange(count // 4)}" if rng.random() < 0.5 else None,
+            'full_name': rng.choice(['Amal', 'Badr', None]),
+            'updated_at': start + timedelta(days=rng.randrange(365)),
+        }
+
+
+def merged(max_rows, directory):
+    merge_set = MergeSet(('email', 'phone'), protected=('id', 'email', 'phone'),
+                         greatest=('updated_at',), max_rows=max_rows, directory=directory)
+    other = MergeSet(('email', 'phone'), protected=('id', 'email', 'phone'),
+                     greatest=('updated_at',), max_rows=max_rows, directory=directory)
+    for old_ids, row in rows(600, 1):
+        merge_set.add(old_ids, row)
+    for old_ids, row in rows(400, 2):
+        other.add(old_ids, row)
+    merge_set.update(other)
+    result = list(merge_set)
+    spilled = merge_set.spilled
+    assert merge_set.rows == 1000 and len(merge_set) == len(result)
+    merge_set.close()
+    other.close()
+    return result, spilled
+
+
+def test_merge_rules():
+    merge_set = MergeSet(('email', 'phone'), protected=('id', 'email', 'phone'), greatest=('updated_at',))
+    merge_set.add(['a'], {'id': 1, 'email': 'x@example.com', 'phone': None, 'name': 'A', 'updated_at': 5})
+    merge_set.add(['b'], {'id': 2, 'email': None, 'phone': '99', 'name': 'B', 'updated_at': 1})
+    merge_set.add(['c'], {'id': 3, 'email': 'x@example.com', 'phone': '99', 'name': None, 'updated_at': 3})
+    merge_set.add(['d'], {'id': 4, 'email': 'y@example.com', 'phone': '99', 'name': 'D', 'updated_at': 9})
+    # c joins a by email (tried first), d joins b by phone: ids and match keys are the first row's
+    assert list(merge_set) == [
+        (['a', 'c'], {'id': 1, 'email': 'x@example.com', 'phone': None, 'name': 'A', 'updated_at': 5}),
+        (['b', 'd'], {'id': 2, 'email': None, 'phone': '99', 'name': 'D', 'updated_at': 9}),
+    ]
+    assert len(merge_set) == 2 and merge_set.rows == 4
+
+
+def test_spilled_merge_matches_in_memory(tmp_path):
+    in_memory, spilled = merged(10 ** 6, str(tmp_path))
+    assert not spilled
+    on_disk, spilled = merged(50, str(tmp_path))
+    assert spilled
+    assert on_disk == in_memory
+    assert list(tmp_path.iterdir()) == []       # close() removed the spill file
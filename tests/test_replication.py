@@ -0,0 +1,90 @@
+import struct
+from datetime import timedelta
+
+from migration.replication import ChangeStream, Change, Commit, Truncate, POSTGRES_EPOCH
+
+
+def string(value):
+    return value.encode() + b'\0'
+
+
+def tuple_data(*values):
+    data = struct.pack('!h', len(values))
+    for value in values:
+        if value is None:
+            data += b'n'
+        elif value is ...:
+            data += b'u'        # unchanged TOAST value
+        else:
+            data += b't' + struct.pack('!I', len(value.encode())) + value.encode()
+    return data
+
+
+def relation(relid, table, columns):
+    data = b'R' + struct.pack('!I', relid) + string('public') + string(table) + b'd'
+    data += struct.pack('!h', len(columns))
+    for column in columns:
+        data += b'\1' + string(column) + struct.pack('!Ii', 25, -1)
+    return data
+
+
+def begin(lsn):
+    return b'B' + struct.pack('!qqI', lsn, 0, 1)
+
+
+def commit(lsn, end_lsn, microseconds):
+    return b'C' + struct.pack('!bqqq', 0, lsn, end_lsn, microseconds)
+
+
+def stream():
+    """A ChangeStream that decodes messages without a connection"""
+    change_stream = ChangeStream.__new__(ChangeStream)
+    change_stream.keys = {'profiles': 'id', 'bookings': 'id'}
+    change_stream._relations = {}
+    change_stream.in_transaction = False
+    return change_stream
+
+
+def decode(change_stream, *messages):
+    return [event for message in messages for event in change_stream._decode(message)]
+
+
+def test_changes_and_commit():
+    change_stream = stream()
+    events = decode(
+        change_stream,
+        begin(100),
+        relation(16400, 'profiles', ['email', 'id', 'full_name']),
+        b'I' + struct.pack('!I', 16400) + b'N' + tuple_data('a@example.com', 'p1', None),
+        b'U' + struct.pack('!I', 16400) + b'N' + tuple_data('b@example.com', 'p2', ...),
+        b'D' + struct.pack('!I', 16400) + b'K' + tuple_data(None, 'p3', None),
+    )
+    assert change_stream.in_transaction
+    events += decode(change_stream, commit(100, 164, 86_400_000_000))
+    assert not change_stream.in_transaction
+    assert events == [
+        Change('profiles', 'insert', 'p1'),
+        Change('profiles', 'update', 'p2'),
+        Change('profiles', 'delete', 'p3'),
+        Commit(164, POSTGRES_EPOCH + timedelta(days=1)),
+    ]
+
+
+def test_update_of_the_key_is_a_delete_and_an_update():
+    change_stream = stream()
+    decode(change_stream, relation(16401, 'bookings', ['id', 'status']))
+    moved = b'U' + struct.pack('!I', 16401) + b'K' + tuple_data('b1', None) + b'N' + tuple_data('b2', 'done')
+    kept = b'U' + struct.pack('!I', 16401) + b'O' + tuple_data('b3', 'new') + b'N' + tuple_data('b3', 'done')
+    assert decode(change_stream, moved, kept) == [
+        Change('bookings', 'delete', 'b1'), Change('bookings', 'update', 'b2'),
+        Change('bookings', 'update', 'b3'),
+    ]
+
+
+def test_unmapped_tables_and_truncate():
+    change_stream = stream()
+    decode(change_stream, relation(16400, 'profiles', ['id']), relation(16402, 'audit_log', ['id', 'event']))
+    assert decode(change_stream, b'I' + struct.pack('!I', 16402) + b'N' + tuple_data('x', 'login')) == []
+    truncate = b'T' + struct.pack('!Ib', 2, 0) + struct.pack('!II', 16400, 16402)
+    assert decode(change_stream, truncate) == [Truncate(['profiles', 'audit_log'])]
+    assert decode(change_stream, b'O' + struct.pack('!q', 5) + string('origin')) == []
@@ -0,0 +1,63 @@
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+from migration.snapshot import Snapshot, SnapshotWriter
+
+TYPES = {'id': 'uuid', 'name': 'text', 'price': 'numeric', 'created_at': 'timestamp with time zone'}
+
+
+def source_rows(count):
+    keys = sorted(uuid.UUID(int=n * 2 ** 120 + 1) for n in range(count))
+    return [{'_key': key, 'id': key, 'name': f"service {n}" if n % 7 else None, 'price': Decimal(n) / 4,
+             'created_at': datetime(2024, 1, 1 + n % 28, tzinfo=timezone.utc)}
+            for n, key in enumerate(keys)]
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    writer = SnapshotWriter(str(tmp_path), chunk_rows=10, level=1)
+    assert writer.write_table('services', TYPES, source_rows(95)) == 95
+    assert writer.write_table('bookings', {'id': 'uuid'}, []) == 0
+    writer.close()
+    return Snapshot(str(tmp_path))
+
+
+def without_key(rows):
+    return [{column: value for column, value in row.items() if column != '_key'} for row in rows]
+
+
+def test_round_trip(snapshot):
+    assert snapshot.types('services') == TYPES
+    assert snapshot.count('services') == 95
+    assert list(snapshot.rows('services')) == without_key(source_rows(95))
+    assert snapshot.count('bookings') == 0 and list(snapshot.rows('bookings')) == []
+
+
+def test_key_range_and_after(snapshot):
+    rows = source_rows(95)
+    keys = [str(row['_key']) for row in rows]
+
+    # A key range takes lo and excludes hi, even inside a chunk
+    assert list(snapshot.rows('services', (keys[15], keys[42]))) == without_key(rows[15:42])
+    assert list(snapshot.rows('services', (None, keys[5]))) == without_key(rows[:5])
+    assert list(snapshot.rows('services', (keys[90], None))) == without_key(rows[90:])
+    # Counts are of whole chunks overlapping the range
+    assert snapshot.count('services', (keys[15], keys[42])) == 40
+
+    # Resuming after a key skips it and everything before
+    assert list(snapshot.rows('services', after=keys[57])) == without_key(rows[58:])
+    assert list(snapshot.rows('services', (keys[15], keys[42]), after=keys[30])) == without_key(rows[31:42])
+    assert list(snapshot.rows('services', (keys[15], keys[42]), after=keys[3])) == without_key(rows[15:42])
+    assert snapshot.count('services', after=keys[57]) == 45
+
+
+def test_missing_table_and_manifest(snapshot, tmp_path):
+    with pytest.raises(ValueError):
+        snapshot.types('profiles')
+    with pytest.raises(ValueError):
+        list(snapshot.rows('profiles'))
+    with pytest.raises(ValueError):
+        Snapshot(str(tmp_path / 'services'))